@@ -0,0 +1,106 @@
+# barcodes.py
+# Códigos de barra (EAN-13 / EAN-8 / UPC-A / GTIN-14) de products.ean_ua.
+# El mismo código llega escrito de distintas formas: "7406112111048" desde el
+# escáner, "07406112111048" (GTIN-14 o UPC con cero), "7406112111048.0" (EAN leído
+# como número desde Excel) o sin el dígito verificador (escáner configurado para
+# no transmitirlo). Todos se comparan como GTIN-14: solo dígitos y ceros a la
+# izquierda hasta 14.
+#
+# Un mismo EAN puede estar en varios SKU (un código de proveedor para todas las
+# tallas o colores), por eso el índice de BD no es UNIQUE: la unicidad se resuelve
+# en el mapa en memoria, donde un EAN compartido queda con todos sus SKU.
+
+import re
+
+LARGO_MIN = 7       # EAN-8 sin verificador
+LARGO_GTIN = 14
+
+_DIGITOS_RE = re.compile(r'^\d+$')
+
+# Misma expresión en el índice y en la consulta, o SQLite no usa el índice
+EXPR_BARRA = "substr('00000000000000' || ean_ua, -14)"
+
+BARCODE_INDEX_SQL = f"""
+CREATE INDEX IF NOT EXISTS idx_products_barra ON products({EXPR_BARRA});
+"""
+
+
+def asegurar_indice(conn):
+    """Crea el índice de códigos de barra sobre products si no existe."""
+    conn.executescript(BARCODE_INDEX_SQL)
+    conn.commit()
+
+
+def limpiar_barra(texto):
+    """Solo los dígitos del código ('7406112111048.0' -> '7406112111048'), o None si no es un código de barras."""
+    if texto is None:
+        return None
+    texto = str(texto).strip()
+    if texto.endswith('.0'):
+        texto = texto[:-2]
+    if not _DIGITOS_RE.match(texto) or not LARGO_MIN <= len(texto) <= LARGO_GTIN:
+        return None
+    return texto
+
+
+def clave_barra(texto):
+    """Clave GTIN-14 de lo escaneado, o None si no es un código de barras."""
+    digitos = limpiar_barra(texto)
+    return None if digitos is None else digitos.zfill(LARGO_GTIN)
+
+
+def digito_verificador(cuerpo):
+    """Dígito verificador GS1 (módulo 10, pesos 3-1 desde la derecha)."""
+    suma = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(cuerpo)))
+    return str((10 - suma % 10) % 10)
+
+
+def claves_busqueda(texto):
+    """
+    Claves con que se busca lo escaneado en la BD: tal cual y, por si el escáner
+    omitió el verificador, con el verificador calculado al final.
+    """
+    digitos = limpiar_barra(texto)
+    if digitos is None:
+        return ()
+    claves = [digitos.zfill(LARGO_GTIN)]
+    if len(digitos) < LARGO_GTIN:
+        claves.append((digitos + digito_verificador(digitos)).zfill(LARGO_GTIN))
+    return tuple(claves)
+
+
+class MapaBarras(dict):
+    """clave GTIN-14 -> tupla de SKU con ese código de barras (más de uno = EAN compartido)."""
+
+    def __init__(self):
+        super().__init__()
+        self.sin_verificador = set()      # claves que son solo la variante sin verificador
+
+    def agregar(self, ean, codigo):
+        """
+        Registra el código completo y también el código sin verificador, salvo que
+        este choque con el código completo de otro producto (ese siempre gana).
+        Así cada lectura es una sola búsqueda en el mapa.
+        """
+        digitos = limpiar_barra(ean)
+        if digitos is None:
+            return
+        clave = digitos.zfill(LARGO_GTIN)
+        if clave in self.sin_verificador:
+            del self[clave]
+            self.sin_verificador.discard(clave)
+        skus = self.get(clave, ())
+        if codigo not in skus:
+            self[clave] = skus + (codigo,)
+
+        variante = digitos[:-1].zfill(LARGO_GTIN)
+        if variante not in self:
+            self[variante] = (codigo,)
+            self.sin_verificador.add(variante)
+        elif variante in self.sin_verificador and codigo not in self[variante]:
+            self[variante] += (codigo,)
+
+    def buscar(self, texto):
+        """SKU con ese código de barras (tupla vacía si no hay ninguno)."""
+        clave = clave_barra(texto)
+        return () if clave is None else self.get(clave, ())
@@ -0,0 +1,62 @@
+import sqlite3
+import threading
+
+# =========================
+# CONEXIONES SQLITE COMPARTIDAS
+# =========================
+# Todas las conexiones se abren en modo WAL: los lectores (informes, export SAP)
+# no bloquean a la caja que confirma una venta, ni al revés.
+# get_connection() reutiliza una conexión por hilo y por archivo, en vez de
+# abrir y cerrar una conexión nueva en cada consulta.
+
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),      # seguro con WAL; solo se pierde la última transacción ante un corte de luz
+    ("cache_size", "-16000"),       # ~16 MB de caché de páginas
+    ("mmap_size", "268435456"),     # 256 MB de lectura mapeada en memoria
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", "5000"),       # esperar hasta 5 s un lock en vez de fallar con "database is locked"
+)
+
+_local = threading.local()
+_todas = []
+_lock = threading.Lock()
+
+
+def configurar(conn):
+    for nombre, valor in PRAGMAS:
+        conn.execute(f"PRAGMA {nombre} = {valor}")
+    return conn
+
+
+def conectar(db_path, check_same_thread=True):
+    """Abre una conexión nueva ya configurada (para quien necesita una propia)."""
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    return configurar(conn)
+
+
+def get_connection(db_path):
+    """
+    Devuelve la conexión reutilizable del hilo actual para db_path.
+    No se debe cerrar: se cierra con cerrar_conexiones() al salir.
+    """
+    conexiones = getattr(_local, "conexiones", None)
+    if conexiones is None:
+        conexiones = _local.conexiones = {}
+    conn = conexiones.get(db_path)
+    if conn is None:
+        conn = conexiones[db_path] = conectar(db_path)
+        with _lock:
+            _todas.append(conn)
+    return conn
+
+
+def cerrar_conexiones():
+    with _lock:
+        for conn in _todas:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _todas.clear()
+    _local.conexiones = {}
@@ -0,0 +1,120 @@
+# db_worker.py
+# Ejecuta el trabajo de base de datos fuera del hilo de Tk.
+# Cada "carril" es un hilo propio con su cola: la caja (carrito, ventas,
+# devoluciones) no queda detrás de un informe o un export largo.
+# Los resultados vuelven a la UI por una cola que el hilo de Tk revisa con after().
+
+import queue
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+CARRIL_CAJA = 'caja'
+CARRIL_CONSULTAS = 'consultas'
+
+
+class DBWorker:
+    def __init__(self, root, carriles=(CARRIL_CAJA, CARRIL_CONSULTAS), on_busy=None, poll_ms=30):
+        """
+        - root: widget de Tk que agenda la revisión de resultados
+        - carriles: nombres de los hilos de trabajo (uno por carril, en orden FIFO)
+        - on_busy: callback(bool) en el hilo de Tk al empezar/terminar trabajo pendiente
+        - poll_ms: cada cuánto se revisan resultados mientras hay trabajo en curso
+        """
+        self.root = root
+        self.on_busy = on_busy
+        self.poll_ms = poll_ms
+        self._ejecutores = {
+            nombre: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'db-{nombre}')
+            for nombre in carriles
+        }
+        self._resultados = queue.SimpleQueue()
+        self._en_curso = 0
+        self._revisando = False
+        self._cerrado = False
+
+    def submit(self, carril, fn, *args, on_ok=None, on_error=None, **kwargs):
+        """
+        Encola fn(*args, **kwargs) en el carril indicado y devuelve el Future.
+        on_ok(resultado) / on_error(excepcion) se llaman en el hilo de Tk.
+        Debe llamarse desde el hilo de Tk.
+        """
+        if self._cerrado:
+            raise RuntimeError("DBWorker cerrado")
+        futuro = self._ejecutores[carril].submit(fn, *args, **kwargs)
+        self._en_curso += 1
+        # el callback corre en el hilo de trabajo: solo deja el resultado en la cola
+        futuro.add_done_callback(lambda f: self._resultados.put((f, on_ok, on_error)))
+        if not self._revisando:
+            self._revisando = True
+            if self.on_busy:
+                self.on_busy(True)
+            self.root.after(self.poll_ms, self._revisar)
+        return futuro
+
+    @property
+    def ocupado(self):
+        return self._en_curso > 0
+
+    @property
+    def cerrado(self):
+        return self._cerrado
+
+    def _vaciar_resultados(self):
+        while True:
+            try:
+                futuro, on_ok, on_error = self._resultados.get_nowait()
+            except queue.Empty:
+                break
+            self._en_curso -= 1
+            self._entregar(futuro, on_ok, on_error)
+
+    def _revisar(self):
+        self._vaciar_resultados()
+        if self._en_curso > 0 and not self._cerrado:
+            self.root.after(self.poll_ms, self._revisar)
+        else:
+            self._revisando = False
+            if self.on_busy:
+                self.on_busy(False)
+
+    def _entregar(self, futuro, on_ok, on_error):
+        if futuro.cancelled():
+            return
+        exc = futuro.exception()
+        try:
+            if exc is not None:
+                logging.error(f"Error en tarea de BD: {exc}", exc_info=exc)
+                if on_error:
+                    on_error(exc)
+            elif on_ok:
+                on_ok(futuro.result())
+        except Exception:
+            logging.exception("Error en callback de UI")
+
+    def close(self, wait=True):
+        """Deja de aceptar trabajo; con wait=True espera a que terminen las tareas en curso."""
+        self._cerrado = True
+        for ejecutor in self._ejecutores.values():
+            ejecutor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def cerrar(self, al_terminar, esperar=(CARRIL_CAJA,)):
+        """
+        Cierre sin bloquear el hilo de Tk: deja de aceptar trabajo, descarta lo que
+        aún no empezó en los demás carriles y revisa con after() hasta que los
+        carriles de `esperar` terminan lo ya encolado (una venta no queda a medias).
+        Entonces entrega los resultados pendientes y llama al_terminar() en el hilo de Tk.
+        Una tarea que ya corre en otro carril (un export) termina sola después.
+        """
+        self._cerrado = True
+        # cada carril es FIFO de un hilo: la marca termina después de todo lo encolado antes
+        marcas = [self._ejecutores[nombre].submit(lambda: None) for nombre in esperar]
+        for nombre, ejecutor in self._ejecutores.items():
+            ejecutor.shutdown(wait=False, cancel_futures=nombre not in esperar)
+        self._esperar_cierre(marcas, al_terminar)
+
+    def _esperar_cierre(self, marcas, al_terminar):
+        if not all(marca.done() for marca in marcas):
+            self.root.after(self.poll_ms, self._esperar_cierre, marcas, al_terminar)
+            return
+        self._vaciar_resultados()
+        al_terminar()
@@ -1,13 +1,24 @@
 # importer.py
 # Ejecutar: python importer.py
 # Importa productos desde Excel a la BD pos_full.db (idempotente)
+# Ejecutar: python importer.py --delta [--baja]
+# Solo inserta/actualiza los SKU que cambiaron; --baja desactiva los que ya no están en el Excel
 
 import os
+import sys
+import hashlib
+import argparse
 import sqlite3
 import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
 from datetime import datetime
 import logging
 
+import barcodes
+import product_search
+from db_connection import conectar
+
 BASE_DIR = r'D:\Proyectos\Cuesta Blaca Proyect Vers. 2.0'
 EXCEL_DIR = os.path.join(BASE_DIR, 'fuentes')
 EXCEL_FILENAME = 'INFORME CUESTA BLANCA().xlsx'
@@ -38,82 +49,272 @@ CREATE TABLE IF NOT EXISTS products (
     unidad_almacenamiento TEXT,
     ean_ua TEXT,
     stock_fisico INTEGER DEFAULT 0,
-    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    hash_fila TEXT,
+    activo INTEGER DEFAULT 1
 );
 """
 
+# Columnas agregadas después de la primera versión del esquema (BD ya existentes)
+PRODUCT_MIGRATIONS = {
+    'hash_fila': "ALTER TABLE products ADD COLUMN hash_fila TEXT",
+    'activo': "ALTER TABLE products ADD COLUMN activo INTEGER DEFAULT 1",
+}
+
 def init_db(conn):
     cur = conn.cursor()
     cur.executescript(SCHEMA_SQL)
+    cur.execute("PRAGMA table_info(products)")
+    existentes = {r[1] for r in cur.fetchall()}
+    for col, ddl in PRODUCT_MIGRATIONS.items():
+        if col not in existentes:
+            cur.execute(ddl)
     conn.commit()
+    product_search.asegurar_indice(conn)
+    barcodes.asegurar_indice(conn)
 
-def import_products(conn, excel_path):
+COLUMN_MAP = {
+    'Familia':'familia',
+    'Código':'codigo',
+    'Descripción':'descripcion',
+    'Categoria':'categoria',
+    'Modelo':'modelo',
+    'Color':'color',
+    'Talla':'talla',
+    'Unidad de Medida':'unidad_medida',
+    'Bodega':'bodega',
+    'Ubicación':'ubicacion',
+    'Unidad de Almacenamiento':'unidad_almacenamiento',
+    'EAN UA':'ean_ua',
+    'Stock Físico':'stock_fisico'
+}
+
+PRODUCT_COLUMNS = ['familia', 'codigo', 'descripcion', 'categoria', 'modelo', 'color', 'talla',
+                   'unidad_medida', 'bodega', 'ubicacion', 'unidad_almacenamiento', 'ean_ua', 'stock_fisico']
+
+# Tabla temporal de la importación incremental: una fila por SKU (la última del Excel)
+STAGING_SQL = """
+CREATE TEMP TABLE import_staging (
+    familia TEXT,
+    codigo TEXT PRIMARY KEY,
+    descripcion TEXT,
+    categoria TEXT,
+    modelo TEXT,
+    color TEXT,
+    talla TEXT,
+    unidad_medida TEXT,
+    bodega TEXT,
+    ubicacion TEXT,
+    unidad_almacenamiento TEXT,
+    ean_ua TEXT,
+    stock_fisico INTEGER,
+    hash_fila TEXT
+)
+"""
+
+# Filas del Excel que se preparan y escriben juntas
+CHUNK_SIZE = 5000
+
+# Celdas con error de fórmula: openpyxl las entrega como texto ('#VALUE!', '#N/A'...);
+# se importan vacías, como cuando se leía con pd.read_excel
+ERRORES_EXCEL = frozenset(ERROR_CODES)
+
+# Pragmas solo para la carga masiva: el archivo Excel es la fuente, así que
+# ante un corte basta con reimportar.
+BULK_PRAGMAS = {
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': '-65536',
+}
+
+def preparar_productos(df):
+    """
+    Limpieza vectorizada del DataFrame leído del Excel: renombra columnas,
+    descarta filas sin código, deja el EAN solo con sus dígitos y convierte el
+    stock a entero (0 si no es numérico).
+    """
+    df = df.rename(columns=COLUMN_MAP)
+    for col in PRODUCT_COLUMNS:
+        if col not in df.columns:
+            df[col] = ''
+    df = df[PRODUCT_COLUMNS].fillna('')
+    df['codigo'] = df['codigo'].astype(str).str.strip()
+    df = df[df['codigo'] != '']
+    # EAN guardado como número en el Excel: '7406112111048.0' -> '7406112111048'
+    df['ean_ua'] = df['ean_ua'].astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    stock = pd.to_numeric(df['stock_fisico'].astype(str).str.replace(',', '', regex=False), errors='coerce')
+    df['stock_fisico'] = stock.fillna(0).astype('int64')
+    return df
+
+def hash_fila(fila):
+    """Hash estable de los valores de origen de un producto (detecta cambios entre importaciones)."""
+    return hashlib.sha1('\x1f'.join(str(v) for v in fila).encode('utf-8')).hexdigest()
+
+def _filas_producto(df):
+    # tolist() entrega tipos nativos de Python (sqlite3 no acepta numpy.int64)
+    return list(zip(*[df[col].tolist() for col in PRODUCT_COLUMNS]))
+
+def leer_excel_por_bloques(excel_path, tam_bloque=CHUNK_SIZE):
+    """
+    Recorre la primera hoja fila a fila (openpyxl read_only) y entrega DataFrames
+    de hasta tam_bloque filas con todos los valores como texto (igual que dtype=str).
+    La memoria usada no depende del tamaño del libro.
+    """
+    wb = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        filas = wb.worksheets[0].iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        encabezado = [str(c).strip() if c is not None else '' for c in encabezado]
+        ancho = len(encabezado)
+        bloque = []
+        for fila in filas:
+            if fila is None or all(v is None for v in fila):
+                continue
+            fila = tuple(None if v is None or v in ERRORES_EXCEL else str(v)
+                         for v in fila[:ancho]) + (None,) * (ancho - len(fila))
+            bloque.append(fila)
+            if len(bloque) >= tam_bloque:
+                yield pd.DataFrame.from_records(bloque, columns=encabezado)
+                bloque = []
+        if bloque:
+            yield pd.DataFrame.from_records(bloque, columns=encabezado)
+    finally:
+        wb.close()
+
+def _bloques_productos(excel_path):
     if not os.path.exists(excel_path):
         logging.error(f"Excel no encontrado: {excel_path}")
         raise FileNotFoundError(excel_path)
+    for df in leer_excel_por_bloques(excel_path):
+        yield _filas_producto(preparar_productos(df))
 
-    df = pd.read_excel(excel_path, sheet_name=0, dtype=str)
-    df = df.rename(columns={
-        'Familia':'familia',
-        'Código':'codigo',
-        'Descripción':'descripcion',
-        'Categoria':'categoria',
-        'Modelo':'modelo',
-        'Color':'color',
-        'Talla':'talla',
-        'Unidad de Medida':'unidad_medida',
-        'Bodega':'bodega',
-        'Ubicación':'ubicacion',
-        'Unidad de Almacenamiento':'unidad_almacenamiento',
-        'EAN UA':'ean_ua',
-        'Stock Físico':'stock_fisico'
-    })
-    df = df.fillna('')
+def _aplicar_pragmas(conn, pragmas):
+    anteriores = {}
+    for nombre, valor in pragmas.items():
+        anteriores[nombre] = conn.execute(f"PRAGMA {nombre}").fetchone()[0]
+        conn.execute(f"PRAGMA {nombre} = {valor}")
+    return anteriores
 
-    cur = conn.cursor()
+def import_products(conn, excel_path):
+    if not os.path.exists(excel_path):
+        logging.error(f"Excel no encontrado: {excel_path}")
+        raise FileNotFoundError(excel_path)
+    created_at = datetime.now().isoformat()
     inserted = 0
-    for _, row in df.iterrows():
-        codigo = str(row.get('codigo','')).strip()
-        if not codigo:
-            continue
-        sf = row.get('stock_fisico','')
-        try:
-            stock_val = int(float(str(sf).replace(',',''))) if sf not in ('', None) else 0
-        except:
-            stock_val = 0
-
-        cur.execute("""
-            INSERT OR REPLACE INTO products
-            (familia, codigo, descripcion, categoria, modelo, color, talla, unidad_medida, bodega, ubicacion, unidad_almacenamiento, ean_ua, stock_fisico, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            row.get('familia',''),
-            codigo,
-            row.get('descripcion',''),
-            row.get('categoria',''),
-            row.get('modelo',''),
-            row.get('color',''),
-            row.get('talla',''),
-            row.get('unidad_medida',''),
-            row.get('bodega',''),
-            row.get('ubicacion',''),
-            row.get('unidad_almacenamiento',''),
-            row.get('ean_ua',''),
-            stock_val,
-            datetime.now().isoformat()
-        ))
-        inserted += 1
 
-    conn.commit()
+    cur = conn.cursor()
+    # Los triggers FTS no ven los borrados implícitos de INSERT OR REPLACE:
+    # se desactivan durante la carga y el índice se reconstruye al final.
+    cur.executescript(product_search.FTS_DROP_TRIGGERS_SQL)
+    anteriores = _aplicar_pragmas(conn, BULK_PRAGMAS)
+    try:
+        cur.execute('BEGIN')
+        # cada bloque se escribe apenas se lee, sin esperar el resto del libro
+        for filas in _bloques_productos(excel_path):
+            cur.executemany("""
+                INSERT OR REPLACE INTO products
+                (familia, codigo, descripcion, categoria, modelo, color, talla, unidad_medida, bodega, ubicacion, unidad_almacenamiento, ean_ua, stock_fisico, created_at, hash_fila, activo)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            """, [f + (created_at, hash_fila(f)) for f in filas])
+            inserted += len(filas)
+        product_search.reconstruir_indice(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.executescript(product_search.FTS_TRIGGERS_SQL)
+        _aplicar_pragmas(conn, anteriores)
+
     logging.info(f"Importación completada. Filas procesadas: {inserted}")
     return inserted
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
+def import_products_delta(conn, excel_path, desactivar_faltantes=False):
+    """
+    Importación incremental: compara el hash de cada fila del Excel con el guardado
+    en products y solo escribe los SKU nuevos o modificados (UPDATE en sitio, sin
+    cambiar products.id). Con desactivar_faltantes=True marca activo=0 los SKU que
+    ya no vienen en el Excel.
+    Las filas pasan primero por una tabla temporal con INSERT OR REPLACE: un SKU
+    repetido en el Excel vale por su última fila, igual que en import_products.
+    Devuelve un dict con los conteos insertados/actualizados/sin_cambios/desactivados.
+    """
+    cur = conn.cursor()
+    created_at = datetime.now().isoformat()
+    columnas = ", ".join(PRODUCT_COLUMNS)
+    asignaciones = ", ".join(f"{c} = s.{c}" for c in PRODUCT_COLUMNS if c != 'codigo')
+    desactivados = 0
+    try:
+        cur.execute('BEGIN')
+        cur.execute("DROP TABLE IF EXISTS temp.import_staging")
+        cur.execute(STAGING_SQL)
+        for filas in _bloques_productos(excel_path):
+            cur.executemany(f"""
+                INSERT OR REPLACE INTO import_staging ({columnas}, hash_fila)
+                VALUES ({", ".join("?" * (len(PRODUCT_COLUMNS) + 1))})
+            """, [f + (hash_fila(f),) for f in filas])
+
+        insertados = cur.execute("""
+            SELECT COUNT(*) FROM import_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.codigo = s.codigo)
+        """).fetchone()[0]
+        actualizados, sin_cambios = cur.execute("""
+            SELECT COALESCE(SUM(p.hash_fila IS NOT s.hash_fila OR p.activo IS 0), 0),
+                   COALESCE(SUM(p.hash_fila IS s.hash_fila AND p.activo IS NOT 0), 0)
+            FROM import_staging s JOIN products p ON p.codigo = s.codigo
+        """).fetchone()
+
+        cur.execute(f"""
+            UPDATE products AS p SET {asignaciones}, hash_fila = s.hash_fila, activo = 1
+            FROM import_staging s
+            WHERE p.codigo = s.codigo AND (p.hash_fila IS NOT s.hash_fila OR p.activo IS 0)
+        """)
+        cur.execute(f"""
+            INSERT INTO products ({columnas}, created_at, hash_fila, activo)
+            SELECT {columnas}, ?, hash_fila, 1 FROM import_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.codigo = s.codigo)
+        """, (created_at,))
+
+        if desactivar_faltantes:
+            cur.execute("""
+                UPDATE products SET activo = 0
+                WHERE activo IS NOT 0 AND codigo NOT IN (SELECT codigo FROM import_staging)
+            """)
+            desactivados = cur.rowcount
+        cur.execute("DROP TABLE temp.import_staging")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    resumen = {
+        'insertados': insertados,
+        'actualizados': actualizados,
+        'sin_cambios': sin_cambios,
+        'desactivados': desactivados,
+    }
+    logging.info(f"Importación incremental completada: {resumen}")
+    return resumen
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa productos desde el Excel a pos_full.db")
+    parser.add_argument('--delta', action='store_true', help="solo escribe SKU nuevos o modificados")
+    parser.add_argument('--baja', action='store_true', help="con --delta, desactiva SKU ausentes en el Excel")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    conn = conectar(DB_PATH)
     init_db(conn)
     try:
-        n = import_products(conn, EXCEL_PATH)
-        print(f"Importación finalizada. Filas: {n}")
+        if args.delta:
+            r = import_products_delta(conn, EXCEL_PATH, desactivar_faltantes=args.baja)
+            print(f"Importación incremental finalizada. Insertados: {r['insertados']}, "
+                  f"actualizados: {r['actualizados']}, sin cambios: {r['sin_cambios']}, "
+                  f"desactivados: {r['desactivados']}")
+        else:
+            n = import_products(conn, EXCEL_PATH)
+            print(f"Importación finalizada. Filas: {n}")
     except Exception as e:
         logging.exception("Error en importación")
         print("Error en importación:", e)
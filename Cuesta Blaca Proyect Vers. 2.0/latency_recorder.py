@@ -0,0 +1,125 @@
+# latency_recorder.py
+# Registro de latencias en memoria con volcado a CSV en segundo plano.
+# Las operaciones instrumentadas solo agregan a un buffer; un hilo aparte
+# escribe los lotes a disco cada cierto intervalo o al llenarse el lote.
+
+import os
+import csv
+import math
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+CSV_HEADER = ['timestamp', 'operation', 'duration_ms']
+
+
+def _percentil(valores_ordenados, p):
+    # método nearest-rank sobre una lista ya ordenada
+    if not valores_ordenados:
+        return None
+    k = max(0, min(len(valores_ordenados), math.ceil(p / 100.0 * len(valores_ordenados))) - 1)
+    return valores_ordenados[k]
+
+
+class LatencyRecorder:
+    def __init__(self, csv_path, flush_interval=2.0, flush_size=500,
+                 max_pendientes=20000, max_muestras=5000):
+        """
+        - flush_interval: segundos máximos entre volcados a disco
+        - flush_size: filas pendientes que fuerzan un volcado anticipado
+        - max_pendientes: tamaño del ring buffer de filas sin escribir (se descartan las más antiguas)
+        - max_muestras: muestras recientes por operación usadas para p50/p95/p99
+        """
+        self.csv_path = csv_path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_muestras = max_muestras
+        self._pendientes = deque(maxlen=max_pendientes)
+        self._muestras = {}
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        atexit.register(self.close)
+
+    # -------------------------
+    # API de registro
+    # -------------------------
+    def record(self, operation, duration_s):
+        ms = round(duration_s * 1000, 2)
+        fila = (datetime.now().isoformat(), operation, ms)
+        with self._lock:
+            self._pendientes.append(fila)
+            muestras = self._muestras.get(operation)
+            if muestras is None:
+                muestras = self._muestras[operation] = deque(maxlen=self.max_muestras)
+            muestras.append(ms)
+            pendientes = len(self._pendientes)
+        if self._hilo is None:
+            self._iniciar_hilo()
+        if pendientes >= self.flush_size:
+            self._despertar.set()
+
+    def percentiles(self, operation=None):
+        """
+        Devuelve {operacion: {'count', 'p50', 'p95', 'p99'}} en milisegundos,
+        calculado sobre las muestras recientes en memoria.
+        """
+        with self._lock:
+            if operation is not None:
+                datos = {operation: list(self._muestras.get(operation, ()))}
+            else:
+                datos = {op: list(m) for op, m in self._muestras.items()}
+        resultado = {}
+        for op, valores in datos.items():
+            valores.sort()
+            resultado[op] = {
+                'count': len(valores),
+                'p50': _percentil(valores, 50),
+                'p95': _percentil(valores, 95),
+                'p99': _percentil(valores, 99),
+            }
+        return resultado
+
+    # -------------------------
+    # Volcado a disco
+    # -------------------------
+    def flush(self):
+        with self._lock:
+            if not self._pendientes:
+                return 0
+            filas = list(self._pendientes)
+            self._pendientes.clear()
+        try:
+            nuevo = not os.path.exists(self.csv_path)
+            with open(self.csv_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if nuevo:
+                    writer.writerow(CSV_HEADER)
+                writer.writerows(filas)
+        except OSError:
+            logging.exception(f"No se pudo escribir métricas de latencia en {self.csv_path}")
+            return 0
+        return len(filas)
+
+    def _iniciar_hilo(self):
+        with self._lock:
+            if self._hilo is not None or self._detener.is_set():
+                return
+            self._hilo = threading.Thread(target=self._bucle, name='latency-flusher', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._despertar.wait(self.flush_interval)
+            self._despertar.clear()
+            self.flush()
+
+    def close(self):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+        self.flush()
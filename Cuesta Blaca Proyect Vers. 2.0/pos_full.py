@@ -1,12 +1,19 @@
 import os
-import csv
 import sqlite3
 import logging
 import time
-from datetime import datetime
+import itertools
+from datetime import datetime, date
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 
+from db_connection import conectar, get_connection
+from db_worker import DBWorker, CARRIL_CAJA, CARRIL_CONSULTAS
+from latency_recorder import LatencyRecorder
+import barcodes
+import product_search
+import sap_ledger
+
 # -------------------------
 # RUTAS Y DIRECTORIOS
 # -------------------------
@@ -20,6 +27,9 @@ DB_PATH = os.path.join(DB_DIR, 'pos_full.db')
 LOG_PATH = os.path.join(LOGS_DIR, 'pos_full.log')
 LATENCY_CSV = os.path.join(LOGS_DIR, 'latency_metrics.csv')
 
+# Export SAP incremental en segundo plano (solo ventas nuevas, ver sap_ledger)
+EXPORT_INTERVAL_MS = 5 * 60 * 1000
+
 for d in (BASE_DIR, DB_DIR, REPORTS_DIR, EXPORTS_DIR, LOGS_DIR):
     os.makedirs(d, exist_ok=True)
 
@@ -30,17 +40,11 @@ logging.basicConfig(filename=LOG_PATH, level=logging.INFO,
                     format='%(asctime)s %(levelname)s %(message)s')
 logging.info("POS_FULL iniciado (sin importación automática)")
 
-# Ensure latency CSV header
-if not os.path.exists(LATENCY_CSV):
-    with open(LATENCY_CSV, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['timestamp','operation','duration_ms'])
+# Métricas de latencia: se acumulan en memoria y un hilo las vuelca al CSV por lotes
+latency = LatencyRecorder(LATENCY_CSV)
 
 def log_latency(operation, duration_s):
-    ms = round(duration_s * 1000, 2)
-    with open(LATENCY_CSV, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow([datetime.now().isoformat(), operation, ms])
+    latency.record(operation, duration_s)
 
 # -------------------------
 # DB: esquema (crea tablas mínimas si no existen)
@@ -61,7 +65,9 @@ CREATE TABLE IF NOT EXISTS products (
     unidad_almacenamiento TEXT,
     ean_ua TEXT,
     stock_fisico INTEGER DEFAULT 0,
-    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    hash_fila TEXT,
+    activo INTEGER DEFAULT 1
 );
 
 CREATE TABLE IF NOT EXISTS price_list (
@@ -75,6 +81,7 @@ CREATE TABLE IF NOT EXISTS price_list (
 CREATE TABLE IF NOT EXISTS sales (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     fecha TEXT,
+    ts INTEGER,
     total REAL,
     forma_pago TEXT,
     estado TEXT DEFAULT 'cerrada'
@@ -98,51 +105,237 @@ CREATE TABLE IF NOT EXISTS returns (
     cantidad INTEGER,
     monto REAL,
     motivo TEXT,
-    fecha TEXT DEFAULT CURRENT_TIMESTAMP
+    fecha TEXT DEFAULT CURRENT_TIMESTAMP,
+    ts INTEGER
+);
+"""
+
+# ts = segundos epoch de fecha (hora local). Las consultas por rango de días filtran
+# sobre ts (ts >= inicio AND ts < fin) en vez de date(fecha), que no usa índices.
+INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_sales_ts ON sales(ts);
+CREATE INDEX IF NOT EXISTS idx_sale_lines_sale ON sale_lines(sale_id, producto_codigo);
+CREATE INDEX IF NOT EXISTS idx_sale_lines_producto ON sale_lines(producto_codigo);
+CREATE INDEX IF NOT EXISTS idx_returns_sale ON returns(sale_id, producto_codigo);
+CREATE INDEX IF NOT EXISTS idx_returns_ts ON returns(ts);
+"""
+
+# Columnas agregadas después de la primera versión del esquema (BD ya existentes)
+MIGRATIONS = {
+    'products': {
+        'hash_fila': "ALTER TABLE products ADD COLUMN hash_fila TEXT",
+        'activo': "ALTER TABLE products ADD COLUMN activo INTEGER DEFAULT 1",
+    },
+    'sales': {
+        'ts': "ALTER TABLE sales ADD COLUMN ts INTEGER",
+    },
+    'returns': {
+        'ts': "ALTER TABLE returns ADD COLUMN ts INTEGER",
+    },
+}
+
+# Relleno de columnas recién agregadas a partir de los datos existentes
+# ('utc' convierte la fecha local guardada a epoch, igual que datetime.timestamp()).
+# En returns, las filas sin fecha explícita tomaron el DEFAULT CURRENT_TIMESTAMP,
+# que ya está en UTC ('YYYY-MM-DD HH:MM:SS', sin la 'T' de isoformat()):
+# esas se convierten sin 'utc'.
+MIGRATION_BACKFILLS = {
+    ('sales', 'ts'): "UPDATE sales SET ts = CAST(strftime('%s', fecha, 'utc') AS INTEGER) WHERE ts IS NULL",
+    ('returns', 'ts'): """
+        UPDATE returns SET ts = CAST(CASE WHEN instr(fecha, 'T') = 0 THEN strftime('%s', fecha)
+                                          ELSE strftime('%s', fecha, 'utc') END AS INTEGER)
+        WHERE ts IS NULL
+    """,
+}
+
+def migrate_db(conn):
+    cur = conn.cursor()
+    for tabla, columnas in MIGRATIONS.items():
+        cur.execute(f"PRAGMA table_info({tabla})")
+        existentes = {r[1] for r in cur.fetchall()}
+        for col, ddl in columnas.items():
+            if col not in existentes:
+                cur.execute(ddl)
+                backfill = MIGRATION_BACKFILLS.get((tabla, col))
+                if backfill:
+                    cur.execute(backfill)
+                logging.info(f"Migración: {tabla}.{col} agregada")
+    conn.commit()
+
+# Resumen diario: una fila por día y forma de pago, mantenida por finalize_sale
+# y devolver_articulo dentro de la misma transacción. El cierre de caja lee
+# esta tabla en vez de recorrer todo el historial de sales/returns.
+DAILY_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS daily_sales (
+    dia TEXT NOT NULL,
+    forma_pago TEXT NOT NULL,
+    ventas INTEGER NOT NULL DEFAULT 0,
+    total_ventas REAL NOT NULL DEFAULT 0,
+    devoluciones REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, forma_pago)
 );
 """
 
+UPSERT_DAILY_VENTA = """
+INSERT INTO daily_sales (dia, forma_pago, ventas, total_ventas) VALUES (?, ?, 1, ?)
+ON CONFLICT(dia, forma_pago) DO UPDATE SET
+    ventas = ventas + 1, total_ventas = total_ventas + excluded.total_ventas
+"""
+
+UPSERT_DAILY_DEVOLUCION = """
+INSERT INTO daily_sales (dia, forma_pago, devoluciones) VALUES (?, ?, ?)
+ON CONFLICT(dia, forma_pago) DO UPDATE SET
+    devoluciones = devoluciones + excluded.devoluciones
+"""
+
+def asegurar_resumen_diario(conn):
+    """
+    Crea daily_sales si no existe y, en ese caso, la completa desde el historial
+    (las fechas se guardan en hora local, por eso el día es substr(fecha, 1, 10);
+    las devoluciones con fecha CURRENT_TIMESTAMP, en UTC, se pasan a hora local).
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_sales'")
+    if cur.fetchone():
+        return
+    cur.executescript(DAILY_SCHEMA_SQL)
+    cur.execute("""
+        INSERT INTO daily_sales (dia, forma_pago, ventas, total_ventas)
+        SELECT substr(fecha, 1, 10), COALESCE(forma_pago, ''), COUNT(*), COALESCE(SUM(total), 0)
+        FROM sales GROUP BY 1, 2
+    """)
+    cur.execute("""
+        INSERT INTO daily_sales (dia, forma_pago, devoluciones)
+        SELECT CASE WHEN instr(r.fecha, 'T') = 0 THEN date(r.fecha, 'localtime')
+                    ELSE substr(r.fecha, 1, 10) END,
+               COALESCE(s.forma_pago, ''), COALESCE(SUM(r.monto), 0)
+        FROM returns r LEFT JOIN sales s ON s.id = r.sale_id
+        WHERE 1  -- evita que SQLite lea ON CONFLICT como parte del JOIN
+        GROUP BY 1, 2
+        ON CONFLICT(dia, forma_pago) DO UPDATE SET devoluciones = excluded.devoluciones
+    """)
+    conn.commit()
+    logging.info("Resumen diario daily_sales creado desde el historial")
+
 def init_db(db_path=DB_PATH):
-    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn = conectar(db_path, check_same_thread=False)
     cur = conn.cursor()
     cur.executescript(SCHEMA_SQL)
     conn.commit()
+    migrate_db(conn)
+    cur.executescript(INDEXES_SQL)
+    asegurar_resumen_diario(conn)
+    product_search.asegurar_indice(conn)
+    barcodes.asegurar_indice(conn)
     return conn
 
 # -------------------------
 # POS: lógica principal
 # -------------------------
+PRODUCT_KEYS = ['familia','codigo','descripcion','categoria','modelo','color','talla','unidad_medida','bodega','ubicacion','unidad_almacenamiento','ean_ua','stock_fisico']
+PRODUCT_COLS = ",".join(PRODUCT_KEYS)
+
 class POS:
     def __init__(self, db_path=DB_PATH):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.db_path = db_path
+        self.conn = conectar(db_path, check_same_thread=False)
         self.cur = self.conn.cursor()
         self.cart = []
+        # id estable por línea: la UI identifica filas por line_id, no por posición en el carrito
+        self._line_ids = itertools.count(1)
         self.monto_inicial = 0
+        # Caché de catálogo: codigo -> columnas de products + precio_categoria
+        self._catalogo = {}
+        # Códigos de barra del catálogo: clave GTIN-14 -> SKU (ver barcodes.py)
+        self._barras = barcodes.MapaBarras()
+        # Caché de precios: categoria -> precio (None si la categoría no tiene precio)
+        self._precios = {}
+        self.cargar_catalogo()
+
+    # Caché de catálogo
+    def cargar_catalogo(self):
+        """
+        Precarga products y price_list en memoria con una sola consulta por tabla.
+        Se llama al iniciar y puede volver a llamarse tras reimportar el Excel.
+        """
+        t0 = time.perf_counter()
+        self.cur.execute("SELECT categoria, precio FROM price_list")
+        self._precios = {cat: float(precio) for cat, precio in self.cur.fetchall() if precio is not None}
+        self.cur.execute(f"SELECT {PRODUCT_COLS} FROM products WHERE activo = 1")
+        self._catalogo = {}
+        self._barras = barcodes.MapaBarras()
+        for row in self.cur.fetchall():
+            self._cachear_producto(row)
+        log_latency('cargar_catalogo', time.perf_counter() - t0)
+        logging.info(f"Catálogo en memoria: {len(self._catalogo)} productos, {len(self._precios)} categorías con precio")
+
+    def _cachear_producto(self, row):
+        prod = dict(zip(PRODUCT_KEYS, row))
+        prod['precio_categoria'] = self._precios.get(prod['categoria'])
+        self._catalogo[prod['codigo']] = prod
+        self._barras.agregar(prod['ean_ua'], prod['codigo'])
+        return prod
+
+    def _actualizar_stock_cache(self, codigo, stock):
+        prod = self._catalogo.get(codigo)
+        if prod is not None:
+            prod['stock_fisico'] = stock
 
     # Productos / precios / stock
+    def resolver_codigo(self, codigo):
+        """
+        SKU de lo escaneado o tipeado, sea código interno o código de barras.
+        Devuelve una tupla: vacía si no existe, con un SKU, o con varios si el
+        código de barras está compartido entre productos.
+        """
+        codigo = str(codigo).strip()
+        if codigo in self._catalogo:
+            return (codigo,)
+        skus = self._barras.buscar(codigo)
+        if skus:
+            return skus
+
+        # no está en memoria (p.ej. importado después de iniciar): una consulta por código o EAN
+        claves = barcodes.claves_busqueda(codigo) or ('',)
+        self.cur.execute(f"""
+            SELECT {PRODUCT_COLS} FROM products
+            WHERE activo = 1 AND (codigo = ? OR {barcodes.EXPR_BARRA} IN ({','.join('?' * len(claves))}))
+        """, (codigo, *claves))
+        prods = [self._cachear_producto(row) for row in self.cur.fetchall()]
+        exactos = [p['codigo'] for p in prods if p['codigo'] == codigo]
+        return tuple(exactos or [p['codigo'] for p in prods])
+
     def get_product(self, codigo):
+        """Producto por código interno o código de barras; None si no existe o el código de barras es compartido."""
         t0 = time.perf_counter()
-        self.cur.execute("SELECT familia,codigo,descripcion,categoria,modelo,color,talla,unidad_medida,bodega,ubicacion,unidad_almacenamiento,ean_ua,stock_fisico FROM products WHERE codigo = ?", (codigo,))
-        row = self.cur.fetchone()
+        skus = self.resolver_codigo(codigo)
+        prod = self._catalogo.get(skus[0]) if len(skus) == 1 else None
         duration = time.perf_counter() - t0
         log_latency('get_product', duration)
-        if not row:
+        if not prod:
             return None
-        keys = ['familia','codigo','descripcion','categoria','modelo','color','talla','unidad_medida','bodega','ubicacion','unidad_almacenamiento','ean_ua','stock_fisico']
-        return dict(zip(keys, row))
+        return dict(prod)
 
     def get_stock(self, codigo):
+        prod = self._catalogo.get(codigo)
+        if prod is not None:
+            return int(prod['stock_fisico']) if prod['stock_fisico'] is not None else 0
         self.cur.execute("SELECT stock_fisico FROM products WHERE codigo = ?", (codigo,))
         r = self.cur.fetchone()
         return int(r[0]) if r and r[0] is not None else 0
 
     def get_price_by_category(self, categoria):
         t0 = time.perf_counter()
-        self.cur.execute("SELECT precio FROM price_list WHERE categoria = ?", (categoria,))
-        r = self.cur.fetchone()
+        if categoria in self._precios:
+            precio = self._precios[categoria]
+        else:
+            self.cur.execute("SELECT precio FROM price_list WHERE categoria = ?", (categoria,))
+            r = self.cur.fetchone()
+            precio = float(r[0]) if r and r[0] is not None else None
+            self._precios[categoria] = precio
         duration = time.perf_counter() - t0
         log_latency('get_price_by_category', duration)
-        return float(r[0]) if r else None
+        return precio
 
     def set_price_for_category(self, categoria, precio):
         self.cur.execute("""
@@ -150,6 +343,11 @@ class POS:
             ON CONFLICT(categoria) DO UPDATE SET precio=excluded.precio, updated_at=CURRENT_TIMESTAMP
         """, (categoria, float(precio)))
         self.conn.commit()
+        # mantener coherente la caché tras confirmar la escritura
+        self._precios[categoria] = float(precio)
+        for prod in self._catalogo.values():
+            if prod['categoria'] == categoria:
+                prod['precio_categoria'] = float(precio)
         logging.info(f"Precio actualizado: {categoria} -> {precio}")
 
     # Carrito
@@ -161,9 +359,15 @@ class POS:
          - (None, {"need_price": True, "producto": prod}) -> falta precio por categoría
          - (False, "mensaje") -> error (producto no existe o stock insuficiente)
         """
-        prod = self.get_product(codigo)
+        skus = self.resolver_codigo(codigo)
+        if len(skus) > 1:
+            return False, (f"El código de barras {codigo} corresponde a {len(skus)} productos.\n"
+                           "Ingrese el código interno del producto.")
+        prod = self.get_product(skus[0]) if skus else None
         if not prod:
             return False, "Producto no encontrado"
+        # desde aquí el carrito guarda el SKU aunque se haya escaneado el EAN
+        codigo = prod['codigo']
 
         stock_actual = self.get_stock(codigo)
         if cantidad > stock_actual:
@@ -176,6 +380,7 @@ class POS:
             precio = precio_manual
             subtotal = cantidad * float(precio)
             line = {
+                "line_id": next(self._line_ids),
                 "producto_codigo": codigo,
                 "descripcion": prod['descripcion'],
                 "cantidad": cantidad,
@@ -193,6 +398,12 @@ class POS:
         # Si no hay precio por categoría y no se pasó precio manual
         return None, {"need_price": True, "producto": prod}
 
+    def indice_linea(self, line_id):
+        for i, l in enumerate(self.cart):
+            if l['line_id'] == line_id:
+                return i
+        return None
+
     def edit_line_price(self, index, nuevo_precio):
         if index < 0 or index >= len(self.cart):
             return False
@@ -201,45 +412,66 @@ class POS:
         logging.info(f"Precio línea {index} editado a {nuevo_precio}")
         return True
 
-    def finalize_sale(self, forma_pago='efectivo'):
+    def finalize_sale(self, forma_pago='efectivo', lineas=None):
         """
-        Ejecuta la venta en una transacción: verifica stock línea por línea antes de confirmar.
+        Ejecuta la venta en una transacción con un número fijo de sentencias:
+        una consulta de stock para todo el carrito, un INSERT de venta, un
+        executemany de líneas y un executemany de descuentos de stock.
+        El descuento es condicional (stock_fisico >= cantidad), así que no se
+        puede sobrevender aunque otra caja haya vendido entre la consulta y el UPDATE.
         Si algún item no tiene stock suficiente, hace rollback y devuelve error.
+        - lineas: copia del carrito tomada por quien llama (la UI, desde su hilo);
+          se registra esa copia y el carrito no se toca. Sin lineas se vende el
+          carrito actual y se vacía al confirmar.
         """
-        if not self.cart:
+        vaciar = lineas is None
+        if vaciar:
+            lineas = tuple(dict(l) for l in self.cart)
+        if not lineas:
             return False, "Carrito vacío"
 
+        # cantidades agregadas por SKU (un mismo código puede estar en varias líneas)
+        pedidos = {}
+        for l in lineas:
+            pedidos[l['producto_codigo']] = pedidos.get(l['producto_codigo'], 0) + int(l['cantidad'])
+        total = sum(l['subtotal'] for l in lineas)
+
         try:
-            # iniciar transacción
-            self.conn.execute('BEGIN')
-            total = 0
-            for l in self.cart:
-                codigo = l['producto_codigo']
-                cantidad = int(l['cantidad'])
-                # verificar stock actual
-                self.cur.execute("SELECT stock_fisico FROM products WHERE codigo = ?", (codigo,))
-                row = self.cur.fetchone()
-                stock_actual = int(row[0]) if row and row[0] is not None else 0
-                if cantidad > stock_actual:
+            # iniciar transacción (IMMEDIATE: toma el lock de escritura antes de leer el stock)
+            self.conn.execute('BEGIN IMMEDIATE')
+            placeholders = ",".join("?" * len(pedidos))
+            self.cur.execute(f"SELECT codigo, stock_fisico FROM products WHERE codigo IN ({placeholders})", list(pedidos))
+            stock_actual = {codigo: int(stock or 0) for codigo, stock in self.cur.fetchall()}
+            for codigo, cantidad in pedidos.items():
+                disponible = stock_actual.get(codigo, 0)
+                if cantidad > disponible:
                     self.conn.execute('ROLLBACK')
-                    return False, f"Stock insuficiente para {codigo}. Disponible: {stock_actual}"
-                total += l['subtotal']
+                    return False, f"Stock insuficiente para {codigo}. Disponible: {disponible}"
 
             # insertar venta y líneas
-            fecha = datetime.now().isoformat()
-            self.cur.execute("INSERT INTO sales (fecha, total, forma_pago) VALUES (?, ?, ?)", (fecha, total, forma_pago))
+            ahora = datetime.now()
+            fecha = ahora.isoformat()
+            self.cur.execute("INSERT INTO sales (fecha, ts, total, forma_pago) VALUES (?, ?, ?, ?)", (fecha, int(ahora.timestamp()), total, forma_pago))
             sale_id = self.cur.lastrowid
-            for l in self.cart:
-                self.cur.execute("""
-                    INSERT INTO sale_lines (sale_id, producto_codigo, descripcion, cantidad, precio_unitario, subtotal)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (sale_id, l['producto_codigo'], l['descripcion'], l['cantidad'], l['precio_unitario'], l['subtotal']))
-                # actualizar stock
-                self.cur.execute("UPDATE products SET stock_fisico = stock_fisico - ? WHERE codigo = ?", (l['cantidad'], l['producto_codigo']))
+            self.cur.executemany("""
+                INSERT INTO sale_lines (sale_id, producto_codigo, descripcion, cantidad, precio_unitario, subtotal)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(sale_id, l['producto_codigo'], l['descripcion'], l['cantidad'], l['precio_unitario'], l['subtotal']) for l in lineas])
+            self.cur.execute(UPSERT_DAILY_VENTA, (fecha[:10], forma_pago, total))
+            # actualizar stock: una fila por SKU, solo si alcanza
+            self.cur.executemany(
+                "UPDATE products SET stock_fisico = stock_fisico - ? WHERE codigo = ? AND stock_fisico >= ?",
+                [(cantidad, codigo, cantidad) for codigo, cantidad in pedidos.items()])
+            if self.cur.rowcount != len(pedidos):
+                self.conn.rollback()
+                return False, "Stock insuficiente: el inventario cambió durante la venta"
 
             self.conn.commit()
+            for codigo, cantidad in pedidos.items():
+                self._actualizar_stock_cache(codigo, stock_actual[codigo] - cantidad)
             logging.info(f"Venta finalizada ID {sale_id} total {total}")
-            self.cart = []
+            if vaciar:
+                self.cart = []
             return True, sale_id
 
         except Exception as e:
@@ -252,41 +484,116 @@ class POS:
 
     # Devoluciones
     def devolver_articulo(self, id_venta, sku, cantidad, motivo="SIN MOTIVO"):
-        self.cur.execute("SELECT cantidad, precio_unitario FROM sale_lines WHERE sale_id = ? AND producto_codigo = ?", (id_venta, sku))
+        self.cur.execute("""
+            SELECT sl.cantidad, sl.precio_unitario, s.forma_pago
+            FROM sale_lines sl JOIN sales s ON s.id = sl.sale_id
+            WHERE sl.sale_id = ? AND sl.producto_codigo = ?
+        """, (id_venta, sku))
         row = self.cur.fetchone()
         if not row:
             return False, "Artículo no encontrado en la venta"
-        cantidad_vendida, precio_unitario = row
+        cantidad_vendida, precio_unitario, forma_pago = row
         if cantidad > cantidad_vendida:
             return False, f"Solo se vendieron {cantidad_vendida} unidades"
         monto_devuelto = cantidad * precio_unitario
-        self.cur.execute("""
-            INSERT INTO returns (sale_id, producto_codigo, cantidad, monto, motivo, fecha)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (id_venta, sku, cantidad, monto_devuelto, motivo, datetime.now().isoformat()))
-        # ajustar stock
-        self.cur.execute("UPDATE products SET stock_fisico = stock_fisico + ? WHERE codigo = ?", (cantidad, sku))
-        self.conn.commit()
+        ahora = datetime.now()
+        fecha = ahora.isoformat()
+        try:
+            self.cur.execute("""
+                INSERT INTO returns (sale_id, producto_codigo, cantidad, monto, motivo, fecha, ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (id_venta, sku, cantidad, monto_devuelto, motivo, fecha, int(ahora.timestamp())))
+            # ajustar stock
+            self.cur.execute("UPDATE products SET stock_fisico = stock_fisico + ? WHERE codigo = ?", (cantidad, sku))
+            self.cur.execute(UPSERT_DAILY_DEVOLUCION, (fecha[:10], forma_pago or '', monto_devuelto))
+            self.conn.commit()
+        except Exception as e:
+            logging.exception("Error devolver_articulo")
+            self.conn.rollback()
+            return False, str(e)
+        self._actualizar_stock_cache(sku, self.get_stock(sku) + cantidad)
         logging.info(f"Devolución registrada: venta {id_venta} sku {sku} cant {cantidad} monto {monto_devuelto} motivo {motivo}")
         return True, f"Devolución registrada por ${monto_devuelto}"
 
+    # Consultas de solo lectura
+    # Usan la conexión propia del hilo que las ejecuta (get_connection), no self.conn:
+    # así un informe corriendo en segundo plano no comparte cursor con la caja.
+    def _lectura(self):
+        return get_connection(self.db_path).cursor()
+
+    def buscar_productos(self, term, limit=200):
+        cur = self._lectura()
+        try:
+            return product_search.buscar_productos(cur, term, limit=limit)
+        except sqlite3.OperationalError as e:
+            # BD sin índice FTS (o SQLite sin FTS5): búsqueda simple por LIKE
+            logging.error(f"Error en búsqueda FTS: {e}")
+            term_like = f"%{term}%"
+            cur.execute("SELECT codigo, descripcion, stock_fisico FROM products WHERE activo = 1 AND (descripcion LIKE ? OR codigo LIKE ?) LIMIT ?", (term_like, term_like, limit))
+            return cur.fetchall()
+
+    def lineas_venta(self, sale_id):
+        cur = self._lectura()
+        cur.execute("SELECT producto_codigo, descripcion, cantidad, precio_unitario FROM sale_lines WHERE sale_id = ?", (sale_id,))
+        return cur.fetchall()
+
+    def historial_devoluciones(self, limit=200):
+        cur = self._lectura()
+        cur.execute("SELECT sale_id, producto_codigo, cantidad, monto, motivo, fecha FROM returns ORDER BY ts DESC LIMIT ?", (limit,))
+        return cur.fetchall()
+
+    def listar_precios(self):
+        cur = self._lectura()
+        cur.execute("SELECT categoria, precio, updated_at FROM price_list ORDER BY categoria")
+        return cur.fetchall()
+
     # Reportes simples
-    def reporte_cierre(self):
-        self.cur.execute("SELECT id, fecha, total, forma_pago FROM sales WHERE date(fecha) = date('now')")
-        ventas = self.cur.fetchall()
-        self.cur.execute("SELECT SUM(monto) FROM returns WHERE date(fecha) = date('now')")
-        devoluciones = self.cur.fetchone()[0] or 0
-        self.cur.execute("SELECT SUM(total) FROM sales WHERE date(fecha) = date('now')")
-        total_ventas = self.cur.fetchone()[0] or 0
-        self.cur.execute("SELECT COUNT(*) FROM products WHERE stock_fisico <= 0")
-        agotados = self.cur.fetchone()[0]
+    def reporte_cierre(self, dia=None):
+        """
+        Cierre de caja del día (hoy por defecto) leído de daily_sales:
+        ventas = cantidad de ventas, por_forma_pago = {forma: {ventas, total_ventas, devoluciones}}.
+        """
+        dia = dia or date.today().isoformat()
+        cur = self._lectura()
+        cur.execute("SELECT forma_pago, ventas, total_ventas, devoluciones FROM daily_sales WHERE dia = ?", (dia,))
+        por_forma_pago = {fp: {"ventas": v, "total_ventas": t, "devoluciones": d} for fp, v, t, d in cur.fetchall()}
+        cur.execute("SELECT COUNT(*) FROM products WHERE stock_fisico <= 0 AND activo = 1")
+        agotados = cur.fetchone()[0]
         return {
-            "ventas": ventas,
-            "total_ventas": total_ventas,
-            "devoluciones": devoluciones,
+            "dia": dia,
+            "ventas": sum(r["ventas"] for r in por_forma_pago.values()),
+            "total_ventas": sum(r["total_ventas"] for r in por_forma_pago.values()),
+            "devoluciones": sum(r["devoluciones"] for r in por_forma_pago.values()),
+            "por_forma_pago": por_forma_pago,
             "agotados": agotados
         }
 
+    def reporte_rango(self, desde, hasta, agrupar='dia'):
+        """
+        Totales entre dos días inclusive ('YYYY-MM-DD'), agrupados por 'dia' o 'mes'
+        y forma de pago. Devuelve filas (periodo, forma_pago, ventas, total_ventas, devoluciones).
+        """
+        largo = {'dia': 10, 'mes': 7}[agrupar]
+        cur = self._lectura()
+        cur.execute(f"""
+            SELECT substr(dia, 1, {largo}) AS periodo, forma_pago,
+                   SUM(ventas), SUM(total_ventas), SUM(devoluciones)
+            FROM daily_sales
+            WHERE dia BETWEEN ? AND ?
+            GROUP BY periodo, forma_pago
+            ORDER BY periodo, forma_pago
+        """, (desde, hasta))
+        return cur.fetchall()
+
+    def reporte_salidas(self, limit=200):
+        cur = self._lectura()
+        cur.execute("SELECT sale_id, producto_codigo, cantidad, subtotal FROM sale_lines ORDER BY id DESC LIMIT ?", (limit,))
+        return cur.fetchall()
+
+    def export_sap_pendientes(self, carpeta=EXPORTS_DIR, lote=sap_ledger.TAM_LOTE):
+        """Exporta solo las ventas posteriores a la última exportada. Devuelve [(archivo, ventas, lineas), ...]."""
+        return sap_ledger.exportar_pendientes(get_connection(self.db_path), carpeta, lote=lote)
+
 # -------------------------
 # UI: Interfaz moderna integrada
 # -------------------------
@@ -295,6 +602,44 @@ COLOR_PRIMARY = "#87CEEB"   # azul celeste
 COLOR_ACCENT = "#F4C7C3"    # rojo pálido
 COLOR_TEXT = "#222222"
 
+class CartViewModel:
+    """
+    Refleja pos.cart en la Treeview sin reconstruirla. sync() compara el carrito
+    con lo último mostrado y devuelve solo los cambios, por line_id:
+    ('add', line_id, valores), ('update', line_id, valores), ('remove', line_id, None).
+    El total se mantiene sumando la diferencia de cada línea cambiada.
+    """
+    def __init__(self, pos):
+        self.pos = pos
+        self._mostradas = {}   # line_id -> (cantidad, precio_unitario, subtotal, descripcion)
+        self.total = 0.0
+
+    @staticmethod
+    def valores(line):
+        return (line['producto_codigo'], line['descripcion'], line['cantidad'],
+                f"{line['precio_unitario']:.2f}", f"{line['subtotal']:.2f}")
+
+    def sync(self):
+        cambios = []
+        vigentes = set()
+        for line in self.pos.cart:
+            lid = line['line_id']
+            vigentes.add(lid)
+            clave = (line['cantidad'], line['precio_unitario'], line['subtotal'], line['descripcion'])
+            previa = self._mostradas.get(lid)
+            if previa == clave:
+                continue
+            cambios.append(('add' if previa is None else 'update', lid, self.valores(line)))
+            self.total += line['subtotal'] - (previa[2] if previa else 0.0)
+            self._mostradas[lid] = clave
+        if len(vigentes) != len(self._mostradas):
+            for lid in [lid for lid in self._mostradas if lid not in vigentes]:
+                self.total -= self._mostradas.pop(lid)[2]
+                cambios.append(('remove', lid, None))
+        if not self._mostradas:
+            self.total = 0.0
+        return cambios
+
 class ModernPOSApp(tk.Tk):
     def __init__(self, pos):
         super().__init__()
@@ -304,8 +649,15 @@ class ModernPOSApp(tk.Tk):
         self.configure(bg=COLOR_BG)
         self.style = ttk.Style(self)
         self._setup_style()
+        self.cart_view = CartViewModel(pos)
         self._build_layout()
         self._bind_shortcuts()
+        # el trabajo de BD corre en hilos aparte; los resultados vuelven por after()
+        self.worker = DBWorker(self, on_busy=self._set_busy)
+        # mientras la caja registra una venta el carrito no se edita (ver finalize)
+        self._venta_en_curso = False
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(EXPORT_INTERVAL_MS, self._export_periodico)
 
     def _setup_style(self):
         try:
@@ -392,13 +744,56 @@ class ModernPOSApp(tk.Tk):
         ttk.Button(rpt_frame, text="Informe de Salidas", command=self.report_salidas).pack(fill=tk.X, pady=4)
         ttk.Button(rpt_frame, text="Exportar SAP Diario", command=self.export_sap).pack(fill=tk.X, pady=4)
 
-        self.status = ttk.Label(self, text="Listo", anchor="w")
-        self.status.pack(fill=tk.X, side=tk.BOTTOM)
+        status_bar = ttk.Frame(self)
+        status_bar.pack(fill=tk.X, side=tk.BOTTOM)
+        self.progress = ttk.Progressbar(status_bar, mode="indeterminate", length=140)
+        self.status = ttk.Label(status_bar, text="Listo", anchor="w")
+        self.status.pack(fill=tk.X, side=tk.LEFT, expand=True)
+
+    def _set_busy(self, busy):
+        if busy:
+            self.status.config(text="Procesando...")
+            self.progress.pack(side=tk.RIGHT, padx=6)
+            self.progress.start(12)
+        else:
+            self.progress.stop()
+            self.progress.pack_forget()
+            self.status.config(text="Listo")
+
+    def en_caja(self, fn, *args, on_ok=None, on_error=None):
+        """Carrito, ventas, devoluciones y precios: en orden, con la conexión de la caja."""
+        if self.worker.cerrado:
+            return None
+        on_error = on_error or (lambda e: messagebox.showerror("Error", str(e)))
+        return self.worker.submit(CARRIL_CAJA, fn, *args, on_ok=on_ok, on_error=on_error)
+
+    def en_consultas(self, fn, *args, on_ok=None, on_error=None):
+        """Búsquedas, informes y exports: no retrasan el escaneo en la caja."""
+        if self.worker.cerrado:
+            return None
+        on_error = on_error or (lambda e: messagebox.showerror("Error", str(e)))
+        return self.worker.submit(CARRIL_CONSULTAS, fn, *args, on_ok=on_ok, on_error=on_error)
+
+    def _carrito_bloqueado(self):
+        if self._venta_en_curso:
+            messagebox.showwarning("Venta en curso", "Espera a que termine de registrarse la venta")
+            return True
+        return False
+
+    def on_close(self):
+        # la ventana sigue respondiendo mientras la caja termina una venta en curso;
+        # los informes y exports que aún no empezaron se descartan
+        if self.worker.cerrado:
+            return
+        self.status.config(text="Cerrando...")
+        self.worker.cerrar(self.destroy)
 
     # -------------------------
     # Acciones UI (con validaciones)
     # -------------------------
     def action_add(self):
+        if self._carrito_bloqueado():
+            return
         codigo = self.entry_search.get().strip()
         if not codigo:
             messagebox.showerror("Error", "Ingresa código o palabra clave")
@@ -409,7 +804,22 @@ class ModernPOSApp(tk.Tk):
             messagebox.showerror("Error", "Cantidad inválida")
             return
 
-        res, info = self.pos.add_to_cart(codigo, cantidad)
+        self.en_caja(self.pos.add_to_cart, codigo, cantidad,
+                     on_ok=lambda r: self._resultado_add(codigo, cantidad, *r))
+
+    def _add_con_precio(self, codigo, cantidad, precio):
+        if self._carrito_bloqueado():
+            return
+
+        def listo(r):
+            ok, line = r
+            if ok:
+                self.refresh_cart()
+            else:
+                messagebox.showerror("Error", line)
+        self.en_caja(self.pos.add_to_cart, codigo, cantidad, precio, on_ok=listo)
+
+    def _resultado_add(self, codigo, cantidad, res, info):
         # Caso: stock insuficiente o producto no existe
         if res is False:
             messagebox.showerror("Error", info)
@@ -425,21 +835,13 @@ class ModernPOSApp(tk.Tk):
                    "¿Deseas usar este precio?")
             usar = messagebox.askyesno("Precio por categoría", msg, icon='question')
             if usar:
-                ok, line = self.pos.add_to_cart(codigo, cantidad, precio_manual=precio_cat)
-                if ok:
-                    self.refresh_cart()
-                else:
-                    messagebox.showerror("Error", line)
+                self._add_con_precio(codigo, cantidad, precio_cat)
                 return
             else:
                 precio = simpledialog.askfloat("Precio manual", f"Ingrese precio para {producto['descripcion']}", parent=self, minvalue=0.0)
                 if precio is None:
                     return
-                ok, line = self.pos.add_to_cart(codigo, cantidad, precio_manual=precio)
-                if ok:
-                    self.refresh_cart()
-                else:
-                    messagebox.showerror("Error", line)
+                self._add_con_precio(codigo, cantidad, precio)
                 return
 
         # Caso: falta precio por categoría -> pedir precio manual
@@ -448,11 +850,7 @@ class ModernPOSApp(tk.Tk):
             precio = simpledialog.askfloat("Precio manual", f"Ingrese precio para {producto['descripcion']}", parent=self, minvalue=0.0)
             if precio is None:
                 return
-            ok, line = self.pos.add_to_cart(codigo, cantidad, precio_manual=precio)
-            if ok:
-                self.refresh_cart()
-            else:
-                messagebox.showerror("Error", line)
+            self._add_con_precio(codigo, cantidad, precio)
             return
 
         # Caso: agregado correctamente
@@ -469,35 +867,9 @@ class ModernPOSApp(tk.Tk):
             term = simpledialog.askstring("Buscar", "Ingrese palabra clave", parent=self)
             if not term:
                 return
-        term_like = f"%{term}%"
-        try:
-            self.pos.cur.execute("SELECT codigo, descripcion, stock_fisico FROM products WHERE lower(descripcion) LIKE lower(?) OR lower(codigo) LIKE lower(?) LIMIT 200", (term_like, term_like))
-            rows = self.pos.cur.fetchall()
-        except Exception as e:
-            logging.error(f"Error en consulta búsqueda SQL: {e}")
-            rows = []
-
-        if not rows:
-            # fallback: cargar y comparar en Python (normalizando acentos)
-            try:
-                import unicodedata
-                def _normalize(s):
-                    if s is None:
-                        return ''
-                    s = str(s).strip().lower()
-                    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-                self.pos.cur.execute("SELECT codigo, descripcion, stock_fisico FROM products")
-                all_rows = self.pos.cur.fetchall()
-                norm_term = _normalize(term)
-                rows = []
-                for r in all_rows:
-                    if norm_term in _normalize(r[1]) or norm_term in _normalize(r[0]):
-                        rows.append(r)
-                rows = rows[:200]
-            except Exception as e:
-                logging.error(f"Error fallback búsqueda: {e}")
-                rows = []
+        self.en_consultas(self.pos.buscar_productos, term, 200, on_ok=self._mostrar_busqueda)
 
+    def _mostrar_busqueda(self, rows):
         if not rows:
             messagebox.showinfo("Buscar", "No se encontraron productos")
             return
@@ -524,60 +896,83 @@ class ModernPOSApp(tk.Tk):
         ttk.Button(win, text="Seleccionar", command=select_and_close).pack(pady=6)
 
     def refresh_cart(self):
-        for r in self.tree.get_children():
-            self.tree.delete(r)
-        for i, l in enumerate(self.pos.cart):
-            self.tree.insert("", tk.END, iid=str(i), values=(l['producto_codigo'], l['descripcion'], l['cantidad'], f"{l['precio_unitario']:.2f}", f"{l['subtotal']:.2f}"))
-        total = sum(l['subtotal'] for l in self.pos.cart)
-        self.lbl_total.config(text=f"Total: ${total:,.2f}")
+        # solo se tocan las filas que cambiaron; el iid de cada fila es su line_id
+        cambios = self.cart_view.sync()
+        for accion, lid, valores in cambios:
+            if accion == 'add':
+                self.tree.insert("", tk.END, iid=str(lid), values=valores)
+            elif accion == 'update':
+                self.tree.item(str(lid), values=valores)
+            else:
+                self.tree.delete(str(lid))
+        if cambios:
+            self.lbl_total.config(text=f"Total: ${self.cart_view.total:,.2f}")
 
-    def edit_line_price(self):
+    def _linea_seleccionada(self):
+        """Índice en pos.cart de la fila seleccionada, o None."""
         sel = self.tree.selection()
         if not sel:
             messagebox.showerror("Error", "Selecciona una línea")
+            return None
+        idx = self.pos.indice_linea(int(sel[0]))
+        if idx is None:
+            messagebox.showerror("Error", "La línea ya no está en el carrito")
+            self.refresh_cart()
+        return idx
+
+    def edit_line_price(self):
+        if self._carrito_bloqueado():
+            return
+        idx = self._linea_seleccionada()
+        if idx is None:
             return
-        idx = int(sel[0])
         nuevo = simpledialog.askfloat("Editar precio", "Nuevo precio unitario:", parent=self)
-        if nuevo is None:
+        if nuevo is None or self._carrito_bloqueado():
             return
         ok = self.pos.edit_line_price(idx, nuevo)
         if ok:
             self.refresh_cart()
 
     def edit_line_qty(self):
-        sel = self.tree.selection()
-        if not sel:
-            messagebox.showerror("Error", "Selecciona una línea")
+        if self._carrito_bloqueado():
+            return
+        idx = self._linea_seleccionada()
+        if idx is None:
             return
-        idx = int(sel[0])
         nuevo = simpledialog.askinteger("Editar cantidad", "Nueva cantidad:", parent=self, minvalue=1)
         if nuevo is None:
             return
         # validar stock al editar cantidad
-        codigo = self.pos.cart[idx]['producto_codigo']
-        stock_actual = self.pos.get_stock(codigo)
-        if nuevo > stock_actual:
-            messagebox.showerror("Error", f"Stock insuficiente. Disponible: {stock_actual}")
-            return
-        self.pos.cart[idx]['cantidad'] = int(nuevo)
-        self.pos.cart[idx]['subtotal'] = round(self.pos.cart[idx]['cantidad'] * self.pos.cart[idx]['precio_unitario'], 2)
-        self.refresh_cart()
+        line = self.pos.cart[idx]
+
+        def aplicar(stock_actual):
+            if self._carrito_bloqueado():
+                return
+            if nuevo > stock_actual:
+                messagebox.showerror("Error", f"Stock insuficiente. Disponible: {stock_actual}")
+                return
+            line['cantidad'] = int(nuevo)
+            line['subtotal'] = round(line['cantidad'] * line['precio_unitario'], 2)
+            self.refresh_cart()
+        self.en_caja(self.pos.get_stock, line['producto_codigo'], on_ok=aplicar)
 
     def remove_line(self):
-        sel = self.tree.selection()
-        if not sel:
-            messagebox.showerror("Error", "Selecciona una línea")
+        if self._carrito_bloqueado():
+            return
+        idx = self._linea_seleccionada()
+        if idx is None:
             return
-        idx = int(sel[0])
         del self.pos.cart[idx]
         self.refresh_cart()
 
     def action_apply_discount(self):
+        if self._carrito_bloqueado():
+            return
         if not self.pos.cart:
             messagebox.showerror("Error", "Carrito vacío")
             return
         pct = simpledialog.askfloat("Descuento", "Porcentaje de descuento a aplicar (ej 10 para 10%)", parent=self, minvalue=0, maxvalue=100)
-        if pct is None:
+        if pct is None or self._carrito_bloqueado():
             return
         factor = (100 - pct) / 100.0
         for l in self.pos.cart:
@@ -587,24 +982,43 @@ class ModernPOSApp(tk.Tk):
         messagebox.showinfo("Descuento", f"Descuento del {pct}% aplicado")
 
     def finalize(self, forma_pago):
-        ok, info = self.pos.finalize_sale(forma_pago)
-        if not ok:
-            messagebox.showerror("Error", info)
+        if self._carrito_bloqueado():
             return
-        messagebox.showinfo("Venta", f"Venta registrada. ID: {info}")
-        self.refresh_cart()
+        # la venta registra esta copia, tomada en el hilo de la UI; hasta que vuelva
+        # el resultado no se aceptan cambios al carrito
+        lineas = tuple(dict(l) for l in self.pos.cart)
+        self._venta_en_curso = True
+
+        def listo(r):
+            self._venta_en_curso = False
+            ok, info = r
+            if not ok:
+                messagebox.showerror("Error", info)
+                return
+            vendidas = {l['line_id'] for l in lineas}
+            self.pos.cart = [l for l in self.pos.cart if l['line_id'] not in vendidas]
+            self.refresh_cart()
+            messagebox.showinfo("Venta", f"Venta registrada. ID: {info}")
+
+        def fallo(e):
+            self._venta_en_curso = False
+            messagebox.showerror("Error", str(e))
+        self.en_caja(self.pos.finalize_sale, forma_pago, lineas, on_ok=listo, on_error=fallo)
 
     # -------------------------
     # Reportes y export
     # -------------------------
     def report_caja(self):
-        r = self.pos.reporte_cierre()
-        txt = f"Ventas hoy: {len(r['ventas'])}\nTotal ventas: {r['total_ventas']}\nDevoluciones hoy: {r['devoluciones']}\nProductos agotados: {r['agotados']}"
+        self.en_consultas(self.pos.reporte_cierre, on_ok=self._mostrar_caja)
+
+    def _mostrar_caja(self, r):
+        txt = f"Ventas hoy: {r['ventas']}\nTotal ventas: {r['total_ventas']}\nDevoluciones hoy: {r['devoluciones']}\nProductos agotados: {r['agotados']}"
         messagebox.showinfo("Informe Caja Diaria", txt)
 
     def report_salidas(self):
-        self.pos.cur.execute("SELECT sale_id, producto_codigo, cantidad, subtotal FROM sale_lines ORDER BY id DESC LIMIT 200")
-        rows = self.pos.cur.fetchall()
+        self.en_consultas(self.pos.reporte_salidas, on_ok=self._mostrar_salidas)
+
+    def _mostrar_salidas(self, rows):
         win = tk.Toplevel(self)
         win.title("Informe de Salidas")
         tree = ttk.Treeview(win, columns=("venta","sku","cant","subtotal"), show="headings")
@@ -615,20 +1029,18 @@ class ModernPOSApp(tk.Tk):
             tree.insert("", tk.END, values=r)
 
     def export_sap(self):
-        fecha_str = datetime.now().strftime("%Y%m%d")
-        filename = os.path.join(EXPORTS_DIR, f"sap_export_{fecha_str}.csv")
-        self.pos.cur.execute("SELECT s.id, s.fecha, sl.producto_codigo, sl.cantidad, sl.precio_unitario, sl.subtotal FROM sales s JOIN sale_lines sl ON s.id = sl.sale_id WHERE date(s.fecha) = date('now')")
-        rows = self.pos.cur.fetchall()
-        if not rows:
-            messagebox.showinfo("Exportar SAP", "No hay ventas para exportar hoy")
-            return
-        with open(filename, "w", newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(["SaleID","Fecha","SKU","Cantidad","PrecioUnitario","Subtotal"])
-            for r in rows:
-                writer.writerow(r)
-        logging.info(f"Export SAP generado: {filename}")
-        messagebox.showinfo("Exportar SAP", f"Exportado a {filename}")
+        def listo(lotes):
+            if not lotes:
+                messagebox.showinfo("Exportar SAP", "No hay ventas nuevas para exportar")
+                return
+            archivos = "\n".join(a for a, _, _ in lotes)
+            messagebox.showinfo("Exportar SAP", f"Exportadas {sum(v for _, v, _ in lotes)} ventas a:\n{archivos}")
+        self.en_consultas(self.pos.export_sap_pendientes, on_ok=listo)
+
+    def _export_periodico(self):
+        # sin diálogos: el resultado queda en el log (sap_ledger) y los errores también
+        self.en_consultas(self.pos.export_sap_pendientes, on_error=lambda e: None)
+        self.after(EXPORT_INTERVAL_MS, self._export_periodico)
 
     # -------------------------
     # Ventanas auxiliares
@@ -684,9 +1096,11 @@ class DevolucionWindow(tk.Toplevel):
         if not vid.isdigit():
             messagebox.showerror("Error", "ID inválido")
             return
-        vid = int(vid)
-        self.pos.cur.execute("SELECT producto_codigo, descripcion, cantidad, precio_unitario FROM sale_lines WHERE sale_id = ?", (vid,))
-        rows = self.pos.cur.fetchall()
+        self.master.en_consultas(self.pos.lineas_venta, int(vid), on_ok=self._mostrar_lineas)
+
+    def _mostrar_lineas(self, rows):
+        if not self.winfo_exists():
+            return
         for r in self.tree.get_children():
             self.tree.delete(r)
         for row in rows:
@@ -704,15 +1118,20 @@ class DevolucionWindow(tk.Toplevel):
             messagebox.showerror("Error", "Selecciona un artículo")
             return
         sku = self.tree.item(sel[0])['values'][0]
-        ok, msg = self.pos.devolver_articulo(int(vid), sku, int(cant), motivo)
-        if ok:
-            messagebox.showinfo("Éxito", msg)
-        else:
-            messagebox.showerror("Error", msg)
+        def listo(r):
+            ok, msg = r
+            if ok:
+                messagebox.showinfo("Éxito", msg)
+            else:
+                messagebox.showerror("Error", msg)
+        self.master.en_caja(self.pos.devolver_articulo, int(vid), sku, int(cant), motivo, on_ok=listo)
 
     def ver_historial(self):
-        self.pos.cur.execute("SELECT sale_id, producto_codigo, cantidad, monto, motivo, fecha FROM returns ORDER BY fecha DESC LIMIT 200")
-        rows = self.pos.cur.fetchall()
+        self.master.en_consultas(self.pos.historial_devoluciones, on_ok=self._mostrar_historial)
+
+    def _mostrar_historial(self, rows):
+        if not self.winfo_exists():
+            return
         win = tk.Toplevel(self)
         win.title("Historial Devoluciones")
         tree = ttk.Treeview(win, columns=("venta","sku","cant","monto","motivo","fecha"), show="headings")
@@ -760,9 +1179,10 @@ class AdminPreciosWindow(tk.Toplevel):
         except:
             messagebox.showerror("Error", "Precio inválido")
             return
-        self.pos.set_price_for_category(cat, prec)
-        messagebox.showinfo("OK", "Precio guardado/actualizado")
-        self.refrescar()
+        def listo(_):
+            messagebox.showinfo("OK", "Precio guardado/actualizado")
+            self.refrescar()
+        self.master.en_caja(self.pos.set_price_for_category, cat, prec, on_ok=listo)
 
     def cargar_seleccion(self):
         sel = self.tree.selection()
@@ -777,10 +1197,14 @@ class AdminPreciosWindow(tk.Toplevel):
         self.entry_prec.insert(0, str(precio))
 
     def refrescar(self):
+        self.master.en_consultas(self.pos.listar_precios, on_ok=self._mostrar_precios)
+
+    def _mostrar_precios(self, rows):
+        if not self.winfo_exists():
+            return
         for r in self.tree.get_children():
             self.tree.delete(r)
-        self.pos.cur.execute("SELECT categoria, precio, updated_at FROM price_list ORDER BY categoria")
-        for row in self.pos.cur.fetchall():
+        for row in rows:
             self.tree.insert("", tk.END, values=row)
 
 # -------------------------
@@ -790,7 +1214,7 @@ def main():
     # Inicializar esquema mínimo (no importa productos)
     conn = init_db(DB_PATH)
     cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM products")
+    cur.execute("SELECT COUNT(*) FROM products WHERE activo = 1")
     total = cur.fetchone()[0]
     conn.close()
 
@@ -811,6 +1235,9 @@ def main():
     pos = POS(DB_PATH)
     app = ModernPOSApp(pos)
     app.mainloop()
+    for op, p in latency.percentiles().items():
+        logging.info(f"Latencia {op}: n={p['count']} p50={p['p50']}ms p95={p['p95']}ms p99={p['p99']}ms")
+    latency.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
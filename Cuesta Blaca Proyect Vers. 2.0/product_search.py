@@ -0,0 +1,100 @@
+# product_search.py
+# Índice de texto completo (FTS5) sobre products para la búsqueda por palabra clave.
+# El tokenizador unicode61 con remove_diacritics elimina tildes, así que
+# "camion" encuentra "CAMIÓN" sin normalizar en Python fila por fila.
+
+import re
+import logging
+import unicodedata
+
+FTS_TABLE = 'products_fts'
+
+FTS_SCHEMA_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    codigo, descripcion, categoria, modelo, color,
+    content='products', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+"""
+
+# Solo se reindexa cuando cambian columnas indexadas: los UPDATE de stock no tocan el índice.
+FTS_TRIGGERS_SQL = """
+CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts(rowid, codigo, descripcion, categoria, modelo, color)
+    VALUES (new.id, new.codigo, new.descripcion, new.categoria, new.modelo, new.color);
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, codigo, descripcion, categoria, modelo, color)
+    VALUES ('delete', old.id, old.codigo, old.descripcion, old.categoria, old.modelo, old.color);
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF codigo, descripcion, categoria, modelo, color ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, codigo, descripcion, categoria, modelo, color)
+    VALUES ('delete', old.id, old.codigo, old.descripcion, old.categoria, old.modelo, old.color);
+    INSERT INTO products_fts(rowid, codigo, descripcion, categoria, modelo, color)
+    VALUES (new.id, new.codigo, new.descripcion, new.categoria, new.modelo, new.color);
+END;
+"""
+
+FTS_DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS products_fts_ai;
+DROP TRIGGER IF EXISTS products_fts_ad;
+DROP TRIGGER IF EXISTS products_fts_au;
+"""
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, igual que el tokenizador del índice."""
+    if texto is None:
+        return ''
+    texto = str(texto).strip().lower()
+    return ''.join(c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn')
+
+
+def asegurar_indice(conn):
+    """
+    Crea el índice FTS y sus triggers si no existen. Si el índice se crea sobre
+    una tabla products con datos (BD importada antes de existir el índice), lo reconstruye.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (FTS_TABLE,))
+    existia = cur.fetchone() is not None
+    cur.executescript(FTS_SCHEMA_SQL + FTS_TRIGGERS_SQL)
+    if not existia:
+        reconstruir_indice(conn)
+    conn.commit()
+
+
+def reconstruir_indice(conn):
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    logging.info("Índice de búsqueda de productos reconstruido")
+
+
+def consulta_fts(term):
+    """
+    Convierte lo escrito por el cajero en una consulta FTS5: cada palabra
+    como prefijo y todas obligatorias. Devuelve None si no hay palabras.
+    """
+    tokens = _TOKEN_RE.findall(normalizar(term))
+    if not tokens:
+        return None
+    return ' '.join(f'"{t}"*' for t in tokens)
+
+
+def buscar_productos(cur, term, limit=200):
+    """Devuelve filas (codigo, descripcion, stock_fisico) ordenadas por relevancia."""
+    consulta = consulta_fts(term)
+    if consulta is None:
+        return []
+    cur.execute(f"""
+        SELECT p.codigo, p.descripcion, p.stock_fisico
+        FROM {FTS_TABLE} f JOIN products p ON p.id = f.rowid
+        WHERE {FTS_TABLE} MATCH ? AND p.activo = 1
+        ORDER BY f.rank
+        LIMIT ?
+    """, (consulta, limit))
+    return cur.fetchall()
@@ -0,0 +1,63 @@
+# prueba_importer.py
+# Importa un libro temporal con celdas de error de fórmula (#VALUE!, #N/A, #DIV/0!)
+# y verifica que quedan vacías en products, igual que con pd.read_excel,
+# tanto en la importación completa como en la incremental.
+# Uso: python prueba_importer.py
+import os
+import tempfile
+
+from openpyxl import Workbook
+
+from db_connection import conectar
+from importer import COLUMN_MAP, init_db, import_products, import_products_delta
+
+ENCABEZADO = list(COLUMN_MAP)
+FILAS = [
+    ['Solares', 'SKU-1', 'Protector Solar SPF50', 'Cuidado', 'M1', '#VALUE!', 'U', 'UN', 'B1', 'A-1', 'CJ', 7406112111048, 10],
+    ['Solares', 'SKU-2', 'Bloqueador Kids', 'Cuidado', 'M2', 'Azul', '#N/A', 'UN', 'B1', 'A-2', 'CJ', '#REF!', '#DIV/0!'],
+]
+
+
+def escribir_libro(ruta):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(ENCABEZADO)
+    for fila in FILAS:
+        ws.append(fila)
+    # openpyxl guarda los códigos de error como celdas de error (tipo 'e'), no como texto
+    assert ws['F2'].data_type == 'e', ws['F2'].data_type
+    wb.save(ruta)
+
+
+def leer(conn):
+    return {r[0]: r[1:] for r in conn.execute(
+        "SELECT codigo, color, talla, ean_ua, stock_fisico FROM products ORDER BY codigo")}
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, 'errores.xlsx')
+        escribir_libro(ruta)
+        esperado = {
+            'SKU-1': ('', 'U', '7406112111048', 10),
+            'SKU-2': ('Azul', '', '', 0),
+        }
+
+        conn = conectar(os.path.join(tmp, 'completa.db'))
+        init_db(conn)
+        assert import_products(conn, ruta) == 2
+        assert leer(conn) == esperado, leer(conn)
+        conn.close()
+        print("OK importación completa: celdas con error quedan vacías")
+
+        conn = conectar(os.path.join(tmp, 'delta.db'))
+        init_db(conn)
+        r = import_products_delta(conn, ruta)
+        assert r['insertados'] == 2, r
+        assert leer(conn) == esperado, leer(conn)
+        conn.close()
+        print("OK importación incremental: celdas con error quedan vacías")
+
+
+if __name__ == "__main__":
+    main()
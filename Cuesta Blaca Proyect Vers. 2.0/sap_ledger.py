@@ -0,0 +1,128 @@
+# sap_ledger.py
+# Exportación SAP incremental. La tabla export_ledger guarda, por destino, el
+# último sale_id exportado: cada corrida exporta solo las ventas nuevas, en lotes
+# de tamaño acotado. Antes de escribir un lote se anota en el ledger su último id
+# y su archivo (lote en curso); el archivo se escribe como .part, se renombra y
+# recién entonces avanza la marca y se borra el lote en curso. Si el proceso se
+# cae a mitad de un lote, la siguiente corrida rehace el lote anotado (mismo rango
+# de ids, mismo archivo) aunque entretanto hayan llegado ventas nuevas: el archivo
+# se sobrescribe en vez de quedar otro con las mismas ventas.
+
+import os
+import csv
+import logging
+from datetime import datetime
+
+LEDGER_SQL = """
+CREATE TABLE IF NOT EXISTS export_ledger (
+    destino TEXT PRIMARY KEY,
+    ultimo_sale_id INTEGER NOT NULL DEFAULT 0,
+    ultimo_ts INTEGER,
+    actualizado TEXT,
+    lote_hasta_id INTEGER,
+    lote_archivo TEXT
+);
+"""
+
+# Columnas agregadas después de la primera versión del ledger (BD ya existentes)
+LEDGER_MIGRATIONS = {
+    'lote_hasta_id': "ALTER TABLE export_ledger ADD COLUMN lote_hasta_id INTEGER",
+    'lote_archivo': "ALTER TABLE export_ledger ADD COLUMN lote_archivo TEXT",
+}
+
+CSV_HEADER = ["SaleID", "Fecha", "SKU", "Cantidad", "PrecioUnitario", "Subtotal"]
+DESTINO_SAP = 'sap'
+TAM_LOTE = 500          # ventas por archivo
+TAM_BLOQUE = 2000       # filas leídas por fetchmany al escribir un lote
+
+
+def asegurar_ledger(conn):
+    conn.execute(LEDGER_SQL)
+    existentes = {r[1] for r in conn.execute("PRAGMA table_info(export_ledger)")}
+    for col, ddl in LEDGER_MIGRATIONS.items():
+        if col not in existentes:
+            conn.execute(ddl)
+
+
+def marca_agua(conn, destino=DESTINO_SAP):
+    """(ultimo_sale_id, ultimo_ts) exportados para el destino; (0, None) si nunca se exportó."""
+    asegurar_ledger(conn)
+    row = conn.execute("SELECT ultimo_sale_id, ultimo_ts FROM export_ledger WHERE destino = ?", (destino,)).fetchone()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def _lote_en_curso(conn, destino):
+    row = conn.execute(
+        "SELECT lote_hasta_id, lote_archivo FROM export_ledger WHERE destino = ? AND lote_hasta_id IS NOT NULL",
+        (destino,)
+    ).fetchone()
+    return row if row else (None, None)
+
+
+def _anotar_lote(conn, destino, hasta_id, archivo):
+    conn.execute("""
+        INSERT INTO export_ledger (destino, lote_hasta_id, lote_archivo, actualizado) VALUES (?, ?, ?, ?)
+        ON CONFLICT(destino) DO UPDATE SET
+            lote_hasta_id = excluded.lote_hasta_id,
+            lote_archivo = excluded.lote_archivo,
+            actualizado = excluded.actualizado
+    """, (destino, hasta_id, archivo, datetime.now().isoformat()))
+    conn.commit()
+
+
+def exportar_pendientes(conn, carpeta, destino=DESTINO_SAP, lote=TAM_LOTE, max_lotes=None):
+    """
+    Exporta las ventas con id mayor a la marca del destino, en lotes de hasta
+    `lote` ventas (un CSV por lote). Devuelve [(archivo, ventas, lineas), ...].
+    Un lote que quedó a medias en una corrida anterior se rehace primero, con su rango y archivo.
+    """
+    ultimo_id, _ = marca_agua(conn, destino)
+    cur = conn.cursor()
+    generados = []
+    while max_lotes is None or len(generados) < max_lotes:
+        hasta_id, archivo = _lote_en_curso(conn, destino)
+        if hasta_id is None:
+            cur.execute("SELECT id FROM sales WHERE id > ? ORDER BY id LIMIT ?", (ultimo_id, lote))
+            ventas = cur.fetchall()
+            if not ventas:
+                break
+            desde_id, hasta_id = ventas[0][0], ventas[-1][0]
+            archivo = os.path.join(carpeta, f"sap_export_{destino}_{desde_id:08d}_{hasta_id:08d}.csv")
+            # rango y archivo quedan anotados antes de escribir: un reintento rehace este mismo lote
+            _anotar_lote(conn, destino, hasta_id, archivo)
+
+        cur.execute("""
+            SELECT COUNT(*), (SELECT ts FROM sales WHERE id = ?) FROM sales WHERE id > ? AND id <= ?
+        """, (hasta_id, ultimo_id, hasta_id))
+        n_ventas, hasta_ts = cur.fetchone()
+
+        tmp = archivo + ".part"
+        cur.execute("""
+            SELECT s.id, s.fecha, sl.producto_codigo, sl.cantidad, sl.precio_unitario, sl.subtotal
+            FROM sales s JOIN sale_lines sl ON sl.sale_id = s.id
+            WHERE s.id > ? AND s.id <= ?
+            ORDER BY s.id, sl.id
+        """, (ultimo_id, hasta_id))
+        lineas = 0
+        with open(tmp, "w", newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            while True:
+                filas = cur.fetchmany(TAM_BLOQUE)
+                if not filas:
+                    break
+                writer.writerows(filas)
+                lineas += len(filas)
+        os.replace(tmp, archivo)
+
+        # el archivo ya está completo: recién ahora avanza la marca y se cierra el lote
+        conn.execute("""
+            UPDATE export_ledger
+            SET ultimo_sale_id = ?, ultimo_ts = ?, actualizado = ?, lote_hasta_id = NULL, lote_archivo = NULL
+            WHERE destino = ?
+        """, (hasta_id, hasta_ts, datetime.now().isoformat(), destino))
+        conn.commit()
+        logging.info(f"Export {destino}: ventas {ultimo_id + 1}-{hasta_id} ({n_ventas} ventas, {lineas} líneas) -> {archivo}")
+        generados.append((archivo, n_ventas, lineas))
+        ultimo_id = hasta_id
+    return generados
@@ -1,6 +1,11 @@
 import os
 import pandas as pd
 
+from excel_stream import leer_excel
+from price_book import PriceBook
+from inventory_index import IndiceInventario
+from stock_journal import DiarioStock, PlanillaCambiada
+
 # =========================
 # CONFIGURACIÓN
 # =========================
@@ -17,22 +22,36 @@ MARGIN_WHOLESALE_2 = 1.35
 
 IVA_RATE = 0.19
 
+# Precios materializados por SKU (se recalculan solo si cambia costo, dólar o margen)
+PRICE_BOOK_DB = os.path.join(os.path.dirname(INVENTORY_FILE), "price_book.db")
+MARGINS = {"DETALLE": MARGIN_RETAIL, "MAY1": MARGIN_WHOLESALE_1, "MAY2": MARGIN_WHOLESALE_2}
+PRICE_COLUMNS = {"DETALLE": "Precio_Detalle", "MAY1": "Precio_Mayorista_1", "MAY2": "Precio_Mayorista_2"}
+
+# Rebajas de stock por venta (la planilla se reescribe solo al compactar)
+STOCK_JOURNAL_DB = os.path.join(os.path.dirname(INVENTORY_FILE), "stock_journal.db")
+
 
 # =========================
 # INVENTARIO
 # =========================
 
 def load_inventory():
-    df = pd.read_excel(INVENTORY_FILE, sheet_name=INVENTORY_SHEET)
+    """Devuelve (inventario, libro de precios)."""
+    df = leer_excel(INVENTORY_FILE, hoja=INVENTORY_SHEET)
+    price_book = PriceBook(USD_CLP_RATE, MARGINS, PRICE_BOOK_DB)
+    price_book.sincronizar(df["Código"], df["Costo"])
+
+    # columnas de precio tomadas del libro (se siguen guardando en la planilla)
     df["Costo_CLP"] = df["Costo"] * USD_CLP_RATE
-    df["Precio_Detalle"] = (df["Costo_CLP"] * MARGIN_RETAIL).round(0)
-    df["Precio_Mayorista_1"] = (df["Costo_CLP"] * MARGIN_WHOLESALE_1).round(0)
-    df["Precio_Mayorista_2"] = (df["Costo_CLP"] * MARGIN_WHOLESALE_2).round(0)
-    return df
+    precios = price_book.precios[price_book.filas(df["Código"])]
+    for lista, columna in PRICE_COLUMNS.items():
+        df[columna] = precios[:, price_book.columna[lista]]
+    return df, price_book
 
 
-def save_inventory(df):
-    df.to_excel(INVENTORY_FILE, sheet_name=INVENTORY_SHEET, index=False)
+def save_inventory(df, diario):
+    # reescribe la planilla con el stock al día y vacía el diario de movimientos
+    diario.compactar(df, INVENTORY_FILE, INVENTORY_SHEET)
     print("\nInventario actualizado guardado correctamente.")
 
 
@@ -40,7 +59,7 @@ def save_inventory(df):
 # POS / PISTOLA LÁSER
 # =========================
 
-def pos_loop(inventory_df, lista_precio="DETALLE"):
+def pos_loop(inventory_df, price_book, indice, lista_precio="DETALLE"):
     carrito = []
 
     print("\n==============================")
@@ -54,27 +73,19 @@ def pos_loop(inventory_df, lista_precio="DETALLE"):
         if codigo.upper() == "FIN":
             break
 
-        # Buscar producto
-        row = inventory_df[inventory_df["Código"] == codigo]
+        # Buscar producto (por SKU o EAN, en el índice)
+        row = indice.fila(codigo)
 
-        if row.empty:
+        if row is None:
             print(f"⚠️ Código no encontrado: {codigo}")
             continue
 
-        row = row.iloc[0]
-
-        # Selección de precio
-        if lista_precio == "DETALLE":
-            precio = row["Precio_Detalle"]
-        elif lista_precio == "MAY1":
-            precio = row["Precio_Mayorista_1"]
-        elif lista_precio == "MAY2":
-            precio = row["Precio_Mayorista_2"]
-        else:
-            precio = row["Precio_Detalle"]
+        # Precio ya calculado en el libro (lista desconocida = detalle)
+        sku = row["Código"]
+        precio = price_book.precio(str(sku), lista_precio)
 
         carrito.append({
-            "Código": codigo,
+            "Código": sku,
             "Descripción": row["Descripción"],
             "Cantidad": 1,
             "Precio Unitario": precio,
@@ -94,14 +105,14 @@ def pos_loop(inventory_df, lista_precio="DETALLE"):
 # REBAJA DE INVENTARIO
 # =========================
 
-def rebajar_inventario(inventory_df, carrito_df):
-    for _, row in carrito_df.iterrows():
-        codigo = row["Código"]
-        qty = row["Cantidad"]
-
-        idx = inventory_df[inventory_df["Código"] == codigo].index[0]
-        inventory_df.at[idx, "Stock Físico"] -= qty
-
+def rebajar_inventario(inventory_df, carrito_df, indice=None, diario=None):
+    # la rebaja queda primero en el diario (un append por venta); luego en memoria,
+    # todas las líneas del carrito en una sola actualización vectorizada
+    if indice is None:
+        indice = IndiceInventario(inventory_df)
+    if diario is not None:
+        diario.registrar(carrito_df["Código"], carrito_df["Cantidad"])
+    indice.rebajar(carrito_df["Código"], carrito_df["Cantidad"])
     return inventory_df
 
 
@@ -110,10 +121,22 @@ def rebajar_inventario(inventory_df, carrito_df):
 # =========================
 
 def main():
-    inv = load_inventory()
+    inv, price_book = load_inventory()
+    indice = IndiceInventario(inv)
+
+    # stock vigente = planilla + movimientos del diario posteriores a ella
+    diario = DiarioStock(STOCK_JOURNAL_DB)
+    try:
+        diario.cargar(inv, indice, INVENTORY_FILE)
+    except PlanillaCambiada as e:
+        # planilla reemplazada por fuera: el operador decide si ya trae esas ventas
+        print(f"\n⚠️ {e}.")
+        respuesta = input("¿La planilla nueva ya incluye esas ventas? (S = descartarlas / N = rebajarlas): ")
+        diario.aceptar_base(INVENTORY_FILE, descartar_pendientes=respuesta.strip().upper() == "S")
+        diario.cargar(inv, indice, INVENTORY_FILE)
 
     # Iniciar POS
-    carrito = pos_loop(inv, lista_precio="DETALLE")
+    carrito = pos_loop(inv, price_book, indice, lista_precio="DETALLE")
 
     if carrito.empty:
         print("No se registraron productos.")
@@ -135,8 +158,11 @@ def main():
     print("==============================\n")
 
     # Rebajar inventario
-    inv = rebajar_inventario(inv, carrito)
-    save_inventory(inv)
+    inv = rebajar_inventario(inv, carrito, indice, diario)
+    print("Venta registrada en el diario de stock.")
+
+    if diario.pendientes() >= diario.compactar_cada:
+        save_inventory(inv, diario)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+# benchmark_dte_xml.py
+# Compara build_boleta_xml (plantilla) con build_boleta_xml_arbol (ElementTree)
+# sobre boletas sintéticas y verifica que ambas generan exactamente los mismos bytes.
+# Uso: python benchmark_dte_xml.py [--docs 10000] [--items 8]
+import time
+import random
+import argparse
+import datetime
+
+from dte_builder import build_boleta_xml, build_boleta_xml_arbol, EMISOR
+
+RECEPTOR = {
+    "rut": "66666666-6",
+    "razon_social": "CONSUMIDOR FINAL"
+}
+
+# nombres con tildes, ñ, caracteres a escapar y fuera de ISO-8859-1
+NOMBRES = [
+    "Protector Solar SPF50",
+    "After Sun Aloe 200 ml",
+    "Bloqueador Niños & Bebés",
+    "Crema <Hidratante> Peñalolén",
+    "Gel Ártico \"Frío\" 150 ml",
+    "Toalla Playa 70×140 €",
+    "",
+]
+
+
+def generar_boletas(n, items_por_boleta, semilla=2990):
+    rnd = random.Random(semilla)
+    fecha = datetime.date(2025, 1, 1)
+    for folio in range(1, n + 1):
+        items = []
+        neto = 0
+        for linea in range(1, rnd.randint(1, items_por_boleta) + 1):
+            cantidad = rnd.randint(1, 5)
+            precio = rnd.choice([990, 1990, 4500, 5000, 12990])
+            items.append({
+                "NroLinDet": linea,
+                "NmbItem": rnd.choice(NOMBRES),
+                "QtyItem": cantidad,
+                "PrcItem": precio,
+                "MontoItem": cantidad * precio
+            })
+            neto += cantidad * precio
+        iva = round(neto * 0.19)
+        totales = {"MntNeto": neto, "IVA": iva, "MntTotal": neto + iva}
+        yield dict(folio=folio, emisor=EMISOR, receptor=RECEPTOR, items=items, totales=totales, fch_emis=fecha)
+
+
+def medir(nombre, boletas, funcion):
+    t0 = time.perf_counter()
+    salida = [funcion(**b) for b in boletas]
+    duracion = time.perf_counter() - t0
+    print(f"{nombre:<28} {duracion:8.3f} s   {len(boletas) / duracion:10.0f} docs/s")
+    return salida, duracion
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del armado de XML de boletas")
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=8, help="máximo de líneas por boleta")
+    args = parser.parse_args(argv)
+
+    boletas = list(generar_boletas(args.docs, args.items))
+    print(f"{len(boletas)} boletas, hasta {args.items} líneas cada una")
+
+    referencia, t_arbol = medir("ElementTree (referencia)", boletas, build_boleta_xml_arbol)
+    plantilla, t_plantilla = medir("Plantilla", boletas, build_boleta_xml)
+
+    distintas = [i for i, (a, b) in enumerate(zip(referencia, plantilla)) if a != b]
+    if distintas:
+        i = distintas[0]
+        print(f"ERROR: {len(distintas)} boletas difieren; primera (folio {boletas[i]['folio']}):")
+        print(referencia[i])
+        print(plantilla[i])
+        raise SystemExit(1)
+
+    print(f"Salida idéntica byte a byte. Aceleración: {t_arbol / t_plantilla:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmark_firma_lote.py
+# Compara firma secuencial vs firmar_lote con distintos tamaños de pool.
+# Uso: python benchmark_firma_lote.py [--docs 500] [--pfx ruta.pfx --password clave]
+# Sin --pfx genera un certificado autofirmado temporal (RSA 2048) solo para medir.
+import os
+import sys
+import time
+import argparse
+import datetime
+import tempfile
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12, BestAvailableEncryption
+
+from dte_builder import build_boleta_xml, EMISOR
+from dte_signer import ContextoFirma, firmar_lote
+
+RECEPTOR = {
+    "rut": "66666666-6",
+    "razon_social": "CONSUMIDOR FINAL"
+}
+
+
+# =========================
+# CERTIFICADO DE PRUEBA
+# =========================
+def generar_pfx_temporal(password):
+    clave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark firma DTE")])
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre)
+        .issuer_name(nombre)
+        .public_key(clave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora)
+        .not_valid_after(ahora + datetime.timedelta(days=1))
+        .sign(clave, hashes.SHA256())
+    )
+    pfx = pkcs12.serialize_key_and_certificates(
+        b"benchmark", clave, cert, None, BestAvailableEncryption(password.encode())
+    )
+    f = tempfile.NamedTemporaryFile(suffix=".pfx", delete=False)
+    f.write(pfx)
+    f.close()
+    return f.name
+
+
+# =========================
+# DOCUMENTOS DE PRUEBA
+# =========================
+def generar_boletas(n):
+    for folio in range(1, n + 1):
+        items = [
+            {"NroLinDet": i, "NmbItem": f"Producto {folio}-{i}", "QtyItem": 1, "PrcItem": 5000, "MontoItem": 5000}
+            for i in range(1, 6)
+        ]
+        totales = {"MntNeto": 21008, "IVA": 3992, "MntTotal": 25000}
+        yield build_boleta_xml(folio=folio, emisor=EMISOR, receptor=RECEPTOR, items=items, totales=totales)
+
+
+def medir(nombre, n, funcion):
+    t0 = time.perf_counter()
+    firmados = funcion()
+    duracion = time.perf_counter() - t0
+    print(f"{nombre:<28} {duracion:8.2f} s   {n / duracion:8.1f} docs/s")
+    return firmados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de firma de boletas en lote")
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--pfx")
+    parser.add_argument("--password", default="benchmark")
+    args = parser.parse_args(argv)
+
+    ruta_pfx = args.pfx or generar_pfx_temporal(args.password)
+    try:
+        boletas = list(generar_boletas(args.docs))
+        nucleos = os.cpu_count() or 1
+        print(f"{args.docs} boletas, {nucleos} núcleos\n")
+
+        contexto = ContextoFirma.desde_pfx(ruta_pfx, args.password)
+        referencia = medir("secuencial (ContextoFirma)", args.docs,
+                           lambda: [contexto.firmar(x) for x in boletas])
+
+        for procesos in sorted({p for p in (2, 4, 8, 16) if p < nucleos} | {nucleos}):
+            firmados = medir(f"firmar_lote ({procesos} procesos)", args.docs,
+                             lambda: list(firmar_lote(boletas, ruta_pfx, args.password, procesos=procesos)))
+            # RSA PKCS#1 v1.5 es determinístico: mismo orden => mismos bytes
+            if firmados != referencia:
+                print("  ERROR: el resultado no coincide con la firma secuencial")
+                return 1
+    finally:
+        if not args.pfx:
+            os.remove(ruta_pfx)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
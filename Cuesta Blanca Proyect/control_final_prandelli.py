@@ -1,12 +1,30 @@
 import sqlite3
+import logging
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import datetime
-import pandas as pd
+
+from db_connection import get_connection
+import sap_export
+import dte_outbox
+import scanner_input
 
 DB_FILE = "inventario.db"
 IVA = 0.19
 
+# =========================
+# BOLETA ELECTRÓNICA
+# =========================
+# Las boletas siempre quedan en la cola dte_outbox; sin certificado configurado
+# no se emiten, y se envían al configurarlo (el hilo retoma la cola completa).
+# Cada boleta necesita un folio de un CAF cargado (DTE_CAFS), que además la timbra.
+DTE_PFX = ""                 # ruta al certificado .pfx
+DTE_PFX_PASSWORD = ""
+DTE_RUT_ENVIA = ""           # RUT del dueño del certificado
+DTE_FCH_RESOL = "2014-08-22"
+DTE_NRO_RESOL = 0            # 0 = ambiente de certificación
+DTE_CAFS = []                # rutas a los CAF (XML de folios del SII); se cargan al abrir el POS
+
 
 # =========================
 # ESTILO MODERNO (AZUL / CELESTE / ROJO PASTEL)
@@ -99,7 +117,8 @@ def aplicar_estilos_modernos(root):
 # =========================
 
 def get_conn():
-    return sqlite3.connect(DB_FILE)
+    # conexión compartida (WAL) reutilizada entre consultas; no se cierra por llamada
+    return get_connection(DB_FILE)
 
 
 # =========================
@@ -116,7 +135,6 @@ def get_producto(codigo):
         WHERE codigo = ?
     """, (codigo,))
     row = cur.fetchone()
-    conn.close()
 
     if not row:
         return None
@@ -138,75 +156,90 @@ def get_producto(codigo):
 
 def actualizar_stock(producto_id, cantidad):
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE productos
-        SET stock_fisico = stock_fisico - ?,
-            unidades_salientes = unidades_salientes + ?
-        WHERE id = ?
-    """, (cantidad, cantidad, producto_id))
-    conn.commit()
-    conn.close()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE productos
+            SET stock_fisico = stock_fisico - ?,
+                unidades_salientes = unidades_salientes + ?
+            WHERE id = ?
+        """, (cantidad, cantidad, producto_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     # =========================
 # REGISTRAR VENTA
 # =========================
 
 def registrar_venta(carrito, neto, iva, total, tipo_doc):
     conn = get_conn()
-    cur = conn.cursor()
-
-    fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        cur = conn.cursor()
 
-    # Crear tablas si no existen
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ventas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            fecha TEXT,
-            total_neto REAL,
-            total_iva REAL,
-            total_total REAL,
-            tipo_documento TEXT
-        )
-    """)
+        fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ventas_detalle (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            venta_id INTEGER,
-            codigo TEXT,
-            descripcion TEXT,
-            cantidad INTEGER,
-            precio_unitario REAL,
-            total_linea REAL
-        )
-    """)
+        # Crear tablas si no existen
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ventas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fecha TEXT,
+                total_neto REAL,
+                total_iva REAL,
+                total_total REAL,
+                tipo_documento TEXT
+            )
+        """)
 
-    # Insertar encabezado
-    cur.execute("""
-        INSERT INTO ventas (fecha, total_neto, total_iva, total_total, tipo_documento)
-        VALUES (?, ?, ?, ?, ?)
-    """, (fecha, neto, iva, total, tipo_doc))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ventas_detalle (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                venta_id INTEGER,
+                codigo TEXT,
+                descripcion TEXT,
+                cantidad INTEGER,
+                precio_unitario REAL,
+                total_linea REAL
+            )
+        """)
 
-    venta_id = cur.lastrowid
+        # fecha se guarda como 'YYYY-MM-DD HH:MM:SS' (ordenable como texto):
+        # los informes filtran por rango sobre este índice en vez de LIKE
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_detalle_venta ON ventas_detalle(venta_id)")
 
-    # Insertar detalle
-    for item in carrito:
+        # Insertar encabezado
         cur.execute("""
-            INSERT INTO ventas_detalle (
-                venta_id, codigo, descripcion,
-                cantidad, precio_unitario, total_linea
-            ) VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            venta_id,
-            item["codigo"],
-            item["descripcion"],
-            item["cantidad"],
-            item["precio"],
-            item["total"]
-        ))
+            INSERT INTO ventas (fecha, total_neto, total_iva, total_total, tipo_documento)
+            VALUES (?, ?, ?, ?, ?)
+        """, (fecha, neto, iva, total, tipo_doc))
+
+        venta_id = cur.lastrowid
+
+        # Insertar detalle
+        for item in carrito:
+            cur.execute("""
+                INSERT INTO ventas_detalle (
+                    venta_id, codigo, descripcion,
+                    cantidad, precio_unitario, total_linea
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                venta_id,
+                item["codigo"],
+                item["descripcion"],
+                item["cantidad"],
+                item["precio"],
+                item["total"]
+            ))
 
-    conn.commit()
-    conn.close()
+        # la boleta electrónica se encola en la misma transacción: o quedan las dos o ninguna
+        if tipo_doc == "BOLETA":
+            dte_outbox.encolar_venta(cur, venta_id)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
     return venta_id
 
@@ -215,20 +248,25 @@ def registrar_venta(carrito, neto, iva, total, tipo_doc):
 # CAJA DIARIA
 # =========================
 
+def rango_dia(dia=None):
+    """('YYYY-MM-DD', día siguiente) para filtrar ventas.fecha con >= y < (usa idx_ventas_fecha)."""
+    dia = dia or datetime.date.today()
+    return dia.strftime("%Y-%m-%d"), (dia + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+
+
 def caja_diaria():
     conn = get_conn()
     cur = conn.cursor()
 
-    hoy = datetime.datetime.now().strftime("%Y-%m-%d")
+    hoy, manana = rango_dia()
 
     cur.execute("""
         SELECT SUM(total_neto), SUM(total_iva), SUM(total_total)
         FROM ventas
-        WHERE fecha LIKE ?
-    """, (hoy + "%",))
+        WHERE fecha >= ? AND fecha < ?
+    """, (hoy, manana))
 
     row = cur.fetchone()
-    conn.close()
 
     neto = row[0] or 0
     iva = row[1] or 0
@@ -259,7 +297,6 @@ def informe_salidas():
     """)
 
     datos = cur.fetchall()
-    conn.close()
 
     ventana = tk.Toplevel()
     ventana.title("Informe de salidas")
@@ -278,88 +315,18 @@ def informe_salidas():
 # EXPORTACIÓN DIARIA A SAP B1
 # =========================
 
-def exportar_sap_diario():
-    conn = get_conn()
-    cur = conn.cursor()
-
-    hoy = datetime.datetime.now().strftime("%Y-%m-%d")
-
-    # Obtener ventas del día
-    cur.execute("""
-        SELECT id, fecha, total_total, tipo_documento
-        FROM ventas
-        WHERE fecha LIKE ?
-    """, (hoy + "%",))
-    ventas = cur.fetchall()
-
-    # Obtener detalle del día
-    cur.execute("""
-        SELECT venta_id, codigo, descripcion, cantidad, precio_unitario, total_linea
-        FROM ventas_detalle
-        WHERE venta_id IN (
-            SELECT id FROM ventas WHERE fecha LIKE ?
-        )
-    """, (hoy + "%",))
-    detalle = cur.fetchall()
+def exportar_sap_diario(formato="xlsx"):
+    # Solo las ventas nuevas desde la última exportación (marca en sap_export_ledger),
+    # así exportar dos veces o pasada la medianoche no duplica ni salta documentos.
+    lotes = sap_export.exportar_pendientes(get_conn(), formato=formato)
 
-    conn.close()
-
-    if not ventas:
-        messagebox.showinfo("Exportación SAP", "No hay ventas para exportar hoy.")
+    if not lotes:
+        messagebox.showinfo("Exportación SAP", "No hay ventas nuevas para exportar.")
         return
 
-    # Crear DataFrames
-    df_oinv = pd.DataFrame(columns=[
-        "DocDate", "DocDueDate", "CardCode", "DocTotal",
-        "Comments", "Series", "DocType"
-    ])
-
-    df_inv1 = pd.DataFrame(columns=[
-        "DocEntry", "ItemCode", "Quantity", "Price",
-        "LineTotal", "WhsCode"
-    ])
-
-    # Llenar encabezado
-    for v in ventas:
-        venta_id, fecha, total, tipo_doc = v
-
-        # Serie SAP según tipo de documento
-        if tipo_doc == "BOLETA":
-            serie = 33
-        else:
-            serie = 30
-
-        df_oinv.loc[len(df_oinv)] = [
-            fecha.split(" ")[0],   # DocDate
-            fecha.split(" ")[0],   # DocDueDate
-            "C99999",              # Cliente genérico
-            total,
-            f"Venta POS ID {venta_id}",
-            serie,
-            "I"                    # Documento de ítems
-        ]
-
-    # Llenar detalle
-    for d in detalle:
-        venta_id, codigo, desc, qty, price, total_linea = d
-        df_inv1.loc[len(df_inv1)] = [
-            venta_id,
-            codigo,
-            qty,
-            price,
-            total_linea,
-            "01"  # Bodega SAP
-        ]
-
-    # Guardar Excel
-    fecha_archivo = datetime.datetime.now().strftime("%Y%m%d")
-    archivo = f"export_sap_{fecha_archivo}.xlsx"
-
-    with pd.ExcelWriter(archivo) as writer:
-        df_oinv.to_excel(writer, sheet_name="OINV", index=False)
-        df_inv1.to_excel(writer, sheet_name="INV1", index=False)
-
-    messagebox.showinfo("Exportación completada", f"Archivo generado:\n{archivo}")
+    documentos = sum(d for _, d, _ in lotes)
+    archivos = "\n".join(a for a, _, _ in lotes)
+    messagebox.showinfo("Exportación completada", f"Archivos generados:\n{archivos}\n\nDocumentos: {documentos}")
     # =========================
 # INTERFAZ GRÁFICA
 # =========================
@@ -379,7 +346,10 @@ class POS:
         tk.Label(root, text="Escanear código:", bg="#F5F5F5", font=("Segoe UI", 11)).grid(row=0, column=0, sticky="w")
         self.entry_codigo = ttk.Entry(root, style="Rounded.TEntry", width=30)
         self.entry_codigo.grid(row=0, column=1, sticky="we")
-        self.entry_codigo.bind("<Return>", self.agregar_producto)
+        # la pistola escribe en este mismo campo: las ráfagas van a la cola de escaneos
+        self.detector_escaneo = scanner_input.DetectorRafagas()
+        self.entry_codigo.bind("<Key>", self._tecla_codigo)
+        self.entry_codigo.bind("<Return>", self._enter_codigo)
 
         ttk.Button(root, text="Agregar", style="Rounded.TButton",
                    command=self.agregar_producto).grid(row=0, column=2, padx=5)
@@ -484,6 +454,10 @@ class POS:
         ttk.Button(root, text="-1 cantidad", style="Rounded.TButton",
                    command=self.decrementar_cantidad).grid(row=10, column=1, pady=5)
 
+        # ===== FILA 11: ESTADO DEL ESCANEO (sin ventanas que bloqueen la pistola) =====
+        self.label_escaneo = tk.Label(root, text="", bg="#F5F5F5", font=("Segoe UI", 10))
+        self.label_escaneo.grid(row=11, column=0, columnspan=3, sticky="w")
+
         # Configuración de expansión
         root.columnconfigure(1, weight=1)
         root.rowconfigure(2, weight=1)
@@ -491,6 +465,28 @@ class POS:
         # Cierre del día
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+        # Exportación SAP incremental cada pocos minutos, en segundo plano
+        self.exportador = sap_export.ExportadorPeriodico(DB_FILE)
+        self.exportador.iniciar()
+
+        for ruta_caf in DTE_CAFS:
+            try:
+                dte_outbox.cargar_caf(get_conn(), ruta_caf)
+            except (OSError, ValueError) as e:
+                logging.error(f"CAF {ruta_caf} no cargado: {e}")
+                messagebox.showerror("CAF", f"No se pudo cargar el CAF {ruta_caf}:\n{e}")
+
+        self.emisor_dte = None
+        if DTE_PFX:
+            self.emisor_dte = dte_outbox.EmisorDTE.desde_pfx(
+                DB_FILE, DTE_PFX, DTE_PFX_PASSWORD, DTE_RUT_ENVIA, DTE_FCH_RESOL, DTE_NRO_RESOL
+            )
+            self.emisor_dte.iniciar()
+
+        self.escaneos = scanner_input.ProcesadorEscaneos(get_producto)
+        self.escaneos.iniciar()
+        self._sondeo_escaneos = self.root.after(scanner_input.INTERVALO_SONDEO_MS, self._aplicar_escaneos)
+
             # =========================
     # AGREGAR PRODUCTO (CON CANTIDAD)
     # =========================
@@ -536,17 +532,7 @@ class POS:
             messagebox.showerror("Error", "No hay stock suficiente")
             return
 
-        # Selección de precio
-        lista = self.lista_precio.get()
-        if lista == "detalle":
-            precio = producto["detalle"]
-        elif lista == "may1":
-            precio = producto["may1"]
-        elif lista == "may2":
-            precio = producto["may2"]
-        else:
-            precio = producto["detalle"]
-
+        precio = self.precio_lista(producto)
         total = precio * cantidad
 
         # Agregar al carrito
@@ -570,6 +556,111 @@ class POS:
 
         self.actualizar_totales()
 
+    def precio_lista(self, producto):
+        lista = self.lista_precio.get()
+        if lista == "detalle":
+            return producto["detalle"]
+        elif lista == "may1":
+            return producto["may1"]
+        elif lista == "may2":
+            return producto["may2"]
+        return producto["detalle"]
+
+
+    # =========================
+    # ESCANEO CON PISTOLA (COLA)
+    # =========================
+
+    def _tecla_codigo(self, event):
+        if event.char and event.char.isprintable():
+            self.detector_escaneo.tecla(event.time / 1000)
+
+    def _enter_codigo(self, event):
+        codigo = self.entry_codigo.get().strip()
+        if not self.detector_escaneo.fin(codigo, event.time / 1000):
+            # digitado a mano: flujo normal con cantidad
+            self.agregar_producto()
+            return "break"
+        self.entry_codigo.delete(0, tk.END)
+        self.escaneos.encolar(codigo)
+        return "break"
+
+    def _aplicar_escaneos(self):
+        # el sondeo se reprograma siempre: un escaneo con error no detiene la pistola
+        try:
+            for lote in self.escaneos.resultados():
+                for codigo, cantidad, producto in lote:
+                    try:
+                        self.sumar_escaneo(codigo, cantidad, producto)
+                    except Exception:
+                        logging.exception(f"Error al agregar el código escaneado {codigo}")
+                        self.avisar_escaneo(f"No se pudo agregar {codigo}: revise el producto", error=True)
+                self.actualizar_totales()
+        finally:
+            self._sondeo_escaneos = self.root.after(scanner_input.INTERVALO_SONDEO_MS, self._aplicar_escaneos)
+
+    def sumar_escaneo(self, codigo, cantidad, producto):
+        """
+        Agrega lo escaneado sin pedir cantidad: un código que ya está en el carrito
+        (con el mismo precio) suma a su línea. Los avisos van a la barra de estado.
+        """
+        if not producto:
+            self.avisar_escaneo(f"Producto no encontrado: {codigo}", error=True)
+            return
+
+        precio = self.precio_lista(producto)
+        if precio is None:
+            self.avisar_escaneo(f"{producto['descripcion']} no tiene precio en la lista {self.lista_precio.get()}", error=True)
+            return
+
+        en_carrito = sum(item["cantidad"] for item in self.carrito if item["codigo"] == producto["codigo"])
+        if not self.modo_prueba.get() and en_carrito + cantidad > producto["stock"]:
+            disponible = max(producto["stock"] - en_carrito, 0)
+            self.avisar_escaneo(
+                f"Sin stock suficiente para {producto['descripcion']}: "
+                f"se agregaron {disponible} de {cantidad}", error=True
+            )
+            cantidad = disponible
+            if cantidad == 0:
+                return
+        else:
+            self.avisar_escaneo(f"{producto['descripcion']} x{cantidad}")
+
+        filas = self.tree.get_children()
+        for index, item in enumerate(self.carrito):
+            if item["codigo"] == producto["codigo"] and item["precio"] == precio:
+                item["cantidad"] += cantidad
+                item["total"] = item["cantidad"] * item["precio"]
+                self.tree.item(filas[index], values=(
+                    item["codigo"],
+                    item["descripcion"],
+                    item["cantidad"],
+                    item["precio"],
+                    item["total"]
+                ))
+                return
+
+        self.carrito.append({
+            "id": producto["id"],
+            "codigo": producto["codigo"],
+            "descripcion": producto["descripcion"],
+            "cantidad": cantidad,
+            "precio": precio,
+            "total": precio * cantidad
+        })
+        self.tree.insert("", tk.END, values=(
+            producto["codigo"],
+            producto["descripcion"],
+            cantidad,
+            precio,
+            precio * cantidad
+        ))
+
+    def avisar_escaneo(self, texto, error=False):
+        self.label_escaneo.config(text=texto, fg="#C0392B" if error else "#2E7D32")
+        if error:
+            self.root.bell()
+
 
     # =========================
     # AJUSTAR CANTIDAD (+1)
@@ -706,6 +797,10 @@ class POS:
             for item in self.carrito:
                 actualizar_stock(item["id"], item["cantidad"])
 
+            # la emisión corre en segundo plano: la caja no espera al SII
+            if self.emisor_dte is not None:
+                self.emisor_dte.despertar()
+
             messagebox.showinfo("Venta registrada", f"Venta ID: {venta_id}")
             self.vaciar_carrito()
 
@@ -726,7 +821,6 @@ class POS:
             WHERE descripcion LIKE ?
         """, ("%" + palabra + "%",))
         resultados = cur.fetchall()
-        conn.close()
 
         ventana = tk.Toplevel(self.root)
         ventana.title("Resultados de búsqueda")
@@ -803,6 +897,11 @@ class POS:
     # =========================
 
     def on_close(self):
+        self.root.after_cancel(self._sondeo_escaneos)
+        self.escaneos.detener()
+        self.exportador.detener()
+        if self.emisor_dte is not None:
+            self.emisor_dte.detener()
         if self.modo_prueba.get():
             messagebox.showinfo(
                 "Modo prueba",
@@ -811,7 +910,7 @@ class POS:
             self.root.destroy()
             return
 
-        if messagebox.askyesno("Cerrar día", "¿Deseas exportar las ventas del día a SAP antes de cerrar?"):
+        if messagebox.askyesno("Cerrar día", "¿Deseas exportar a SAP las ventas pendientes antes de cerrar?"):
             exportar_sap_diario()
 
         self.root.destroy()
@@ -1,5 +1,8 @@
+import re
 import datetime
 import xml.etree.ElementTree as ET
+from functools import lru_cache
+from collections import Counter
 
 
 # =========================
@@ -16,18 +19,130 @@ EMISOR = {
 }
 
 
+ENCODING_DTE = "ISO-8859-1"
+SII_NS = "http://www.sii.cl/SiiDte"
+DECLARACION_XML = b'<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+
+
 # =========================
 # CONSTRUCTOR DE DTE (BOLETA ELECTRÓNICA)
 # =========================
+# build_boleta_xml arma el XML por plantilla: los bloques fijos (emisor, receptor
+# genérico) se codifican una vez y se reutilizan, y el resto se escribe como texto
+# con el mismo escape que ElementTree. build_boleta_xml_arbol es la construcción
+# con ElementTree que sirve de referencia: ambas deben dar exactamente los mismos bytes
+# (ver benchmark_dte_xml.py).
+
+def _esc(valor):
+    # mismo escape que ElementTree para el texto de un elemento
+    texto = str(valor)
+    if "&" in texto:
+        texto = texto.replace("&", "&amp;")
+    if "<" in texto:
+        texto = texto.replace("<", "&lt;")
+    if ">" in texto:
+        texto = texto.replace(">", "&gt;")
+    return texto
+
+
+def _tag(nombre, valor):
+    texto = _esc(valor)
+    # ElementTree escribe <X /> cuando el texto es vacío
+    return f"<{nombre}>{texto}</{nombre}>" if texto else f"<{nombre} />"
+
+
+def _codificar(texto):
+    # caracteres fuera de ISO-8859-1 como referencia numérica, igual que ET.tostring
+    return texto.encode(ENCODING_DTE, "xmlcharrefreplace")
+
+
+@lru_cache(maxsize=32)
+def _bloque_emisor(rut, razon_social, giro, direccion, comuna, ciudad):
+    return _codificar(
+        "<Emisor>"
+        + _tag("RUTEmisor", rut)
+        + _tag("RznSoc", razon_social)
+        + _tag("GiroEmis", giro)
+        + _tag("DirOrigen", direccion)
+        + _tag("CmnaOrigen", comuna)
+        + _tag("CiudadOrigen", ciudad)
+        + "</Emisor>"
+    )
+
+
+@lru_cache(maxsize=256)
+def _bloque_receptor(rut, razon_social):
+    return _codificar("<Receptor>" + _tag("RUTRecep", rut) + _tag("RznSocRecep", razon_social) + "</Receptor>")
 
-def build_boleta_xml(folio, emisor, receptor, items, totales, tipo_dte=39):
+
+def _marca_firma(instante=None):
+    return (instante or datetime.datetime.now()).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def id_documento(folio, tipo_dte=39):
+    """ID del nodo Documento, único por tipo y folio (la firma del DTE lo referencia)."""
+    return f"F{folio}T{tipo_dte}"
+
+
+def build_boleta_xml(folio, emisor, receptor, items, totales, tipo_dte=39, fch_emis=None,
+                     ted=None, tmst_firma=None):
     """
-    Construye el XML base de una boleta electrónica (DTE tipo 39).
+    Construye el XML base de una boleta electrónica (DTE tipo 39), en ISO-8859-1.
+    fch_emis: fecha de emisión (date); por defecto hoy.
+    ted: nodo TED ya firmado (dte_timbre.build_ted); con él se agrega también
+    TmstFirma (tmst_firma, datetime; por defecto ahora).
+    """
+    fecha = (fch_emis or datetime.date.today()).strftime("%Y-%m-%d")
+
+    apertura = (
+        f'<DTE xmlns="{SII_NS}" version="1.0"><Documento ID="{_esc(id_documento(folio, tipo_dte))}"><Encabezado><IdDoc>'
+        f"<TipoDTE>{tipo_dte}</TipoDTE>"
+        + _tag("Folio", folio)
+        + f"<FchEmis>{fecha}</FchEmis></IdDoc>"
+    )
+
+    cuerpo = [
+        "<Totales>",
+        _tag("MntNeto", totales["MntNeto"]),
+        _tag("IVA", totales["IVA"]),
+        _tag("MntTotal", totales["MntTotal"]),
+        "</Totales></Encabezado>",
+    ]
+    for item in items:
+        cuerpo.append(
+            "<Detalle>"
+            + _tag("NroLinDet", item["NroLinDet"])
+            + _tag("NmbItem", item["NmbItem"])
+            + _tag("QtyItem", item["QtyItem"])
+            + _tag("PrcItem", item["PrcItem"])
+            + _tag("MontoItem", item["MontoItem"])
+            + "</Detalle>"
+        )
+    cierre = "</Documento></DTE>"
+    if ted is not None:
+        cierre = _tag("TmstFirma", _marca_firma(tmst_firma)) + cierre
+
+    return b"".join((
+        DECLARACION_XML,
+        _codificar(apertura),
+        _bloque_emisor(emisor["rut"], emisor["razon_social"], emisor["giro"],
+                       emisor["direccion"], emisor["comuna"], emisor["ciudad"]),
+        _bloque_receptor(receptor["rut"], receptor["razon_social"]),
+        _codificar("".join(cuerpo)),
+        ted or b"",
+        _codificar(cierre),
+    ))
+
+
+def build_boleta_xml_arbol(folio, emisor, receptor, items, totales, tipo_dte=39, fch_emis=None,
+                           ted=None, tmst_firma=None):
+    """
+    Misma boleta que build_boleta_xml, construida nodo a nodo con ElementTree (referencia).
     """
 
     # Raíz DTE
-    dte = ET.Element("DTE", attrib={"version": "1.0"})
-    documento = ET.SubElement(dte, "Documento", attrib={"ID": f"DTE{tipo_dte}"})
+    dte = ET.Element("DTE", attrib={"xmlns": SII_NS, "version": "1.0"})
+    documento = ET.SubElement(dte, "Documento", attrib={"ID": id_documento(folio, tipo_dte)})
 
     # ===== Encabezado =====
     encabezado = ET.SubElement(documento, "Encabezado")
@@ -36,7 +151,7 @@ def build_boleta_xml(folio, emisor, receptor, items, totales, tipo_dte=39):
     iddoc = ET.SubElement(encabezado, "IdDoc")
     ET.SubElement(iddoc, "TipoDTE").text = str(tipo_dte)
     ET.SubElement(iddoc, "Folio").text = str(folio)
-    ET.SubElement(iddoc, "FchEmis").text = datetime.date.today().strftime("%Y-%m-%d")
+    ET.SubElement(iddoc, "FchEmis").text = (fch_emis or datetime.date.today()).strftime("%Y-%m-%d")
 
     # Emisor
     emisor_xml = ET.SubElement(encabezado, "Emisor")
@@ -67,11 +182,102 @@ def build_boleta_xml(folio, emisor, receptor, items, totales, tipo_dte=39):
         ET.SubElement(det, "PrcItem").text = str(item["PrcItem"])
         ET.SubElement(det, "MontoItem").text = str(item["MontoItem"])
 
-    # Convertir a string con declaración XML
-    xml_bytes = ET.tostring(dte, encoding="utf-8")
-    xml_str = b'<?xml version="1.0" encoding="ISO-8859-1"?>\n' + xml_bytes
+    # ===== Timbre =====
+    if ted is not None:
+        documento.append(ET.fromstring(ted, parser=ET.XMLParser(encoding=ENCODING_DTE)))
+        ET.SubElement(documento, "TmstFirma").text = _marca_firma(tmst_firma)
+
+    # Convertir a bytes en la misma codificación que declara el encabezado XML
+    xml_str = ET.tostring(dte, encoding="unicode")
+    return DECLARACION_XML + _codificar(xml_str)
+
+
+# =========================
+# SOBRE DE ENVÍO (EnvioBOLETA)
+# =========================
+# Un sobre agrupa muchos DTE ya firmados en un solo upload al SII.
+# Los DTE se insertan como bytes, sin volver a parsearlos: re-serializarlos
+# podría alterar espacios o prefijos y romper su firma. Cada DTE firma solo su
+# Documento (#F{folio}T{tipo}) y el sobre firma el SetDTE (#SetDoc); como el DTE
+# y el sobre declaran el mismo namespace del SII, la firma del DTE sigue siendo
+# válida dentro del sobre.
+
+RUT_SII = "60803000-K"
+MAX_DTE_ENVIO = 500                     # documentos por sobre
+MAX_BYTES_ENVIO = 4 * 1024 * 1024       # tamaño máximo del sobre
+SET_ID_ENVIO = "SetDoc"                 # ID del SetDTE, referenciado por la firma del sobre
+
+_DECLARACION_RE = re.compile(rb"^\s*<\?xml[^>]*\?>\s*")
+_TIPO_DTE_RE = re.compile(rb"<TipoDTE>\s*(\d+)\s*</TipoDTE>")
+_ID_DOCUMENTO_RE = re.compile(rb"<Documento\s+ID=\"([^\"]*)\"")
+
+
+def _sin_declaracion(xml_bytes):
+    return _DECLARACION_RE.sub(b"", xml_bytes, count=1)
 
-    return xml_str
+
+def build_envio_boleta(dtes_firmados, emisor, rut_envia, fch_resol, nro_resol, set_id=SET_ID_ENVIO):
+    """
+    Construye el sobre EnvioBOLETA (sin firmar) con la Caratula y un SubTotDTE por tipo.
+    Se firma con reference_uri=f"#{set_id}".
+    - dtes_firmados: XML de cada DTE ya firmado (bytes, ISO-8859-1)
+    - rut_envia: RUT de la persona dueña del certificado que firma el sobre
+    - fch_resol / nro_resol: resolución de autorización del SII (nro 0 = certificación)
+    """
+    subtotales = Counter()
+    cuerpos = []
+    for xml in dtes_firmados:
+        tipo = _TIPO_DTE_RE.search(xml)
+        if tipo is None:
+            raise ValueError("DTE sin TipoDTE: no se puede incluir en el sobre")
+        subtotales[int(tipo.group(1))] += 1
+        cuerpos.append(_sin_declaracion(xml))
+
+    ids = _ID_DOCUMENTO_RE.findall(b"".join(cuerpos))
+    if len(set(ids)) != len(ids):
+        raise ValueError("DTE con el mismo ID de Documento en un sobre: revise folios y tipos")
+
+    caratula = ET.Element("Caratula", attrib={"version": "1.0"})
+    ET.SubElement(caratula, "RutEmisor").text = emisor["rut"]
+    ET.SubElement(caratula, "RutEnvia").text = rut_envia
+    ET.SubElement(caratula, "RutReceptor").text = RUT_SII
+    ET.SubElement(caratula, "FchResol").text = str(fch_resol)
+    ET.SubElement(caratula, "NroResol").text = str(nro_resol)
+    ET.SubElement(caratula, "TmstFirmaEnv").text = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    for tipo in sorted(subtotales):
+        subtot = ET.SubElement(caratula, "SubTotDTE")
+        ET.SubElement(subtot, "TpoDTE").text = str(tipo)
+        ET.SubElement(subtot, "NroDTE").text = str(subtotales[tipo])
+
+    caratula_bytes = _codificar(ET.tostring(caratula, encoding="unicode"))
+
+    return b"".join([
+        DECLARACION_XML,
+        f'<EnvioBOLETA xmlns="{SII_NS}" version="1.0">'.encode("ascii"),
+        f'<SetDTE ID="{set_id}">'.encode("ascii"),
+        caratula_bytes,
+        *cuerpos,
+        b"</SetDTE></EnvioBOLETA>",
+    ])
+
+
+def armar_lotes(dtes_firmados, max_docs=MAX_DTE_ENVIO, max_bytes=MAX_BYTES_ENVIO):
+    """
+    Reparte los DTE en lotes que respetan ambos límites y genera la lista de
+    índices (posiciones en dtes_firmados) de cada lote, en orden.
+    Un DTE que por sí solo supera max_bytes va en un lote propio.
+    """
+    lote = []
+    tam = 0
+    for i, xml in enumerate(dtes_firmados):
+        if lote and (len(lote) >= max_docs or tam + len(xml) > max_bytes):
+            yield lote
+            lote = []
+            tam = 0
+        lote.append(i)
+        tam += len(xml)
+    if lote:
+        yield lote
 
 
 # =========================
@@ -0,0 +1,471 @@
+# dte_outbox.py
+# Cola persistente de boletas electrónicas por emitir (tabla dte_outbox).
+# registrar_venta solo inserta la fila en la misma transacción de la venta, así la
+# caja no espera al SII y una caída de red no pierde el documento. Un hilo aparte
+# arma, firma y sube las boletas en sobres, y consulta si el SII las aceptó.
+#
+# Estados por venta:
+#   sin_firmar -> firmado -> enviado (con TRACKID) -> aceptado | rechazado
+# El folio sale de los rangos autorizados por el SII (CAF, tabla dte_caf) y lo
+# asigna el hilo emisor antes de firmar, en una transacción IMMEDIATE: aunque
+# haya más de un proceso sobre la misma BD, un folio no se entrega dos veces.
+# Una venta sin folio disponible (CAF agotado o no cargado) espera en la cola
+# hasta que se cargue un CAF nuevo. Al firmar, cada boleta lleva el timbre (TED)
+# hecho con la llave del CAF de su folio (dte_timbre).
+# Cada paso se guarda antes de intentar el siguiente: un reintento retoma desde
+# el último estado guardado y nunca vuelve a armar, firmar ni subir lo ya hecho.
+# Los sobres EnvioBOLETA se guardan firmados (tabla dte_envios) antes de subirlos:
+# si el upload falla o se pierde la respuesta, se vuelve a subir el mismo sobre,
+# con los mismos documentos y los mismos bytes, en vez de armar uno nuevo.
+
+import time
+import logging
+import datetime
+import threading
+
+import requests
+
+from db_connection import get_connection
+from dte_builder import EMISOR, MAX_DTE_ENVIO, build_boleta_xml, id_documento
+from dte_signer import firmar_xml
+from dte_timbre import CAF, build_ted
+from dte_sender import ClienteSII, ErrorSII, ESTADOS_ENVIO_ACEPTADO, ESTADOS_ENVIO_RECHAZADO
+
+TIPO_BOLETA = 39
+RECEPTOR_GENERICO = {
+    "rut": "66666666-6",
+    "razon_social": "CONSUMIDOR FINAL"
+}
+
+INTERVALO_EMISION_S = 15
+BACKOFF_BASE_S = 30
+BACKOFF_MAX_S = 30 * 60
+BACKOFF_MAX_EXPONENTE = 10    # 2**10 * BACKOFF_BASE_S ya supera BACKOFF_MAX_S
+ESPERA_ESTADO_S = 60          # primera consulta de estado tras subir un sobre
+
+OUTBOX_SQL = """
+    CREATE TABLE IF NOT EXISTS dte_outbox (
+        venta_id INTEGER PRIMARY KEY,
+        tipo_dte INTEGER NOT NULL,
+        folio INTEGER,
+        estado TEXT NOT NULL DEFAULT 'sin_firmar',
+        xml BLOB,
+        track_id TEXT,
+        intentos INTEGER NOT NULL DEFAULT 0,
+        proximo_intento REAL NOT NULL DEFAULT 0,
+        ultimo_error TEXT,
+        creado TEXT,
+        actualizado TEXT,
+        envio_id INTEGER,
+        UNIQUE (tipo_dte, folio)
+    )
+"""
+
+# columnas agregadas después de la primera versión de la cola (BD ya existentes)
+OUTBOX_COLUMNAS_NUEVAS = {
+    "envio_id": "ALTER TABLE dte_outbox ADD COLUMN envio_id INTEGER",
+}
+
+OUTBOX_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_dte_outbox_estado ON dte_outbox(estado, proximo_intento)"
+
+ENVIOS_SQL = """
+    CREATE TABLE IF NOT EXISTS dte_envios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sobre BLOB NOT NULL,
+        track_id TEXT,
+        creado TEXT,
+        actualizado TEXT
+    )
+"""
+
+CAF_SQL = """
+    CREATE TABLE IF NOT EXISTS dte_caf (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo_dte INTEGER NOT NULL,
+        desde INTEGER NOT NULL,
+        hasta INTEGER NOT NULL,
+        siguiente INTEGER NOT NULL,
+        xml BLOB NOT NULL,
+        cargado TEXT,
+        UNIQUE (tipo_dte, desde)
+    )
+"""
+
+
+def _ahora():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def asegurar_tabla(cur):
+    cur.execute(OUTBOX_SQL)
+    existentes = {r[1] for r in cur.execute("PRAGMA table_info(dte_outbox)").fetchall()}
+    for columna, ddl in OUTBOX_COLUMNAS_NUEVAS.items():
+        if columna not in existentes:
+            cur.execute(ddl)
+    cur.execute(OUTBOX_INDEX_SQL)
+    cur.execute(ENVIOS_SQL)
+    cur.execute(CAF_SQL)
+
+
+# =========================
+# CAF (RANGOS DE FOLIOS AUTORIZADOS)
+# =========================
+
+def _rut_sin_formato(rut):
+    return (rut or "").replace(".", "").strip().upper()
+
+
+def cargar_caf(conn, ruta_xml, rut_emisor=EMISOR["rut"]):
+    """
+    Registra el rango de folios de un CAF. Cargar dos veces el mismo CAF no hace nada;
+    un CAF de otro RUT o que se cruza con un rango ya cargado se rechaza (ValueError).
+    """
+    with open(ruta_xml, "rb") as f:
+        xml = f.read()
+    caf = CAF(xml)
+    if _rut_sin_formato(caf.rut) != _rut_sin_formato(rut_emisor):
+        raise ValueError(f"CAF del RUT {caf.rut}, no del emisor {rut_emisor}")
+
+    cur = conn.cursor()
+    asegurar_tabla(cur)
+    cur.execute("""
+        SELECT desde, hasta FROM dte_caf
+        WHERE tipo_dte = ? AND desde <= ? AND hasta >= ? AND NOT (desde = ? AND hasta = ?)
+    """, (caf.tipo_dte, caf.hasta, caf.desde, caf.desde, caf.hasta))
+    cruce = cur.fetchone()
+    if cruce:
+        raise ValueError(f"CAF {caf.desde}-{caf.hasta} se cruza con el rango ya cargado {cruce[0]}-{cruce[1]}")
+    cur.execute("""
+        INSERT OR IGNORE INTO dte_caf (tipo_dte, desde, hasta, siguiente, xml, cargado)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (caf.tipo_dte, caf.desde, caf.hasta, caf.desde, xml, _ahora()))
+    conn.commit()
+    return caf
+
+
+def asignar_folios(conn):
+    """
+    Da folio a las boletas encoladas que no tienen, en orden de venta, desde el
+    CAF vigente de menor rango. Devuelve la cantidad de folios asignados.
+    """
+    cur = conn.cursor()
+    asegurar_tabla(cur)
+    conn.commit()
+    # IMMEDIATE: toma el lock de escritura antes de leer los contadores de folio
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute("SELECT venta_id, tipo_dte FROM dte_outbox WHERE folio IS NULL ORDER BY venta_id")
+        asignados = 0
+        sin_caf = set()
+        for venta_id, tipo_dte in cur.fetchall():
+            if tipo_dte in sin_caf:
+                continue
+            caf = conn.execute("""
+                SELECT id, siguiente FROM dte_caf
+                WHERE tipo_dte = ? AND siguiente <= hasta
+                ORDER BY desde LIMIT 1
+            """, (tipo_dte,)).fetchone()
+            if caf is None:
+                sin_caf.add(tipo_dte)
+                continue
+            conn.execute("UPDATE dte_caf SET siguiente = siguiente + 1 WHERE id = ?", (caf[0],))
+            conn.execute("UPDATE dte_outbox SET folio = ?, actualizado = ? WHERE venta_id = ?",
+                         (caf[1], _ahora(), venta_id))
+            asignados += 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for tipo_dte in sin_caf:
+        logging.warning(f"DTE: no hay folios disponibles para el tipo {tipo_dte}; cargue un CAF nuevo")
+    return asignados
+
+
+# =========================
+# ENCOLAR (DENTRO DE LA TRANSACCIÓN DE LA VENTA)
+# =========================
+
+def encolar_venta(cur, venta_id, tipo_dte=TIPO_BOLETA):
+    """
+    Agrega la venta a la cola, todavía sin folio (lo asigna asignar_folios desde el CAF).
+    No hace commit: se llama antes del commit de registrar_venta.
+    Encolar dos veces la misma venta no crea otro documento.
+    """
+    asegurar_tabla(cur)
+    cur.execute("""
+        INSERT OR IGNORE INTO dte_outbox (venta_id, tipo_dte, creado, actualizado)
+        VALUES (?, ?, ?, ?)
+    """, (venta_id, tipo_dte, _ahora(), _ahora()))
+
+
+def resumen(conn):
+    """{estado: cantidad} de la cola."""
+    cur = conn.cursor()
+    asegurar_tabla(cur)
+    cur.execute("SELECT estado, COUNT(*) FROM dte_outbox GROUP BY estado")
+    return dict(cur.fetchall())
+
+
+# =========================
+# PASOS DE LA COLA
+# =========================
+
+def _reintentar(conn, venta_ids, error):
+    # deja el documento en su estado actual y lo reprograma con espera exponencial:
+    # BACKOFF_BASE_S, el doble en cada fallo, hasta BACKOFF_MAX_S.
+    # El exponente se limita antes de desplazar: en SQLite 1 << 63 es negativo
+    # y 1 << 64 es 0, y tras una caída larga del SII se reintentaría en cada pasada.
+    ahora = time.time()
+    cur = conn.cursor()
+    for venta_id in venta_ids:
+        cur.execute("""
+            UPDATE dte_outbox
+            SET intentos = intentos + 1,
+                proximo_intento = ? + MIN(? * (1 << MIN(intentos, ?)), ?),
+                ultimo_error = ?, actualizado = ?
+            WHERE venta_id = ?
+        """, (ahora, BACKOFF_BASE_S, BACKOFF_MAX_EXPONENTE, BACKOFF_MAX_S, str(error)[:500], _ahora(), venta_id))
+    conn.commit()
+
+
+def _caf_del_folio(cur, folio, tipo_dte, cafs):
+    # cafs: caché {id: CAF} de la pasada, la llave del CAF se lee una sola vez
+    cur.execute("SELECT id, xml FROM dte_caf WHERE tipo_dte = ? AND ? BETWEEN desde AND hasta",
+                (tipo_dte, folio))
+    fila = cur.fetchone()
+    if fila is None:
+        raise ValueError(f"No hay CAF cargado para el folio {folio} (tipo {tipo_dte})")
+    if fila[0] not in cafs:
+        cafs[fila[0]] = CAF(bytes(fila[1]))
+    return cafs[fila[0]]
+
+
+def _armar_boleta(cur, venta_id, folio, tipo_dte, emisor, caf):
+    cur.execute("SELECT fecha, total_neto, total_iva, total_total FROM ventas WHERE id = ?", (venta_id,))
+    fecha, neto, iva, total = cur.fetchone()
+    cur.execute("""
+        SELECT descripcion, cantidad, precio_unitario, total_linea
+        FROM ventas_detalle WHERE venta_id = ? ORDER BY id
+    """, (venta_id,))
+    items = [
+        {
+            "NroLinDet": n,
+            "NmbItem": descripcion,
+            "QtyItem": cantidad,
+            "PrcItem": int(round(precio)),
+            "MontoItem": int(round(total_linea))
+        }
+        for n, (descripcion, cantidad, precio, total_linea) in enumerate(cur.fetchall(), start=1)
+    ]
+    totales = {"MntNeto": int(round(neto)), "IVA": int(round(iva)), "MntTotal": int(round(total))}
+    fch_emis = datetime.datetime.strptime(fecha[:10], "%Y-%m-%d").date()
+    ted = build_ted(caf, folio, fch_emis, RECEPTOR_GENERICO, totales["MntTotal"], items[0]["NmbItem"])
+    return build_boleta_xml(folio, emisor, RECEPTOR_GENERICO, items, totales, tipo_dte, fch_emis, ted=ted)
+
+
+def firmar_pendientes(conn, cliente, emisor=EMISOR, lote=MAX_DTE_ENVIO):
+    """sin_firmar -> firmado. Devuelve la cantidad de documentos firmados."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT venta_id, folio, tipo_dte FROM dte_outbox
+        WHERE estado = 'sin_firmar' AND folio IS NOT NULL AND proximo_intento <= ?
+        ORDER BY venta_id LIMIT ?
+    """, (time.time(), lote))
+    firmados = 0
+    cafs = {}
+    for venta_id, folio, tipo_dte in cur.fetchall():
+        try:
+            caf = _caf_del_folio(conn.cursor(), folio, tipo_dte, cafs)
+            xml = _armar_boleta(conn.cursor(), venta_id, folio, tipo_dte, emisor, caf)
+            xml_firmado = firmar_xml(xml, cliente.private_key, cliente.certificate,
+                                     reference_uri=f"#{id_documento(folio, tipo_dte)}")
+        except Exception as e:
+            logging.exception(f"No se pudo firmar la boleta de la venta {venta_id}")
+            _reintentar(conn, [venta_id], e)
+            continue
+        conn.execute("""
+            UPDATE dte_outbox
+            SET estado = 'firmado', xml = ?, intentos = 0, proximo_intento = 0,
+                ultimo_error = NULL, actualizado = ?
+            WHERE venta_id = ? AND estado = 'sin_firmar'
+        """, (xml_firmado, _ahora(), venta_id))
+        conn.commit()
+        firmados += 1
+    return firmados
+
+
+def _armar_envios(conn, cliente, rut_envia, fch_resol, nro_resol, emisor, lote):
+    # firmado sin sobre -> sobre armado, firmado y guardado en dte_envios, antes de subirlo
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT venta_id, xml FROM dte_outbox
+        WHERE estado = 'firmado' AND envio_id IS NULL AND proximo_intento <= ?
+        ORDER BY venta_id LIMIT ?
+    """, (time.time(), lote))
+    filas = cur.fetchall()
+    venta_ids = [f[0] for f in filas]
+    for indices, sobre in cliente.armar_sobres([bytes(f[1]) for f in filas], rut_envia,
+                                               fch_resol, nro_resol, emisor):
+        cur.execute("INSERT INTO dte_envios (sobre, creado, actualizado) VALUES (?, ?, ?)",
+                    (sobre, _ahora(), _ahora()))
+        envio_id = cur.lastrowid
+        cur.executemany("UPDATE dte_outbox SET envio_id = ?, actualizado = ? WHERE venta_id = ?",
+                        [(envio_id, _ahora(), venta_ids[i]) for i in indices])
+        conn.commit()
+
+
+def enviar_firmados(conn, cliente, rut_envia, fch_resol, nro_resol, emisor=EMISOR, lote=MAX_DTE_ENVIO):
+    """firmado -> enviado, en sobres EnvioBOLETA. Devuelve la cantidad de documentos enviados."""
+    try:
+        _armar_envios(conn, cliente, rut_envia, fch_resol, nro_resol, emisor, lote)
+    except Exception as e:
+        logging.exception("DTE: no se pudieron armar los sobres, se reintentará")
+        conn.rollback()
+        cur = conn.execute("""
+            SELECT venta_id FROM dte_outbox
+            WHERE estado = 'firmado' AND envio_id IS NULL AND proximo_intento <= ?
+        """, (time.time(),))
+        _reintentar(conn, [v for (v,) in cur.fetchall()], e)
+
+    # sobres guardados y sin TRACKID: los recién armados y los de uploads fallidos
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT e.id, e.sobre, GROUP_CONCAT(o.venta_id)
+        FROM dte_envios e JOIN dte_outbox o ON o.envio_id = e.id
+        WHERE e.track_id IS NULL AND o.estado = 'firmado'
+        GROUP BY e.id
+        HAVING MAX(o.proximo_intento) <= ?
+        ORDER BY e.id
+    """, (time.time(),))
+    enviados = 0
+    for envio_id, sobre, ids in cur.fetchall():
+        venta_ids = [int(v) for v in ids.split(",")]
+        try:
+            track_id = cliente.enviar_dte(bytes(sobre), nombre=f"envio_{envio_id}.xml")
+        except (ErrorSII, requests.RequestException) as e:
+            logging.warning(f"DTE: envío del sobre {envio_id} fallido, se reintentará ({e})")
+            _reintentar(conn, venta_ids, e)
+            continue
+        except Exception as e:
+            # respuesta del SII ilegible u otro error inesperado: el sobre queda
+            # reprogramado, no se reintenta en cada pasada
+            logging.exception(f"DTE: error inesperado en el envío del sobre {envio_id}, se reintentará")
+            _reintentar(conn, venta_ids, e)
+            continue
+        conn.execute("UPDATE dte_envios SET track_id = ?, actualizado = ? WHERE id = ?",
+                     (track_id, _ahora(), envio_id))
+        conn.execute("""
+            UPDATE dte_outbox
+            SET estado = 'enviado', track_id = ?, intentos = 0, proximo_intento = ?,
+                ultimo_error = NULL, actualizado = ?
+            WHERE envio_id = ? AND estado = 'firmado'
+        """, (track_id, time.time() + ESPERA_ESTADO_S, _ahora(), envio_id))
+        conn.commit()
+        enviados += len(venta_ids)
+        logging.info(f"DTE: {len(venta_ids)} boleta(s) enviadas, TRACKID {track_id}")
+    return enviados
+
+
+def consultar_enviados(conn, cliente, emisor=EMISOR):
+    """enviado -> aceptado | rechazado según el estado del sobre. Devuelve los TRACKID resueltos."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT track_id, GROUP_CONCAT(venta_id) FROM dte_outbox
+        WHERE estado = 'enviado' AND proximo_intento <= ?
+        GROUP BY track_id
+    """, (time.time(),))
+    resueltos = 0
+    for track_id, ids in cur.fetchall():
+        venta_ids = [int(v) for v in ids.split(",")]
+        try:
+            estado = cliente.estado_envio(track_id, emisor["rut"])
+        except (ErrorSII, requests.RequestException) as e:
+            _reintentar(conn, venta_ids, e)
+            continue
+        except Exception as e:
+            logging.exception(f"DTE: error inesperado al consultar el envío {track_id}")
+            _reintentar(conn, venta_ids, e)
+            continue
+
+        if estado in ESTADOS_ENVIO_ACEPTADO or estado in ESTADOS_ENVIO_RECHAZADO:
+            nuevo = "aceptado" if estado in ESTADOS_ENVIO_ACEPTADO else "rechazado"
+            conn.execute("""
+                UPDATE dte_outbox SET estado = ?, ultimo_error = ?, actualizado = ?
+                WHERE track_id = ? AND estado = 'enviado'
+            """, (nuevo, None if nuevo == "aceptado" else f"ESTADO {estado}", _ahora(), track_id))
+            conn.commit()
+            resueltos += 1
+            if nuevo == "rechazado":
+                logging.error(f"DTE: envío {track_id} rechazado por el SII (ESTADO {estado})")
+        else:
+            # todavía en proceso en el SII
+            _reintentar(conn, venta_ids, f"ESTADO {estado}")
+    return resueltos
+
+
+def procesar_pendientes(conn, cliente, rut_envia, fch_resol, nro_resol, emisor=EMISOR):
+    """Una pasada completa de la cola. Devuelve (firmados, enviados, envios_resueltos)."""
+    asegurar_tabla(conn.cursor())
+    asignar_folios(conn)
+    firmados = firmar_pendientes(conn, cliente, emisor)
+    enviados = enviar_firmados(conn, cliente, rut_envia, fch_resol, nro_resol, emisor)
+    resueltos = consultar_enviados(conn, cliente, emisor)
+    return firmados, enviados, resueltos
+
+
+# =========================
+# HILO EMISOR
+# =========================
+
+class EmisorDTE:
+    """
+    Hilo en segundo plano que vacía la cola cada intervalo_s segundos, o antes
+    si se llama a despertar() (p.ej. recién registrada una venta). Usa su propia
+    conexión (get_connection es por hilo) y una sola sesión con el SII.
+    """
+
+    def __init__(self, db_file, cliente, rut_envia, fch_resol, nro_resol,
+                 emisor=EMISOR, intervalo_s=INTERVALO_EMISION_S):
+        self.db_file = db_file
+        self.cliente = cliente
+        self.rut_envia = rut_envia
+        self.fch_resol = fch_resol
+        self.nro_resol = nro_resol
+        self.emisor = emisor
+        self.intervalo_s = intervalo_s
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    @classmethod
+    def desde_pfx(cls, db_file, ruta_pfx, password, rut_envia, fch_resol, nro_resol, urls=None, **opciones):
+        return cls(db_file, ClienteSII.desde_pfx(ruta_pfx, password, urls=urls),
+                   rut_envia, fch_resol, nro_resol, **opciones)
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="dte-emisor", daemon=True)
+            self._hilo.start()
+
+    def despertar(self):
+        self._despertar.set()
+
+    def procesar(self):
+        return procesar_pendientes(get_connection(self.db_file), self.cliente,
+                                   self.rut_envia, self.fch_resol, self.nro_resol, self.emisor)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.procesar()
+            except Exception:
+                logging.exception("Error en la emisión de boletas electrónicas")
+            self._despertar.wait(self.intervalo_s)
+            self._despertar.clear()
+
+    def detener(self):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=30)
+        self.cliente.cerrar()
@@ -1,38 +1,55 @@
 # dte_sender.py
+import time
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
 from lxml import etree
-from signxml import XMLSigner
-from cryptography.hazmat.primitives.serialization import pkcs12
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
+
+# el .pfx se carga y descifra una sola vez en dte_signer (se re-exporta aquí)
+from dte_signer import cargar_certificado_pfx, firmar_xml
+from dte_builder import EMISOR, MAX_DTE_ENVIO, MAX_BYTES_ENVIO, SET_ID_ENVIO, build_envio_boleta, armar_lotes
 
 
 URL_SEMILLA = "https://palena.sii.cl/DTEWS/CrSeed.jws"
 URL_TOKEN = "https://palena.sii.cl/DTEWS/GetTokenFromSeed.jws"
 URL_UPLOAD = "https://palena.sii.cl/cgi_dte/UPL/DTEUpload"
+URL_ESTADO = "https://palena.sii.cl/DTEWS/QueryEstUp.jws"
 
+URLS_SII = {
+    "semilla": URL_SEMILLA,
+    "token": URL_TOKEN,
+    "upload": URL_UPLOAD,
+    "estado": URL_ESTADO,
+}
+
+TOKEN_TTL_S = 60 * 60        # vigencia asumida del token
+TOKEN_MARGEN_S = 5 * 60      # se renueva antes de vencer
+TIMEOUT_S = 30
+
+# STATUS de DTEUpload que indica token inválido o vencido
+STATUS_NO_AUTENTICADO = "5"
+# ESTADO de QueryEstUp por token inexistente, inválido o vencido
+ESTADOS_TOKEN_INVALIDO = {"001", "002", "003"}
+
+# ESTADO del envío (QueryEstUp): procesado, rechazado o todavía en proceso (REC, SOK, ...)
+ESTADOS_ENVIO_ACEPTADO = {"EPR"}
+ESTADOS_ENVIO_RECHAZADO = {"RCT", "RCH", "RFR", "RSC", "RPT", "VOF"}
 
-# ============================================================
-# CARGAR CERTIFICADO
-# ============================================================
-def cargar_certificado_pfx(ruta_pfx, password):
-    with open(ruta_pfx, "rb") as f:
-        pfx_data = f.read()
 
-    private_key, certificate, _ = pkcs12.load_key_and_certificates(
-        pfx_data,
-        password.encode(),
-        backend=default_backend()
-    )
+class ErrorSII(Exception):
+    pass
 
-    return private_key, certificate
+
+class ErrorAutenticacionSII(ErrorSII):
+    """El SII rechazó el token (HTTP 401/403, STATUS 5 en el upload o ESTADO 001-003 en la consulta)."""
 
 
 # ============================================================
 # 1) OBTENER SEMILLA
 # ============================================================
-def obtener_semilla():
-    resp = requests.get(URL_SEMILLA)
+def obtener_semilla(session=requests, url=URL_SEMILLA, timeout=TIMEOUT_S):
+    resp = session.get(url, timeout=timeout)
     xml = etree.fromstring(resp.content)
     semilla = xml.xpath("//SEMILLA/text()")[0]
     return semilla
@@ -50,49 +67,179 @@ def firmar_semilla(semilla, private_key, certificate):
     </getToken>
     """
 
-    xml_tree = etree.fromstring(xml.encode("ISO-8859-1"))
-
-    # Convertir certificado a DER
-    cert_der = certificate.public_bytes(
-        encoding=serialization.Encoding.DER
-    )
-
-    signer = XMLSigner(
-        signature_algorithm="rsa-sha256",
-        digest_algorithm="sha256"
-    )
-
-    signed = signer.sign(xml_tree, key=private_key, cert=cert_der)
-    return etree.tostring(signed, encoding="ISO-8859-1")
+    # mismo contexto de firma que los DTE: KeyInfo con el certificado en DER (base64),
+    # sin volver a armar el XMLSigner en cada renovación del token
+    return firmar_xml(xml.encode("ISO-8859-1"), private_key, certificate)
 
 
 # ============================================================
 # 3) OBTENER TOKEN
 # ============================================================
-def obtener_token(semilla_firmada):
+def obtener_token(semilla_firmada, session=requests, url=URL_TOKEN, timeout=TIMEOUT_S):
     headers = {"Content-Type": "text/xml"}
-    resp = requests.post(URL_TOKEN, data=semilla_firmada, headers=headers)
+    resp = session.post(url, data=semilla_firmada, headers=headers, timeout=timeout)
 
     xml = etree.fromstring(resp.content)
-    token = xml.xpath("//TOKEN/text()")[0]
-    return token
+    token = xml.xpath("//TOKEN/text()")
+    if not token:
+        raise ErrorSII(f"El SII no entregó token (HTTP {resp.status_code})")
+    return token[0]
 
 
 # ============================================================
 # 4) SUBIR DTE FIRMADO
 # ============================================================
-def enviar_dte(xml_firmado, token):
+def enviar_dte(xml_firmado, token, session=requests, url=URL_UPLOAD, timeout=TIMEOUT_S, nombre="dte.xml"):
     headers = {
         "Cookie": f"TOKEN={token}"
     }
 
     files = {
-        "archivo": ("dte.xml", xml_firmado, "text/xml")
+        "archivo": (nombre, xml_firmado, "text/xml")
     }
 
-    resp = requests.post(URL_UPLOAD, files=files, headers=headers)
+    resp = session.post(url, files=files, headers=headers, timeout=timeout)
+    if resp.status_code in (401, 403):
+        raise ErrorAutenticacionSII(f"HTTP {resp.status_code}")
+    resp.raise_for_status()
 
     xml = etree.fromstring(resp.content)
-    track_id = xml.xpath("//TRACKID/text()")[0]
+    status = xml.xpath("//STATUS/text()")
+    if status and status[0].strip() == STATUS_NO_AUTENTICADO:
+        raise ErrorAutenticacionSII("STATUS 5: token no autenticado")
+    track_id = xml.xpath("//TRACKID/text()")
+    if not track_id:
+        raise ErrorSII(f"Upload rechazado (STATUS {status[0] if status else '?'})")
+
+    return track_id[0]
+
+
+# ============================================================
+# 5) CONSULTAR ESTADO DE UN ENVÍO
+# ============================================================
+def consultar_estado(track_id, rut_emisor, token, session=requests, url=URL_ESTADO, timeout=TIMEOUT_S):
+    """Devuelve el código ESTADO del envío (p.ej. 'EPR' procesado, 'RCH' rechazado)."""
+    rut, dv = rut_emisor.replace(".", "").split("-")
+    params = {
+        "method": "getEstUp",
+        "RutCompania": rut,
+        "DvCompania": dv,
+        "TrackId": track_id,
+        "Token": token,
+    }
+    resp = session.get(url, params=params, timeout=timeout)
+    if resp.status_code in (401, 403):
+        raise ErrorAutenticacionSII(f"HTTP {resp.status_code}")
+    resp.raise_for_status()
+
+    xml = etree.fromstring(resp.content)
+    estado = xml.xpath("//ESTADO/text()")
+    if not estado:
+        raise ErrorSII(f"Respuesta sin ESTADO para el envío {track_id}")
+    if estado[0].strip() in ESTADOS_TOKEN_INVALIDO:
+        raise ErrorAutenticacionSII(f"ESTADO {estado[0].strip()}: token no válido")
+    return estado[0].strip()
+
+
+# ============================================================
+# CLIENTE SII (SESIÓN Y TOKEN REUTILIZABLES)
+# ============================================================
+class ClienteSII:
+    """
+    Mantiene una requests.Session (conexiones keep-alive reutilizadas) y el token
+    vigente: enviar N documentos cuesta un solo intercambio semilla/token.
+    Si el SII rechaza el token (al subir o al consultar un envío), se pide uno
+    nuevo y se reintenta una vez.
+    urls permite apuntar a otro servidor (p.ej. sii_stub para pruebas locales).
+    """
 
-    return track_id
\ No newline at end of file
+    def __init__(self, private_key, certificate, urls=None, token_ttl=TOKEN_TTL_S, timeout=TIMEOUT_S):
+        self.private_key = private_key
+        self.certificate = certificate
+        self.urls = dict(URLS_SII, **(urls or {}))
+        self.token_ttl = token_ttl
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+
+        self._token = None
+        self._vence = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_pfx(cls, ruta_pfx, password, **opciones):
+        private_key, certificate = cargar_certificado_pfx(ruta_pfx, password)
+        return cls(private_key, certificate, **opciones)
+
+    def token(self, renovar=False):
+        """Token vigente; pide semilla y token nuevos solo si no hay, venció o renovar=True."""
+        with self._lock:
+            if renovar or self._token is None or time.monotonic() >= self._vence:
+                semilla = obtener_semilla(self.session, self.urls["semilla"], self.timeout)
+                firmada = firmar_semilla(semilla, self.private_key, self.certificate)
+                self._token = obtener_token(firmada, self.session, self.urls["token"], self.timeout)
+                self._vence = time.monotonic() + self.token_ttl - TOKEN_MARGEN_S
+            return self._token
+
+    def invalidar_token(self):
+        with self._lock:
+            self._token = None
+
+    def enviar_dte(self, xml_firmado, nombre="dte.xml"):
+        """Sube un XML firmado y devuelve el TRACKID."""
+        try:
+            return enviar_dte(xml_firmado, self.token(), self.session, self.urls["upload"], self.timeout, nombre)
+        except ErrorAutenticacionSII:
+            return enviar_dte(xml_firmado, self.token(renovar=True), self.session, self.urls["upload"], self.timeout, nombre)
+
+    def estado_envio(self, track_id, rut_emisor=EMISOR["rut"]):
+        """ESTADO del envío; igual que el upload, si el SII rechaza el token se renueva y se reintenta una vez."""
+        try:
+            return consultar_estado(track_id, rut_emisor, self.token(), self.session, self.urls["estado"], self.timeout)
+        except ErrorAutenticacionSII:
+            return consultar_estado(track_id, rut_emisor, self.token(renovar=True), self.session,
+                                    self.urls["estado"], self.timeout)
+
+    def armar_sobres(self, dtes_firmados, rut_envia, fch_resol, nro_resol, emisor=EMISOR,
+                     max_docs=MAX_DTE_ENVIO, max_bytes=MAX_BYTES_ENVIO):
+        """
+        Agrupa los DTE firmados en sobres EnvioBOLETA y los firma, sin subirlos.
+        Genera (indices, sobre_firmado): indices son las posiciones en dtes_firmados.
+        """
+        for indices in armar_lotes(dtes_firmados, max_docs, max_bytes):
+            sobre = build_envio_boleta([dtes_firmados[i] for i in indices], emisor, rut_envia, fch_resol, nro_resol,
+                                       set_id=SET_ID_ENVIO)
+            yield indices, firmar_xml(sobre, self.private_key, self.certificate, reference_uri=f"#{SET_ID_ENVIO}")
+
+    def enviar_en_sobres(self, dtes_firmados, rut_envia, fch_resol, nro_resol, emisor=EMISOR,
+                         max_docs=MAX_DTE_ENVIO, max_bytes=MAX_BYTES_ENVIO):
+        """
+        Sube los DTE firmados en sobres EnvioBOLETA firmados, un upload por sobre.
+        Genera (indices, track_id) por sobre enviado: indices son las posiciones
+        en dtes_firmados que quedaron con ese TRACKID. Si un upload falla, la
+        excepción sale después de haber entregado los sobres ya aceptados.
+        """
+        sobres = self.armar_sobres(dtes_firmados, rut_envia, fch_resol, nro_resol, emisor, max_docs, max_bytes)
+        for n, (indices, sobre_firmado) in enumerate(sobres, start=1):
+            track_id = self.enviar_dte(sobre_firmado, nombre=f"envio_{n}.xml")
+            yield indices, track_id
+
+    def enviar_lote(self, dtes_firmados, rut_envia, fch_resol, nro_resol, **opciones):
+        """Como enviar_en_sobres, pero devuelve el TRACKID de cada DTE en el orden de entrada."""
+        track_ids = [None] * len(dtes_firmados)
+        for indices, track_id in self.enviar_en_sobres(dtes_firmados, rut_envia, fch_resol, nro_resol, **opciones):
+            for i in indices:
+                track_ids[i] = track_id
+        return track_ids
+
+    def cerrar(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
\ No newline at end of file
@@ -1,48 +1,208 @@
 # dte_signer.py
-from cryptography.hazmat.primitives.serialization import pkcs12
+import os
+import copy
+import base64
+import hashlib
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.hazmat.primitives.serialization import pkcs12, Encoding
 from cryptography.hazmat.backends import default_backend
 from signxml import XMLSigner
 from lxml import etree
 
+DS_NS = "http://www.w3.org/2000/09/xmldsig#"
+
+
+# =========================
+# CONTEXTO DE FIRMA (CERTIFICADO CARGADO UNA VEZ)
+# =========================
+
+class ContextoFirma:
+    """
+    Clave privada y certificado ya descifrados, más todo lo que no cambia entre
+    documentos: el DER del certificado, el bloque <KeyInfo> y el XMLSigner.
+    Firmar un documento solo cuesta el digest, la canonicalización y la operación RSA.
+    Un contexto no debe usarse desde dos hilos a la vez.
+    """
+
+    def __init__(self, private_key, certificate):
+        self.private_key = private_key
+        self.certificate = certificate
+        self.cert_der = certificate.public_bytes(Encoding.DER)
+
+        # <ds:KeyInfo><ds:X509Data><ds:X509Certificate> precalculado (el mismo que arma signxml con cert=)
+        self.key_info = etree.Element(f"{{{DS_NS}}}KeyInfo", nsmap={"ds": DS_NS})
+        x509_data = etree.SubElement(self.key_info, f"{{{DS_NS}}}X509Data")
+        etree.SubElement(x509_data, f"{{{DS_NS}}}X509Certificate").text = base64.b64encode(self.cert_der).decode("ascii")
+
+        self.signer = XMLSigner(
+            signature_algorithm="rsa-sha256",
+            digest_algorithm="sha256"
+        )
+
+    @classmethod
+    def desde_pfx(cls, ruta_pfx, password):
+        with open(ruta_pfx, "rb") as f:
+            pfx_data = f.read()
+
+        private_key, certificate, _ = pkcs12.load_key_and_certificates(
+            pfx_data,
+            password.encode(),
+            backend=default_backend()
+        )
+        return cls(private_key, certificate)
+
+    def firmar_arbol(self, xml_tree, reference_uri=None):
+        """
+        Firma un elemento lxml y devuelve el elemento firmado.
+        reference_uri: nodo firmado ("#ID"); por defecto el que indica referencia_por_defecto.
+        """
+        if reference_uri is None:
+            reference_uri = referencia_por_defecto(xml_tree)
+        return self.signer.sign(
+            xml_tree,
+            key=self.private_key,
+            key_info=copy.deepcopy(self.key_info),
+            reference_uri=reference_uri,
+            id_attribute="ID"
+        )
+
+    def firmar(self, xml_bytes, reference_uri=None):
+        """Firma un XML (bytes) con XMLDSig enveloped y lo devuelve en ISO-8859-1."""
+        signed_xml = self.firmar_arbol(etree.fromstring(xml_bytes), reference_uri)
+        return etree.tostring(
+            signed_xml,
+            xml_declaration=True,
+            encoding="ISO-8859-1"
+        )
+
+
+def referencia_por_defecto(xml_tree):
+    """
+    Nodo que firma cada documento del SII: el primer hijo con atributo ID
+    (Documento en un DTE, SetDTE en un sobre). Sin ID, como la semilla del
+    token, se firma el documento completo (URI="").
+    """
+    for hijo in xml_tree:
+        if isinstance(hijo.tag, str) and hijo.get("ID"):
+            return "#" + hijo.get("ID")
+    return None
+
+
+# Contextos ya cargados, por archivo .pfx (se recarga si el archivo cambia)
+_contextos = {}
+_lock = threading.Lock()
+_ultimo = None
+
+
+def cargar_contexto(ruta_pfx, password):
+    """
+    Devuelve el ContextoFirma del .pfx, descifrándolo solo la primera vez.
+    """
+    ruta = os.path.abspath(ruta_pfx)
+    clave = (ruta, os.stat(ruta).st_mtime_ns, hashlib.sha256(password.encode()).hexdigest())
+    with _lock:
+        contexto = _contextos.get(clave)
+        if contexto is None:
+            contexto = _contextos[clave] = ContextoFirma.desde_pfx(ruta, password)
+    return contexto
+
 
 def cargar_certificado_pfx(ruta_pfx, password):
     """
     Carga un certificado .pfx y devuelve:
     - clave privada
     - certificado X.509
+    (el .pfx se descifra una sola vez por proceso, ver cargar_contexto)
     """
-    with open(ruta_pfx, "rb") as f:
-        pfx_data = f.read()
+    contexto = cargar_contexto(ruta_pfx, password)
+    return contexto.private_key, contexto.certificate
 
-    private_key, certificate, _ = pkcs12.load_key_and_certificates(
-        pfx_data,
-        password.encode(),
-        backend=default_backend()
-    )
 
-    return private_key, certificate
+def _contexto_para(private_key, certificate):
+    # mismo par clave/certificado que el último usado o que uno ya cargado desde .pfx
+    global _ultimo
+    contexto = _ultimo
+    if contexto is not None and contexto.private_key is private_key and contexto.certificate is certificate:
+        return contexto
+    with _lock:
+        for c in _contextos.values():
+            if c.private_key is private_key and c.certificate is certificate:
+                contexto = c
+                break
+        else:
+            contexto = ContextoFirma(private_key, certificate)
+    _ultimo = contexto
+    return contexto
 
 
-def firmar_xml(xml_bytes, private_key, certificate):
+def firmar_xml(xml_bytes, private_key, certificate, reference_uri=None):
     """
     Firma un XML usando XMLDSig (enveloped signature)
     Compatible con versiones nuevas de signxml.
     """
-    xml_tree = etree.fromstring(xml_bytes)
+    return _contexto_para(private_key, certificate).firmar(xml_bytes, reference_uri)
+
+
+# =========================
+# FIRMA EN LOTE (VARIOS PROCESOS)
+# =========================
+# RSA + canonicalización son CPU puro: un lote grande (cierre del día, atrasos)
+# se reparte entre procesos. Cada proceso descifra el .pfx una vez al iniciar,
+# porque la clave privada no se puede enviar entre procesos.
+
+TAM_BLOQUE_FIRMA = 16
+
+_contexto_worker = None
 
-    signer = XMLSigner(
-        signature_algorithm="rsa-sha256",
-        digest_algorithm="sha256"
-    )
 
-    signed_xml = signer.sign(
-        xml_tree,
-        key=private_key,
-        cert=certificate
-    )
+def _iniciar_worker(ruta_pfx, password):
+    global _contexto_worker
+    _contexto_worker = cargar_contexto(ruta_pfx, password)
+
+
+def _firmar_bloque(xmls):
+    return [_contexto_worker.firmar(x) for x in xmls]
+
+
+def _en_bloques(iterable, tam):
+    it = iter(iterable)
+    while True:
+        bloque = list(itertools.islice(it, tam))
+        if not bloque:
+            return
+        yield bloque
+
+
+def firmar_lote(xmls, ruta_pfx, password, procesos=None, tam_bloque=TAM_BLOQUE_FIRMA):
+    """
+    Firma un iterable de XML sin firmar (los bytes de build_boleta_xml) en un pool
+    de procesos y entrega los XML firmados en el mismo orden de entrada.
+    - procesos: cantidad de procesos (por defecto, uno por núcleo); con 1 firma aquí mismo
+    - tam_bloque: documentos por tarea enviada a un proceso
+    Se mantienen a lo sumo 2 bloques por proceso en vuelo, así que el iterable
+    de entrada se consume a medida que se entregan resultados.
+    En Windows el script que lo llame debe estar protegido con if __name__ == "__main__".
+    """
+    procesos = procesos or os.cpu_count() or 1
+    bloques = _en_bloques(xmls, tam_bloque)
+
+    if procesos == 1:
+        contexto = cargar_contexto(ruta_pfx, password)
+        for bloque in bloques:
+            for xml_bytes in bloque:
+                yield contexto.firmar(xml_bytes)
+        return
 
-    return etree.tostring(
-        signed_xml,
-        xml_declaration=True,
-        encoding="ISO-8859-1"
-    )
\ No newline at end of file
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_worker,
+                             initargs=(ruta_pfx, password)) as pool:
+        pendientes = deque()
+        for bloque in bloques:
+            pendientes.append(pool.submit(_firmar_bloque, bloque))
+            if len(pendientes) >= procesos * 2:
+                yield from pendientes.popleft().result()
+        while pendientes:
+            yield from pendientes.popleft().result()
\ No newline at end of file
@@ -0,0 +1,103 @@
+# dte_timbre.py
+# Timbre electrónico (TED) de cada DTE.
+# Con cada rango de folios el SII entrega un CAF: el XML AUTORIZACION con el rango
+# autorizado (CAF/DA, firmado por el SII) y la llave privada RSA del rango (RSASK).
+# El TED copia el nodo CAF tal cual y firma los datos básicos del documento (DD)
+# con esa llave, SHA1withRSA sobre el DD sin espacios entre etiquetas y en
+# ISO-8859-1. Un documento sin TED, o con un TED de otro CAF, el SII lo rechaza.
+
+import re
+import base64
+import datetime
+import xml.etree.ElementTree as ET
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from dte_builder import _codificar, _tag
+
+LARGO_RSR = 40      # razón social del receptor en el DD
+LARGO_IT1 = 40      # descripción del primer ítem en el DD
+
+_CAF_RE = re.compile(rb"<CAF\b.*?</CAF>", re.DOTALL)
+_ENTRE_TAGS_RE = re.compile(rb">\s+<")
+_DD_RE = re.compile(rb"<DD>.*</DD>", re.DOTALL)
+_FRMT_RE = re.compile(rb"<FRMT[^>]*>([^<]*)</FRMT>")
+
+
+def _entero_b64(texto):
+    return int.from_bytes(base64.b64decode(texto), "big")
+
+
+class CAF:
+    """
+    CAF leído del XML del SII: RUT, tipo y rango autorizados, la llave del rango y
+    el nodo CAF (sin espacios entre etiquetas) que se copia en cada TED.
+    """
+
+    def __init__(self, xml_bytes):
+        try:
+            raiz = ET.fromstring(xml_bytes)
+        except ET.ParseError as e:
+            raise ValueError(f"El archivo no es un CAF: {e}")
+        da = raiz.find("CAF/DA")
+        if da is None:
+            raise ValueError("El archivo no es un CAF: falta AUTORIZACION/CAF/DA")
+        self.rut = da.findtext("RE")
+        self.tipo_dte = int(da.findtext("TD"))
+        self.desde = int(da.findtext("RNG/D"))
+        self.hasta = int(da.findtext("RNG/H"))
+
+        rsask = raiz.findtext("RSASK")
+        if not rsask:
+            raise ValueError("El CAF no trae la llave privada del rango (RSASK)")
+        self.llave = serialization.load_pem_private_key(rsask.strip().encode("ascii"), password=None)
+        modulo, exponente = da.findtext("RSAPK/M"), da.findtext("RSAPK/E")
+        if modulo and exponente:
+            self.llave_publica = rsa.RSAPublicNumbers(_entero_b64(exponente), _entero_b64(modulo)).public_key()
+        else:
+            self.llave_publica = self.llave.public_key()
+
+        self.nodo = _ENTRE_TAGS_RE.sub(b"><", _CAF_RE.search(xml_bytes).group(0))
+
+    def incluye(self, folio):
+        return self.desde <= folio <= self.hasta
+
+
+def build_ted(caf, folio, fch_emis, receptor, monto_total, primer_item, tsted=None):
+    """
+    Nodo TED (bytes ISO-8859-1) del documento, firmado con la llave del CAF.
+    fch_emis: date de emisión; tsted: datetime del timbraje (por defecto ahora).
+    """
+    if not caf.incluye(folio):
+        raise ValueError(f"Folio {folio} fuera del CAF {caf.desde}-{caf.hasta}")
+    dd = b"".join((
+        _codificar(
+            "<DD>"
+            + _tag("RE", caf.rut)
+            + _tag("TD", caf.tipo_dte)
+            + _tag("F", folio)
+            + _tag("FE", fch_emis.strftime("%Y-%m-%d"))
+            + _tag("RR", receptor["rut"])
+            + _tag("RSR", receptor["razon_social"][:LARGO_RSR])
+            + _tag("MNT", monto_total)
+            + _tag("IT1", primer_item[:LARGO_IT1])
+        ),
+        caf.nodo,
+        _codificar(_tag("TSTED", (tsted or datetime.datetime.now()).strftime("%Y-%m-%dT%H:%M:%S")) + "</DD>"),
+    ))
+    frmt = base64.b64encode(caf.llave.sign(dd, padding.PKCS1v15(), hashes.SHA1()))
+    return b'<TED version="1.0">' + dd + b'<FRMT algoritmo="SHA1withRSA">' + frmt + b"</FRMT></TED>"
+
+
+def verificar_ted(xml_bytes, caf):
+    """True si el TED del documento está firmado con la llave del CAF (se verifica con RSAPK)."""
+    dd, frmt = _DD_RE.search(xml_bytes), _FRMT_RE.search(xml_bytes)
+    if dd is None or frmt is None:
+        return False
+    try:
+        caf.llave_publica.verify(base64.b64decode(frmt.group(1)), dd.group(0), padding.PKCS1v15(), hashes.SHA1())
+    except InvalidSignature:
+        return False
+    return True
@@ -0,0 +1,76 @@
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+
+# =========================
+# LECTURA DE EXCEL POR BLOQUES
+# =========================
+# openpyxl en modo read_only recorre la hoja fila a fila sin cargar todo el
+# libro en memoria; los bloques de tamaño fijo se entregan como DataFrame.
+# Las celdas con error de fórmula (#VALUE!, #N/A, #REF!, #DIV/0!...) llegan de
+# openpyxl como texto: se leen vacías (None), igual que pd.read_excel (NaN).
+# Como pd.read_excel, las filas en blanco entre datos se conservan (todo None)
+# y solo se descartan las del final de la hoja: quien reescribe la planilla
+# a partir de lo leído no pierde filas.
+
+TAM_BLOQUE = 5000
+ERRORES_EXCEL = frozenset(ERROR_CODES)
+
+
+def iter_filas(excel_path, hoja=0, como_texto=False):
+    """
+    Genera (encabezado, fila) por cada fila de datos de la hoja.
+    - hoja: nombre de la hoja o índice (0 = primera)
+    - como_texto: convierte cada valor a str (equivale a dtype=str de pandas)
+    """
+    wb = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[hoja] if isinstance(hoja, int) else wb[hoja]
+        filas = ws.iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        encabezado = tuple(str(c).strip() if c is not None else "" for c in encabezado)
+        ancho = len(encabezado)
+
+        vacias = 0
+        for fila in filas:
+            fila = tuple(None if v in ERRORES_EXCEL else v for v in fila or ())
+            if all(v is None for v in fila):
+                vacias += 1
+                continue
+            # las filas en blanco se entregan recién cuando aparece otra con datos
+            for _ in range(vacias):
+                yield encabezado, (None,) * ancho
+            vacias = 0
+            if len(fila) != ancho:
+                fila = tuple(fila[:ancho]) + (None,) * (ancho - len(fila))
+            if como_texto:
+                fila = tuple(None if v is None else str(v) for v in fila)
+            yield encabezado, fila
+    finally:
+        wb.close()
+
+
+def iter_bloques(excel_path, hoja=0, tam_bloque=TAM_BLOQUE, como_texto=False):
+    """Genera DataFrames de hasta tam_bloque filas, en el orden de la hoja."""
+    bloque = []
+    encabezado = None
+    for encabezado, fila in iter_filas(excel_path, hoja, como_texto):
+        bloque.append(fila)
+        if len(bloque) >= tam_bloque:
+            yield pd.DataFrame.from_records(bloque, columns=encabezado)
+            bloque = []
+    if bloque:
+        yield pd.DataFrame.from_records(bloque, columns=encabezado)
+
+
+def leer_excel(excel_path, hoja=0, como_texto=False):
+    """Reemplazo de pd.read_excel que no materializa el libro completo de openpyxl."""
+    encabezado = None
+    registros = []
+    for encabezado, fila in iter_filas(excel_path, hoja, como_texto):
+        registros.append(fila)
+    if encabezado is None:
+        return pd.DataFrame()
+    return pd.DataFrame.from_records(registros, columns=encabezado)
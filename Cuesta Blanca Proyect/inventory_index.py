@@ -0,0 +1,78 @@
+# inventory_index.py
+# Índices en memoria sobre el inventario cargado desde Excel (DataFrame):
+#   - SKU (columna Código) -> posición de la fila
+#   - EAN (columna EAN UA) -> SKU
+# Se arman una vez al cargar; cada escaneo es una búsqueda en diccionario en vez
+# de comparar la columna completa. La rebaja de stock no mueve filas, así que
+# los índices siguen válidos después de rebajar.
+
+import numpy as np
+
+COL_CODIGO = "Código"
+COL_EAN = "EAN UA"
+COL_STOCK = "Stock Físico"
+
+
+def normalizar_codigo(valor):
+    """Clave de búsqueda de un código o EAN: texto sin espacios; 7801234.0 -> '7801234'."""
+    if valor is None:
+        return ""
+    if isinstance(valor, float):
+        if valor != valor:          # NaN (celda vacía)
+            return ""
+        if valor.is_integer():
+            return str(int(valor))
+    return str(valor).strip()
+
+
+class IndiceInventario:
+    def __init__(self, df, col_codigo=COL_CODIGO, col_ean=COL_EAN, col_stock=COL_STOCK):
+        self.df = df
+        self.col_codigo = col_codigo
+        self.col_stock = col_stock
+
+        # ante SKU repetidos vale la primera fila, igual que el filtro + iloc[0] anterior
+        self.posicion = {}
+        for i, codigo in enumerate(df[col_codigo].tolist()):
+            self.posicion.setdefault(normalizar_codigo(codigo), i)
+        self.posicion.pop("", None)
+
+        self.ean = {}
+        if col_ean in df.columns:
+            for codigo, ean in zip(df[col_codigo].tolist(), df[col_ean].tolist()):
+                clave = normalizar_codigo(ean)
+                if clave:
+                    self.ean.setdefault(clave, normalizar_codigo(codigo))
+
+    def buscar(self, codigo):
+        """Posición de la fila del código escaneado (SKU o EAN), o None si no existe."""
+        clave = normalizar_codigo(codigo)
+        pos = self.posicion.get(clave)
+        if pos is None and clave in self.ean:
+            pos = self.posicion.get(self.ean[clave])
+        return pos
+
+    def fila(self, codigo):
+        """Fila (Series) del producto, o None si no existe."""
+        pos = self.buscar(codigo)
+        return None if pos is None else self.df.iloc[pos]
+
+    def rebajar(self, codigos, cantidades):
+        """
+        Descuenta del stock todas las cantidades en una sola operación.
+        Un mismo código puede venir varias veces (se acumula). KeyError si un código no existe.
+        """
+        codigos = list(codigos)
+        posiciones = np.fromiter((self._posicion_estricta(c) for c in codigos), dtype=np.int64, count=len(codigos))
+        stock = self.df[self.col_stock].to_numpy(copy=True)
+        cantidades = np.asarray(list(cantidades))
+        if stock.dtype.kind in "iu" and cantidades.dtype.kind == "f":
+            stock = stock.astype(float)
+        np.subtract.at(stock, posiciones, cantidades.astype(stock.dtype, copy=False))
+        self.df[self.col_stock] = stock
+
+    def _posicion_estricta(self, codigo):
+        pos = self.buscar(codigo)
+        if pos is None:
+            raise KeyError(f"Código no encontrado en inventario: {codigo}")
+        return pos
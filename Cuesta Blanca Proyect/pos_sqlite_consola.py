@@ -2,6 +2,8 @@ import sqlite3
 import datetime
 import pandas as pd
 
+from db_connection import get_connection
+
 # =========================
 # CONFIGURACIÓN
 # =========================
@@ -15,7 +17,8 @@ IVA = 0.19
 # =========================
 
 def get_conn():
-    return sqlite3.connect(DB_FILE)
+    # conexión compartida (WAL) reutilizada entre consultas; no se cierra por llamada
+    return get_connection(DB_FILE)
 
 
 # =========================
@@ -33,7 +36,6 @@ def get_producto_por_codigo(codigo):
         WHERE codigo = ?
     """, (codigo,))
     row = cur.fetchone()
-    conn.close()
 
     if not row:
         return None
@@ -56,15 +58,18 @@ def get_producto_por_codigo(codigo):
 
 def actualizar_stock_y_salientes(producto_id, cantidad):
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE productos
-        SET stock_fisico = stock_fisico - ?,
-            unidades_salientes = unidades_salientes + ?
-        WHERE id = ?
-    """, (cantidad, cantidad, producto_id))
-    conn.commit()
-    conn.close()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE productos
+            SET stock_fisico = stock_fisico - ?,
+                unidades_salientes = unidades_salientes + ?
+            WHERE id = ?
+        """, (cantidad, cantidad, producto_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 # =========================
@@ -73,57 +78,60 @@ def actualizar_stock_y_salientes(producto_id, cantidad):
 
 def registrar_venta(carrito, total_neto, total_iva, total_total):
     conn = get_conn()
-    cur = conn.cursor()
-
-    fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        cur = conn.cursor()
 
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ventas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            fecha TEXT,
-            total_neto REAL,
-            total_iva REAL,
-            total_total REAL
-        )
-    """)
+        fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ventas_detalle (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            venta_id INTEGER,
-            codigo TEXT,
-            descripcion TEXT,
-            cantidad INTEGER,
-            precio_unitario REAL,
-            total_linea REAL,
-            FOREIGN KEY (venta_id) REFERENCES ventas(id)
-        )
-    """)
-
-    cur.execute("""
-        INSERT INTO ventas (fecha, total_neto, total_iva, total_total)
-        VALUES (?, ?, ?, ?)
-    """, (fecha, total_neto, total_iva, total_total))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ventas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fecha TEXT,
+                total_neto REAL,
+                total_iva REAL,
+                total_total REAL
+            )
+        """)
 
-    venta_id = cur.lastrowid
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ventas_detalle (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                venta_id INTEGER,
+                codigo TEXT,
+                descripcion TEXT,
+                cantidad INTEGER,
+                precio_unitario REAL,
+                total_linea REAL,
+                FOREIGN KEY (venta_id) REFERENCES ventas(id)
+            )
+        """)
 
-    for item in carrito:
         cur.execute("""
-            INSERT INTO ventas_detalle (
-                venta_id, codigo, descripcion,
-                cantidad, precio_unitario, total_linea
-            ) VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            venta_id,
-            item["codigo"],
-            item["descripcion"],
-            item["cantidad"],
-            item["precio_unitario"],
-            item["total_linea"]
-        ))
-
-    conn.commit()
-    conn.close()
+            INSERT INTO ventas (fecha, total_neto, total_iva, total_total)
+            VALUES (?, ?, ?, ?)
+        """, (fecha, total_neto, total_iva, total_total))
+
+        venta_id = cur.lastrowid
+
+        for item in carrito:
+            cur.execute("""
+                INSERT INTO ventas_detalle (
+                    venta_id, codigo, descripcion,
+                    cantidad, precio_unitario, total_linea
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                venta_id,
+                item["codigo"],
+                item["descripcion"],
+                item["cantidad"],
+                item["precio_unitario"],
+                item["total_linea"]
+            ))
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
     return venta_id
 
@@ -4,6 +4,8 @@ from tkinter import ttk, messagebox
 import pandas as pd
 import datetime
 
+from db_connection import get_connection
+
 DB_FILE = "inventario.db"
 IVA = 0.19
 
@@ -13,7 +15,8 @@ IVA = 0.19
 # =========================
 
 def get_conn():
-    return sqlite3.connect(DB_FILE)
+    # conexión compartida (WAL) reutilizada entre consultas; no se cierra por llamada
+    return get_connection(DB_FILE)
 
 
 # =========================
@@ -30,7 +33,6 @@ def get_producto(codigo):
         WHERE codigo = ?
     """, (codigo,))
     row = cur.fetchone()
-    conn.close()
 
     if not row:
         return None
@@ -52,15 +54,18 @@ def get_producto(codigo):
 
 def actualizar_stock(producto_id, cantidad):
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE productos
-        SET stock_fisico = stock_fisico - ?,
-            unidades_salientes = unidades_salientes + ?
-        WHERE id = ?
-    """, (cantidad, cantidad, producto_id))
-    conn.commit()
-    conn.close()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE productos
+            SET stock_fisico = stock_fisico - ?,
+                unidades_salientes = unidades_salientes + ?
+            WHERE id = ?
+        """, (cantidad, cantidad, producto_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 # =========================
@@ -69,56 +74,59 @@ def actualizar_stock(producto_id, cantidad):
 
 def registrar_venta(carrito, neto, iva, total):
     conn = get_conn()
-    cur = conn.cursor()
-
-    fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        cur = conn.cursor()
 
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ventas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            fecha TEXT,
-            total_neto REAL,
-            total_iva REAL,
-            total_total REAL
-        )
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ventas_detalle (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            venta_id INTEGER,
-            codigo TEXT,
-            descripcion TEXT,
-            cantidad INTEGER,
-            precio_unitario REAL,
-            total_linea REAL
-        )
-    """)
+        fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    cur.execute("""
-        INSERT INTO ventas (fecha, total_neto, total_iva, total_total)
-        VALUES (?, ?, ?, ?)
-    """, (fecha, neto, iva, total))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ventas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fecha TEXT,
+                total_neto REAL,
+                total_iva REAL,
+                total_total REAL
+            )
+        """)
 
-    venta_id = cur.lastrowid
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ventas_detalle (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                venta_id INTEGER,
+                codigo TEXT,
+                descripcion TEXT,
+                cantidad INTEGER,
+                precio_unitario REAL,
+                total_linea REAL
+            )
+        """)
 
-    for item in carrito:
         cur.execute("""
-            INSERT INTO ventas_detalle (
-                venta_id, codigo, descripcion,
-                cantidad, precio_unitario, total_linea
-            ) VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            venta_id,
-            item["codigo"],
-            item["descripcion"],
-            item["cantidad"],
-            item["precio"],
-            item["total"]
-        ))
-
-    conn.commit()
-    conn.close()
+            INSERT INTO ventas (fecha, total_neto, total_iva, total_total)
+            VALUES (?, ?, ?, ?)
+        """, (fecha, neto, iva, total))
+
+        venta_id = cur.lastrowid
+
+        for item in carrito:
+            cur.execute("""
+                INSERT INTO ventas_detalle (
+                    venta_id, codigo, descripcion,
+                    cantidad, precio_unitario, total_linea
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                venta_id,
+                item["codigo"],
+                item["descripcion"],
+                item["cantidad"],
+                item["precio"],
+                item["total"]
+            ))
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
     return venta_id
 
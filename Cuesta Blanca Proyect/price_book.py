@@ -0,0 +1,174 @@
+# price_book.py
+# Libro de precios por SKU para el POS basado en Excel.
+# Los precios de cada lista (detalle / may1 / may2) se calculan desde el costo USD,
+# el tipo de cambio y los márgenes, y quedan guardados en la tabla price_book junto
+# con la versión (tipo de cambio + márgenes) con que se calcularon. Al cargar el
+# inventario solo se recalculan los SKU nuevos o con costo distinto; si cambia la
+# versión se recalcula todo el libro en una sola operación vectorizada.
+# En el escaneo el precio es una búsqueda SKU -> fila y una lectura del arreglo.
+
+import json
+import datetime
+
+import numpy as np
+
+from db_connection import get_connection
+
+LISTAS = ("DETALLE", "MAY1", "MAY2")
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS price_book (
+    sku TEXT PRIMARY KEY,
+    costo_usd REAL,
+    precios TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS price_book_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    usd_clp REAL NOT NULL,
+    margenes TEXT NOT NULL,
+    actualizado TEXT
+);
+"""
+
+
+def calcular_precios(costos_usd, usd_clp, margenes):
+    """Matriz (n SKU, n listas) de precios en CLP redondeados a peso."""
+    costo_clp = np.asarray(costos_usd, dtype=float) * usd_clp
+    return np.round(costo_clp[:, None] * np.asarray(margenes, dtype=float)[None, :])
+
+
+def _distintos(a, b):
+    # NaN (sin costo) se considera igual a NaN
+    return (a != b) & ~(np.isnan(a) & np.isnan(b))
+
+
+class PriceBook:
+    def __init__(self, usd_clp, margenes, db_path=None):
+        """
+        - margenes: {lista: margen}, p.ej. {"DETALLE": 1.80, "MAY1": 1.50, "MAY2": 1.35}
+        - db_path: BD SQLite donde persiste el libro; None = solo en memoria
+        """
+        self.usd_clp = float(usd_clp)
+        self.listas = tuple(margenes)
+        self.margenes = tuple(float(m) for m in margenes.values())
+        self.columna = {lista: i for i, lista in enumerate(self.listas)}
+        self.db_path = db_path
+
+        self.skus = []
+        self.indice = {}                                  # sku -> fila
+        self.costos = np.empty(0)
+        self.precios = np.empty((0, len(self.listas)))
+        self.recalculados = 0                             # filas recalculadas en la última sincronización
+
+        if db_path is not None:
+            self._cargar()
+
+    def _version_json(self):
+        return json.dumps(dict(zip(self.listas, self.margenes)), sort_keys=True)
+
+    # =========================
+    # PERSISTENCIA
+    # =========================
+
+    def _cargar(self):
+        conn = get_connection(self.db_path)
+        conn.executescript(SCHEMA_SQL)
+        version = conn.execute("SELECT usd_clp, margenes FROM price_book_version WHERE id = 1").fetchone()
+        filas = conn.execute("SELECT sku, costo_usd, precios FROM price_book").fetchall()
+        if not filas:
+            return
+
+        self.skus = [f[0] for f in filas]
+        self.indice = {sku: i for i, sku in enumerate(self.skus)}
+        self.costos = np.array([np.nan if f[1] is None else f[1] for f in filas], dtype=float)
+
+        if version != (self.usd_clp, self._version_json()):
+            # tipo de cambio o márgenes distintos a los guardados: nueva versión del libro
+            self.precios = calcular_precios(self.costos, self.usd_clp, self.margenes)
+            self._guardar(np.arange(len(self.skus)))
+            self.recalculados = len(self.skus)
+        else:
+            self.precios = np.array([json.loads(f[2]) for f in filas], dtype=float)
+
+    def _guardar(self, filas):
+        if self.db_path is None:
+            return
+        conn = get_connection(self.db_path)
+        conn.executemany("""
+            INSERT INTO price_book (sku, costo_usd, precios) VALUES (?, ?, ?)
+            ON CONFLICT(sku) DO UPDATE SET costo_usd = excluded.costo_usd, precios = excluded.precios
+        """, [
+            (self.skus[i],
+             None if np.isnan(self.costos[i]) else float(self.costos[i]),
+             json.dumps([None if np.isnan(p) else float(p) for p in self.precios[i]]))
+            for i in filas
+        ])
+        conn.execute("""
+            INSERT INTO price_book_version (id, usd_clp, margenes, actualizado) VALUES (1, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                usd_clp = excluded.usd_clp,
+                margenes = excluded.margenes,
+                actualizado = excluded.actualizado
+        """, (self.usd_clp, self._version_json(), datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        conn.commit()
+
+    # =========================
+    # ACTUALIZACIÓN
+    # =========================
+
+    def sincronizar(self, skus, costos_usd):
+        """
+        Alinea el libro con el inventario (SKU y costo USD por fila).
+        Solo recalcula los SKU nuevos o cuyo costo cambió. Devuelve cuántos recalculó.
+        """
+        skus = [str(s) for s in skus]
+        costos = np.asarray(costos_usd, dtype=float)
+        filas = np.fromiter((self.indice.get(s, -1) for s in skus), dtype=np.int64, count=len(skus))
+
+        nuevos = np.flatnonzero(filas < 0)
+        if len(nuevos):
+            base = len(self.skus)
+            for i in nuevos:
+                fila = self.indice.get(skus[i])      # SKU repetido dentro del mismo inventario
+                if fila is None:
+                    fila = self.indice[skus[i]] = len(self.skus)
+                    self.skus.append(skus[i])
+                filas[i] = fila
+            agregados = len(self.skus) - base
+            self.costos = np.concatenate([self.costos, np.full(agregados, np.nan)])
+            self.precios = np.vstack([self.precios, np.full((agregados, len(self.listas)), np.nan)])
+
+        cambio = np.zeros(len(skus), dtype=bool)
+        cambio[nuevos] = True
+        cambio |= _distintos(self.costos[filas], costos)
+
+        idx = filas[cambio]
+        self.costos[idx] = costos[cambio]
+        self.precios[idx] = calcular_precios(costos[cambio], self.usd_clp, self.margenes)
+        if len(idx):
+            self._guardar(np.unique(idx))
+        self.recalculados = int(len(np.unique(idx)))
+        return self.recalculados
+
+    def cambiar_version(self, usd_clp=None, margenes=None):
+        """Nuevo tipo de cambio y/o márgenes: recalcula el libro completo de una vez."""
+        if usd_clp is not None:
+            self.usd_clp = float(usd_clp)
+        if margenes is not None:
+            self.margenes = tuple(float(margenes.get(lista, m)) for lista, m in zip(self.listas, self.margenes))
+        self.precios = calcular_precios(self.costos, self.usd_clp, self.margenes)
+        self._guardar(np.arange(len(self.skus)))
+        self.recalculados = len(self.skus)
+
+    # =========================
+    # CONSULTA
+    # =========================
+
+    def filas(self, skus):
+        """Fila del libro de cada SKU (para asignar columnas de precio a un DataFrame)."""
+        return np.fromiter((self.indice[str(s)] for s in skus), dtype=np.int64, count=len(skus))
+
+    def precio(self, sku, lista="DETALLE"):
+        """Precio del SKU en la lista (listas desconocidas usan la primera, detalle)."""
+        return self.precios[self.indice[sku], self.columna.get(lista, 0)]
@@ -0,0 +1,213 @@
+# prueba_dte_outbox.py
+# Recorre la cola de boletas (dte_outbox) de punta a punta contra el stub local del SII:
+# registra ventas, simula una caída del upload y verifica que la cola se vacía al volver.
+# Antes revisa la espera entre reintentos con muchos fallos acumulados, que un
+# error inesperado del envío también reprograma los documentos, que un sobre cuya
+# respuesta se perdió se vuelve a subir idéntico, que la consulta de estado renueva
+# un token vencido y que los folios
+# salen de los CAF cargados, sin repetirse ni salirse del rango; al final, que
+# cada boleta aceptada lleva un TED válido para la llave de su CAF.
+# Uso: python prueba_dte_outbox.py [--ventas 5] [--fallas 2]
+# Trabaja sobre una BD temporal, CAF de prueba (llave propia, sin firma del SII) y un certificado
+# autofirmado; no toca inventario.db.
+import os
+import time
+import base64
+import sqlite3
+import argparse
+import tempfile
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import dte_outbox
+import control_final_prandelli
+from db_connection import get_connection
+from dte_builder import EMISOR, build_boleta_xml
+from dte_sender import ClienteSII
+from dte_timbre import CAF, verificar_ted
+from sii_stub import StubSII
+from benchmark_firma_lote import generar_pfx_temporal
+
+CARRITO_DTE = [{"NroLinDet": 1, "NmbItem": "Protector Solar SPF50", "QtyItem": 2, "PrcItem": 5000, "MontoItem": 10000}]
+TOTALES_DTE = {"MntNeto": 8403, "IVA": 1597, "MntTotal": 10000}
+
+CARRITO = [
+    {"codigo": "P001", "descripcion": "Protector Solar SPF50", "cantidad": 2, "precio": 5000, "total": 10000},
+    {"codigo": "P002", "descripcion": "After Sun Aloe", "cantidad": 1, "precio": 4000, "total": 4000},
+]
+
+
+def generar_caf(desde, hasta, rut=dte_outbox.EMISOR["rut"], tipo_dte=39):
+    """CAF de prueba con el rango pedido y una llave RSA nueva; devuelve la ruta del XML."""
+    llave = rsa.generate_private_key(public_exponent=65537, key_size=1024)
+    numeros = llave.public_key().public_numbers()
+    def b64(n):
+        return base64.b64encode(n.to_bytes((n.bit_length() + 7) // 8, "big")).decode("ascii")
+    rsask = llave.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                serialization.NoEncryption()).decode("ascii")
+    fd, ruta = tempfile.mkstemp(suffix=".xml")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(f'<AUTORIZACION>\n<CAF version="1.0">\n<DA><RE>{rut}</RE><TD>{tipo_dte}</TD>'
+                f'<RNG><D>{desde}</D><H>{hasta}</H></RNG>'
+                f'<RSAPK><M>{b64(numeros.n)}</M><E>{b64(numeros.e)}</E></RSAPK></DA>\n'
+                f'<FRMA algoritmo="SHA1withRSA">sin-firma-del-SII</FRMA></CAF>\n'
+                f'<RSASK>{rsask}</RSASK></AUTORIZACION>')
+    return ruta
+
+
+def probar_folios_caf():
+    conn = sqlite3.connect(":memory:")
+    cur = conn.cursor()
+    for venta_id in range(1, 6):
+        dte_outbox.encolar_venta(cur, venta_id)
+    conn.commit()
+
+    caf_1 = generar_caf(1, 3)
+    dte_outbox.cargar_caf(conn, caf_1)
+    assert dte_outbox.asignar_folios(conn) == 3
+    dte_outbox.cargar_caf(conn, caf_1)      # cargar de nuevo el mismo CAF no repite folios
+    assert dte_outbox.asignar_folios(conn) == 0, "se asignaron folios fuera del CAF"
+
+    for desde, hasta, rut in ((3, 8, dte_outbox.EMISOR["rut"]), (4, 8, "11.111.111-1")):
+        ruta = generar_caf(desde, hasta, rut)
+        try:
+            dte_outbox.cargar_caf(conn, ruta)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"se aceptó el CAF {desde}-{hasta} de {rut}")
+        finally:
+            os.remove(ruta)
+
+    caf_2 = generar_caf(10, 20)
+    dte_outbox.cargar_caf(conn, caf_2)
+    assert dte_outbox.asignar_folios(conn) == 2
+    folios = [f for (f,) in conn.execute("SELECT folio FROM dte_outbox ORDER BY venta_id")]
+    assert folios == [1, 2, 3, 10, 11], folios
+    os.remove(caf_1)
+    os.remove(caf_2)
+    print("OK: folios tomados de los CAF, sin repetir y esperando cuando se agotan")
+
+
+def probar_backoff():
+    conn = sqlite3.connect(":memory:")
+    dte_outbox.asegurar_tabla(conn.cursor())
+    for venta_id, intentos in ((1, 0), (2, 5), (3, 63), (4, 64), (5, 500)):
+        conn.execute("INSERT INTO dte_outbox (venta_id, tipo_dte, folio, intentos) VALUES (?, 39, ?, ?)",
+                     (venta_id, venta_id, intentos))
+    antes = time.time()
+    dte_outbox._reintentar(conn, [1, 2, 3, 4, 5], "prueba")
+    esperas = dict(conn.execute("SELECT venta_id, proximo_intento - ? FROM dte_outbox", (antes,)).fetchall())
+    assert abs(esperas[1] - dte_outbox.BACKOFF_BASE_S) < 5, esperas
+    assert abs(esperas[2] - min(dte_outbox.BACKOFF_BASE_S * 32, dte_outbox.BACKOFF_MAX_S)) < 5, esperas
+    for venta_id in (3, 4, 5):
+        assert abs(esperas[venta_id] - dte_outbox.BACKOFF_MAX_S) < 5, esperas
+    print("OK: espera entre reintentos acotada con muchos fallos")
+
+
+class ClienteRespuestaIlegible:
+    # arma el sobre, pero el SII responde al upload algo que no es XML
+    def armar_sobres(self, dtes_firmados, *args, **kwargs):
+        yield list(range(len(dtes_firmados))), b"<EnvioBOLETA/>"
+
+    def enviar_dte(self, sobre, nombre="dte.xml"):
+        raise ValueError("respuesta del SII ilegible")
+
+
+def probar_error_inesperado():
+    conn = sqlite3.connect(":memory:")
+    dte_outbox.asegurar_tabla(conn.cursor())
+    conn.executemany("INSERT INTO dte_outbox (venta_id, tipo_dte, folio, estado, xml) VALUES (?, 39, ?, 'firmado', x'00')",
+                     [(1, 1), (2, 2)])
+    enviados = dte_outbox.enviar_firmados(conn, ClienteRespuestaIlegible(), "11111111-1", "2014-08-22", 0)
+    filas = conn.execute("SELECT intentos, proximo_intento > ?, ultimo_error FROM dte_outbox", (time.time(),)).fetchall()
+    assert enviados == 0 and all(f[0] == 1 and f[1] and "ilegible" in f[2] for f in filas), filas
+    print("OK: un error inesperado del envío reprograma los documentos")
+
+
+def probar_respuesta_perdida(ruta_pfx):
+    conn = sqlite3.connect(":memory:")
+    dte_outbox.asegurar_tabla(conn.cursor())
+    conn.executemany("INSERT INTO dte_outbox (venta_id, tipo_dte, folio, estado, xml) VALUES (?, 39, ?, 'firmado', ?)",
+                     [(folio, folio, build_boleta_xml(folio, EMISOR, dte_outbox.RECEPTOR_GENERICO,
+                                                      CARRITO_DTE, TOTALES_DTE)) for folio in (1, 2)])
+    with StubSII() as stub:
+        cliente = ClienteSII.desde_pfx(ruta_pfx, "prueba", urls=stub.urls)
+        stub.respuestas_perdidas = 1
+        assert dte_outbox.enviar_firmados(conn, cliente, "11111111-1", "2014-08-22", 0) == 0
+        conn.execute("UPDATE dte_outbox SET proximo_intento = 0")
+        assert dte_outbox.enviar_firmados(conn, cliente, "11111111-1", "2014-08-22", 0) == 2
+        cliente.cerrar()
+
+    sobres = conn.execute("SELECT sobre FROM dte_envios").fetchall()
+    assert len(sobres) == 1 and len(stub.uploads) == 2, (len(sobres), len(stub.uploads))
+    assert all(bytes(sobres[0][0]) in cuerpo for _, cuerpo in stub.uploads), "el reintento subió otro sobre"
+    print("OK: si se pierde la respuesta del upload se reintenta el mismo sobre")
+
+
+def probar_token_vencido(ruta_pfx):
+    with StubSII() as stub:
+        with ClienteSII.desde_pfx(ruta_pfx, "prueba", urls=stub.urls) as cliente:
+            track_id = cliente.enviar_dte(b"<EnvioBOLETA/>")
+            stub.revocar_tokens()
+            estado = cliente.estado_envio(track_id)
+    assert estado == stub.estado_envios and stub.tokens == 2, (estado, stub.tokens)
+    print("OK: la consulta de estado renueva un token vencido y reintenta")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de la cola de boletas contra el stub del SII")
+    parser.add_argument("--ventas", type=int, default=5)
+    parser.add_argument("--fallas", type=int, default=2, help="uploads que fallan antes de recuperar la conexión")
+    args = parser.parse_args(argv)
+
+    probar_backoff()
+    probar_error_inesperado()
+    probar_folios_caf()
+
+    control_final_prandelli.DB_FILE = os.path.join(tempfile.mkdtemp(), "prueba_outbox.db")
+    ruta_pfx = generar_pfx_temporal("prueba")
+    probar_respuesta_perdida(ruta_pfx)
+    probar_token_vencido(ruta_pfx)
+
+    with StubSII() as stub:
+        stub.fallas_upload = args.fallas
+        emisor = dte_outbox.EmisorDTE.desde_pfx(
+            control_final_prandelli.DB_FILE, ruta_pfx, "prueba", "11111111-1", "2014-08-22", 0, urls=stub.urls
+        )
+        # sin esperas: cada pasada reintenta de inmediato
+        dte_outbox.BACKOFF_BASE_S = 0
+        dte_outbox.ESPERA_ESTADO_S = 0
+
+        for _ in range(args.ventas):
+            control_final_prandelli.registrar_venta(CARRITO, 14000, 2660, 16660, "BOLETA")
+        conn = get_connection(control_final_prandelli.DB_FILE)
+        ruta_caf = generar_caf(1, args.ventas)
+        dte_outbox.cargar_caf(conn, ruta_caf)
+        os.remove(ruta_caf)
+        print("Encoladas:", dte_outbox.resumen(conn))
+
+        for pasada in range(1, args.fallas + 4):
+            t0 = time.perf_counter()
+            firmados, enviados, resueltos = emisor.procesar()
+            print(f"Pasada {pasada}: firmados={firmados} enviados={enviados} envios_resueltos={resueltos} "
+                  f"({time.perf_counter() - t0:.2f} s) -> {dte_outbox.resumen(conn)}")
+            if dte_outbox.resumen(conn) == {"aceptado": args.ventas}:
+                break
+
+        emisor.cliente.cerrar()
+        print(f"Stub: {stub.tokens} token(s), {len(stub.uploads)} sobre(s) recibidos")
+
+    os.remove(ruta_pfx)
+    assert dte_outbox.resumen(conn) == {"aceptado": args.ventas}, "la cola no se vació"
+    print("OK: todas las boletas aceptadas")
+
+    caf = CAF(bytes(conn.execute("SELECT xml FROM dte_caf").fetchone()[0]))
+    for folio, xml in conn.execute("SELECT folio, xml FROM dte_outbox ORDER BY folio"):
+        assert b"<F>%d</F>" % folio in xml and verificar_ted(bytes(xml), caf), f"TED inválido en el folio {folio}"
+    print("OK: cada boleta lleva un TED válido para su CAF")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# prueba_envio_boleta.py
+# Arma y firma un sobre EnvioBOLETA con varias boletas y verifica:
+#   - cada Documento tiene un ID propio (F{folio}T{tipo}) y no se repite en el SetDTE
+#   - la firma de cada DTE referencia su Documento y sigue siendo válida dentro del sobre
+#   - la firma del sobre referencia #SetDoc y es válida
+#   - el sobre y los DTE usan el namespace del SII
+# Uso: python prueba_envio_boleta.py [--docs 3]
+# Usa un certificado autofirmado temporal; no se conecta al SII.
+import os
+import argparse
+
+from lxml import etree
+from signxml import XMLVerifier, SignatureConfiguration
+
+from dte_builder import EMISOR, SII_NS, SET_ID_ENVIO, build_boleta_xml, build_envio_boleta, id_documento
+from dte_signer import DS_NS, cargar_certificado_pfx, firmar_xml
+from benchmark_firma_lote import generar_pfx_temporal
+
+RECEPTOR = {
+    "rut": "66666666-6",
+    "razon_social": "CONSUMIDOR FINAL"
+}
+
+ITEMS = [{"NroLinDet": 1, "NmbItem": "Protector Solar SPF50", "QtyItem": 2, "PrcItem": 5000, "MontoItem": 10000}]
+TOTALES = {"MntNeto": 8403, "IVA": 1597, "MntTotal": 10000}
+
+# cada firma se verifica sola: la del sobre es hija directa de EnvioBOLETA
+SOLO_FIRMA_RAIZ = SignatureConfiguration(location="./")
+
+
+def verificar(elemento, certificado, referencia):
+    resultado = XMLVerifier().verify(etree.tostring(elemento), x509_cert=certificado,
+                                     id_attribute="ID", expect_config=SOLO_FIRMA_RAIZ)
+    uri = elemento.find(f"{{{DS_NS}}}Signature//{{{DS_NS}}}Reference").get("URI")
+    assert uri == referencia, (uri, referencia)
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba del sobre EnvioBOLETA con varias boletas firmadas")
+    parser.add_argument("--docs", type=int, default=3)
+    args = parser.parse_args(argv)
+    assert args.docs >= 2, "la prueba necesita al menos dos boletas"
+
+    ruta_pfx = generar_pfx_temporal("prueba")
+    private_key, certificate = cargar_certificado_pfx(ruta_pfx, "prueba")
+    os.remove(ruta_pfx)
+
+    folios = range(1, args.docs + 1)
+    dtes = [
+        firmar_xml(build_boleta_xml(folio, EMISOR, RECEPTOR, ITEMS, TOTALES), private_key, certificate,
+                   reference_uri=f"#{id_documento(folio)}")
+        for folio in folios
+    ]
+    sobre = build_envio_boleta(dtes, EMISOR, "11111111-1", "2014-08-22", 0)
+    sobre_firmado = firmar_xml(sobre, private_key, certificate, reference_uri=f"#{SET_ID_ENVIO}")
+
+    raiz = etree.fromstring(sobre_firmado)
+    assert raiz.tag == f"{{{SII_NS}}}EnvioBOLETA", raiz.tag
+
+    ids = [d.get("ID") for d in raiz.iter(f"{{{SII_NS}}}Documento")]
+    assert ids == [id_documento(folio) for folio in folios], ids
+    assert len(set(ids)) == len(ids), f"IDs repetidos en el sobre: {ids}"
+    print(f"OK: {len(ids)} Documento con ID único: {', '.join(ids)}")
+
+    for dte, id_doc in zip(raiz.iter(f"{{{SII_NS}}}DTE"), ids):
+        verificar(dte, certificate, f"#{id_doc}")
+    print("OK: la firma de cada DTE es válida dentro del sobre")
+
+    verificar(raiz, certificate, f"#{SET_ID_ENVIO}")
+    print("OK: firma del sobre válida (#SetDoc)")
+
+    try:
+        build_envio_boleta([dtes[0], dtes[0]], EMISOR, "11111111-1", "2014-08-22", 0)
+    except ValueError:
+        print("OK: un sobre con el mismo Documento dos veces se rechaza")
+    else:
+        raise AssertionError("se aceptó un sobre con IDs de Documento repetidos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# prueba_excel_stream.py
+# Lee un libro temporal con celdas de error de fórmula (#VALUE!, #N/A, #REF!, #DIV/0!)
+# y verifica que excel_stream las entrega vacías (None / NaN), igual que pd.read_excel,
+# con y sin como_texto.
+# Uso: python prueba_excel_stream.py
+import os
+import tempfile
+
+import pandas as pd
+from openpyxl import Workbook
+
+from excel_stream import iter_filas, leer_excel
+
+ENCABEZADO = ["Código", "Descripción", "Color", "Stock Físico"]
+FILAS = [
+    ["SKU-1", "Protector Solar SPF50", "#VALUE!", 10],
+    ["SKU-2", "#N/A", "Azul", "#DIV/0!"],
+    ["SKU-3", "Bloqueador Kids", "#REF!", 4],
+]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "errores.xlsx")
+        wb = Workbook()
+        ws = wb.active
+        ws.append(ENCABEZADO)
+        for fila in FILAS:
+            ws.append(fila)
+        assert ws["C2"].data_type == "e", ws["C2"].data_type
+        wb.save(ruta)
+
+        filas = [fila for _, fila in iter_filas(ruta)]
+        assert filas == [
+            ("SKU-1", "Protector Solar SPF50", None, 10),
+            ("SKU-2", None, "Azul", None),
+            ("SKU-3", "Bloqueador Kids", None, 4),
+        ], filas
+        print("OK iter_filas: celdas con error -> None")
+
+        texto = [fila for _, fila in iter_filas(ruta, como_texto=True)]
+        assert texto[1] == ("SKU-2", None, "Azul", None), texto[1]
+        print("OK iter_filas(como_texto=True): celdas con error -> None, no '#N/A'")
+
+        df = leer_excel(ruta)
+        referencia = pd.read_excel(ruta)
+        assert df["Color"].isna().tolist() == referencia["Color"].isna().tolist() == [True, False, True]
+        assert df["Stock Físico"].isna().tolist() == referencia["Stock Físico"].isna().tolist()
+        print("OK leer_excel: mismas celdas vacías que pd.read_excel")
+
+
+if __name__ == "__main__":
+    main()
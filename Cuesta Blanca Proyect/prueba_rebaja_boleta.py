@@ -1,4 +1,11 @@
-import pandas as pd
+import os
+import shutil
+import tempfile
+
+from excel_stream import leer_excel
+from price_book import PriceBook
+from inventory_index import IndiceInventario
+from stock_journal import DiarioStock
 
 # =========================
 # CONFIGURACIÓN
@@ -11,15 +18,22 @@ USD_CLP = 950
 MARGIN = 1.80
 IVA = 0.19
 
+# La prueba trabaja sobre una copia de la planilla en una carpeta temporal, con su
+# propio diario de movimientos: nunca toca la planilla ni el stock_journal.db del POS.
+
 
 # =========================
 # CARGAR INVENTARIO
 # =========================
 
-def cargar_inventario():
-    df = pd.read_excel(INVENTARIO, sheet_name=HOJA)
+def cargar_inventario(ruta):
+    # mismo lector que el POS (CuestaBlanca_Proyect.load_inventory)
+    df = leer_excel(ruta, hoja=HOJA)
+    # libro solo en memoria: la prueba no debe pisar el libro del POS (otra versión de márgenes)
+    libro = PriceBook(USD_CLP, {"DETALLE": MARGIN})
+    libro.sincronizar(df["Código"], df["Costo"])
     df["Costo_CLP"] = df["Costo"] * USD_CLP
-    df["Precio_Detalle"] = (df["Costo_CLP"] * MARGIN).round(0)
+    df["Precio_Detalle"] = libro.precios[libro.filas(df["Código"]), libro.columna["DETALLE"]]
     return df
 
 
@@ -27,8 +41,12 @@ def cargar_inventario():
 # GUARDAR INVENTARIO
 # =========================
 
-def guardar_inventario(df):
-    df.to_excel(INVENTARIO, sheet_name=HOJA, index=False)
+def guardar_inventario(df, diario, ruta):
+    # solo se reescribe la planilla cuando el diario acumuló suficientes movimientos
+    if diario.pendientes() < diario.compactar_cada:
+        print("\nRebaja registrada en el diario de stock.")
+        return
+    diario.compactar(df, ruta, HOJA)
     print("\nInventario actualizado guardado correctamente.")
 
 
@@ -62,7 +80,15 @@ def generar_boleta(producto, cantidad):
 # =========================
 
 def main():
-    inv = cargar_inventario()
+    carpeta = tempfile.mkdtemp(prefix="prueba_rebaja_")
+    copia = os.path.join(carpeta, os.path.basename(INVENTARIO))
+    shutil.copy2(INVENTARIO, copia)
+    print(f"Copia de trabajo: {copia}")
+
+    inv = cargar_inventario(copia)
+    indice = IndiceInventario(inv)
+    diario = DiarioStock(os.path.join(carpeta, "stock_journal.db"))
+    diario.cargar(inv, indice, copia)
 
     print("\n====================================")
     print("   PRUEBA: ESCANEO + REBAJA + BOLETA")
@@ -70,15 +96,13 @@ def main():
 
     codigo = input("Escanea el producto: ").strip()
 
-    # Buscar producto
-    fila = inv[inv["Código"] == codigo]
+    # Buscar producto (por SKU o EAN)
+    producto = indice.fila(codigo)
 
-    if fila.empty:
+    if producto is None:
         print(f"\n⚠️ Código no encontrado en inventario: {codigo}")
         return
 
-    producto = fila.iloc[0]
-
     print(f"\nProducto encontrado: {producto['Descripción']}")
     print(f"Stock actual: {producto['Stock Físico']}")
 
@@ -89,15 +113,15 @@ def main():
         print("\n❌ No hay suficiente stock.")
         return
 
-    # Rebajar stock
-    idx = inv[inv["Código"] == codigo].index[0]
-    inv.at[idx, "Stock Físico"] -= cantidad
+    # Rebajar stock (diario primero, luego memoria)
+    diario.registrar([producto["Código"]], [cantidad])
+    indice.rebajar([codigo], [cantidad])
 
     # Generar boleta
     generar_boleta(producto, cantidad)
 
     # Guardar inventario actualizado
-    guardar_inventario(inv)
+    guardar_inventario(inv, diario, copia)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+# prueba_stock_journal.py
+# Diario de stock sobre una planilla temporal (no toca la planilla ni el diario del POS):
+#   - compactar conserva las filas en blanco entre datos (mismas filas que pd.read_excel)
+#   - los movimientos sin compactar no se aplican sobre una planilla reexportada por
+#     fuera (sin marca y con otra huella): cargar() lanza PlanillaCambiada
+#   - aceptar_base() descarta esos movimientos o los deja para la planilla nueva
+# Uso: python prueba_stock_journal.py
+import os
+import tempfile
+
+import pandas as pd
+from openpyxl import Workbook
+
+from excel_stream import leer_excel
+from inventory_index import IndiceInventario
+from stock_journal import DiarioStock, PlanillaCambiada
+
+HOJA = "CUESTA BLANCA"
+ENCABEZADO = ["Código", "Descripción", "Stock Físico"]
+
+
+def escribir_planilla(ruta, filas):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = HOJA
+    ws.append(ENCABEZADO)
+    for fila in filas:
+        ws.append(fila)
+    wb.save(ruta)
+
+
+def cargar(ruta, diario):
+    df = leer_excel(ruta, hoja=HOJA)
+    indice = IndiceInventario(df)
+    aplicados = diario.cargar(df, indice, ruta)
+    return df, indice, aplicados
+
+
+def stock(df, indice, codigo):
+    return df["Stock Físico"].iloc[indice.buscar(codigo)]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "inventario.xlsx")
+        # dos filas en blanco entre los datos y una al final
+        escribir_planilla(ruta, [["SKU-1", "Protector", 10], [None, None, None], [],
+                                 ["SKU-2", "Bloqueador", 5], [None, None, None]])
+        filas_originales = len(pd.read_excel(ruta, sheet_name=HOJA))
+
+        diario = DiarioStock(os.path.join(tmp, "stock_journal.db"))
+        df, indice, _ = cargar(ruta, diario)
+        assert len(df) == filas_originales == 4, (len(df), filas_originales)
+
+        diario.registrar(["SKU-1"], [3])
+        indice.rebajar(["SKU-1"], [3])
+        diario.compactar(df, ruta, HOJA)
+        assert len(pd.read_excel(ruta, sheet_name=HOJA)) == filas_originales
+        print(f"OK compactar conserva las {filas_originales} filas (incluidas las en blanco)")
+
+        df, indice, aplicados = cargar(ruta, diario)
+        assert aplicados == 0 and stock(df, indice, "SKU-1") == 7
+        diario.registrar(["SKU-1", "SKU-2"], [1, 2])
+        print("OK planilla compactada se carga sin reaplicar movimientos")
+
+        # reexportación por fuera: otro stock, sin hoja de marca
+        escribir_planilla(ruta, [["SKU-1", "Protector", 20], ["SKU-2", "Bloqueador", 8]])
+        try:
+            cargar(ruta, diario)
+            raise AssertionError("se aplicaron movimientos sobre una planilla distinta")
+        except PlanillaCambiada as e:
+            assert e.pendientes == 2, e.pendientes
+        print("OK planilla reexportada: los movimientos pendientes no se aplican solos")
+
+        assert diario.aceptar_base(ruta, descartar_pendientes=False) == 0
+        df, indice, aplicados = cargar(ruta, diario)
+        assert aplicados == 2 and stock(df, indice, "SKU-1") == 19 and stock(df, indice, "SKU-2") == 6
+        print("OK aceptar_base(descartar_pendientes=False) rebaja la planilla nueva")
+
+        escribir_planilla(ruta, [["SKU-1", "Protector", 19], ["SKU-2", "Bloqueador", 6]])
+        try:
+            cargar(ruta, diario)
+            raise AssertionError("se aplicaron movimientos sobre una planilla distinta")
+        except PlanillaCambiada:
+            pass
+        assert diario.aceptar_base(ruta, descartar_pendientes=True) == 2
+        df, indice, aplicados = cargar(ruta, diario)
+        assert aplicados == 0 and stock(df, indice, "SKU-1") == 19
+        print("OK aceptar_base(descartar_pendientes=True) deja la planilla nueva tal cual")
+
+
+if __name__ == "__main__":
+    main()
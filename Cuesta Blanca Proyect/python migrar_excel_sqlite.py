@@ -1,6 +1,8 @@
-import pandas as pd
 import sqlite3
 
+from db_connection import conectar
+from excel_stream import iter_bloques
+
 # =========================
 # CONFIG
 # =========================
@@ -16,26 +18,25 @@ MARGIN_MAY2 = 1.35
 
 
 # =========================
-# CARGAR EXCEL
+# CALCULAR COSTOS Y PRECIOS (POR BLOQUE)
 # =========================
 
-df = pd.read_excel(EXCEL_FILE, sheet_name=SHEET)
-
-# Calcular costos y precios
-df["Costo_CLP"] = df["Costo"] * USD_CLP
-df["Precio_Detalle"] = (df["Costo_CLP"] * MARGIN_RETAIL).round(0)
-df["Precio_May1"] = (df["Costo_CLP"] * MARGIN_MAY1).round(0)
-df["Precio_May2"] = (df["Costo_CLP"] * MARGIN_MAY2).round(0)
+def preparar_bloque(df):
+    df["Costo_CLP"] = df["Costo"] * USD_CLP
+    df["Precio_Detalle"] = (df["Costo_CLP"] * MARGIN_RETAIL).round(0)
+    df["Precio_May1"] = (df["Costo_CLP"] * MARGIN_MAY1).round(0)
+    df["Precio_May2"] = (df["Costo_CLP"] * MARGIN_MAY2).round(0)
 
-# Nueva columna
-df["Unidades_Salientes"] = 0
+    # Nueva columna
+    df["Unidades_Salientes"] = 0
+    return df
 
 
 # =========================
 # CREAR BASE DE DATOS
 # =========================
 
-conn = sqlite3.connect(DB_FILE)
+conn = conectar(DB_FILE)
 cur = conn.cursor()
 
 cur.execute("""
@@ -58,31 +59,30 @@ CREATE TABLE IF NOT EXISTS productos (
 )
 """)
 
-# Insertar productos
-for _, row in df.iterrows():
-    cur.execute("""
+# Insertar productos: el Excel se lee por bloques y cada bloque se escribe
+# apenas está listo, así la memoria no crece con el tamaño del libro
+COLUMNAS = [
+    "Código", "Descripción", "Familia", "Unidad de Medida",
+    "Stock Físico", "Costo", "Costo_CLP",
+    "Precio_Detalle", "Precio_May1", "Precio_May2",
+    "Unidades_Salientes", "EAN UA", "Bodega", "Ubicación"
+]
+
+total = 0
+for bloque in iter_bloques(EXCEL_FILE, hoja=SHEET):
+    bloque = preparar_bloque(bloque)
+    # astype(object) + where: NaN -> None y tipos nativos de Python para sqlite3
+    datos = bloque[COLUMNAS].astype(object).where(bloque[COLUMNAS].notna(), None)
+    cur.executemany("""
         INSERT OR REPLACE INTO productos (
             codigo, descripcion, familia, unidad_medida,
             stock_fisico, costo_usd, costo_clp,
             precio_detalle, precio_may1, precio_may2,
             unidades_salientes, ean, bodega, ubicacion
         ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        row["Código"],
-        row["Descripción"],
-        row["Familia"],
-        row["Unidad de Medida"],
-        row["Stock Físico"],
-        row["Costo"],
-        row["Costo_CLP"],
-        row["Precio_Detalle"],
-        row["Precio_May1"],
-        row["Precio_May2"],
-        row["Unidades_Salientes"],
-        row["EAN UA"],
-        row["Bodega"],
-        row["Ubicación"]
-    ))
+    """, datos.itertuples(index=False, name=None))
+    total += len(bloque)
+    print(f"  {total} productos escritos...")
 
 conn.commit()
 conn.close()
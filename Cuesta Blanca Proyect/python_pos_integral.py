@@ -2,7 +2,9 @@ import sqlite3
 import tkinter as tk
 from tkinter import ttk, messagebox
 import datetime
-import pandas as pd
+
+from db_connection import get_connection
+import sap_export
 
 DB_FILE = "inventario.db"
 IVA = 0.19
@@ -13,7 +15,8 @@ IVA = 0.19
 # =========================
 
 def get_conn():
-    return sqlite3.connect(DB_FILE)
+    # conexión compartida (WAL) reutilizada entre consultas; no se cierra por llamada
+    return get_connection(DB_FILE)
 
 
 # =========================
@@ -30,7 +33,6 @@ def get_producto(codigo):
         WHERE codigo = ?
     """, (codigo,))
     row = cur.fetchone()
-    conn.close()
 
     if not row:
         return None
@@ -52,15 +54,18 @@ def get_producto(codigo):
 
 def actualizar_stock(producto_id, cantidad):
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE productos
-        SET stock_fisico = stock_fisico - ?,
-            unidades_salientes = unidades_salientes + ?
-        WHERE id = ?
-    """, (cantidad, cantidad, producto_id))
-    conn.commit()
-    conn.close()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE productos
+            SET stock_fisico = stock_fisico - ?,
+                unidades_salientes = unidades_salientes + ?
+            WHERE id = ?
+        """, (cantidad, cantidad, producto_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 # =========================
@@ -69,58 +74,66 @@ def actualizar_stock(producto_id, cantidad):
 
 def registrar_venta(carrito, neto, iva, total, tipo_doc):
     conn = get_conn()
-    cur = conn.cursor()
-
-    fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # Asegurar estructura de tabla ventas
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ventas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            fecha TEXT,
-            total_neto REAL,
-            total_iva REAL,
-            total_total REAL,
-            tipo_documento TEXT
-        )
-    """)
+    try:
+        cur = conn.cursor()
 
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS ventas_detalle (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            venta_id INTEGER,
-            codigo TEXT,
-            descripcion TEXT,
-            cantidad INTEGER,
-            precio_unitario REAL,
-            total_linea REAL
-        )
-    """)
+        fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    cur.execute("""
-        INSERT INTO ventas (fecha, total_neto, total_iva, total_total, tipo_documento)
-        VALUES (?, ?, ?, ?, ?)
-    """, (fecha, neto, iva, total, tipo_doc))
+        # Asegurar estructura de tabla ventas
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ventas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fecha TEXT,
+                total_neto REAL,
+                total_iva REAL,
+                total_total REAL,
+                tipo_documento TEXT
+            )
+        """)
 
-    venta_id = cur.lastrowid
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ventas_detalle (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                venta_id INTEGER,
+                codigo TEXT,
+                descripcion TEXT,
+                cantidad INTEGER,
+                precio_unitario REAL,
+                total_linea REAL
+            )
+        """)
+
+        # fecha se guarda como 'YYYY-MM-DD HH:MM:SS' (ordenable como texto):
+        # los informes filtran por rango sobre este índice en vez de LIKE
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_detalle_venta ON ventas_detalle(venta_id)")
 
-    for item in carrito:
         cur.execute("""
-            INSERT INTO ventas_detalle (
-                venta_id, codigo, descripcion,
-                cantidad, precio_unitario, total_linea
-            ) VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            venta_id,
-            item["codigo"],
-            item["descripcion"],
-            item["cantidad"],
-            item["precio"],
-            item["total"]
-        ))
+            INSERT INTO ventas (fecha, total_neto, total_iva, total_total, tipo_documento)
+            VALUES (?, ?, ?, ?, ?)
+        """, (fecha, neto, iva, total, tipo_doc))
+
+        venta_id = cur.lastrowid
+
+        for item in carrito:
+            cur.execute("""
+                INSERT INTO ventas_detalle (
+                    venta_id, codigo, descripcion,
+                    cantidad, precio_unitario, total_linea
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                venta_id,
+                item["codigo"],
+                item["descripcion"],
+                item["cantidad"],
+                item["precio"],
+                item["total"]
+            ))
 
-    conn.commit()
-    conn.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
     return venta_id
 
@@ -129,20 +142,25 @@ def registrar_venta(carrito, neto, iva, total, tipo_doc):
 # CAJA DIARIA
 # =========================
 
+def rango_dia(dia=None):
+    """('YYYY-MM-DD', día siguiente) para filtrar ventas.fecha con >= y < (usa idx_ventas_fecha)."""
+    dia = dia or datetime.date.today()
+    return dia.strftime("%Y-%m-%d"), (dia + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+
+
 def caja_diaria():
     conn = get_conn()
     cur = conn.cursor()
 
-    hoy = datetime.datetime.now().strftime("%Y-%m-%d")
+    hoy, manana = rango_dia()
 
     cur.execute("""
         SELECT SUM(total_neto), SUM(total_iva), SUM(total_total)
         FROM ventas
-        WHERE fecha LIKE ?
-    """, (hoy + "%",))
+        WHERE fecha >= ? AND fecha < ?
+    """, (hoy, manana))
 
     row = cur.fetchone()
-    conn.close()
 
     neto = row[0] or 0
     iva = row[1] or 0
@@ -173,7 +191,6 @@ def informe_salidas():
     """)
 
     datos = cur.fetchall()
-    conn.close()
 
     ventana = tk.Toplevel()
     ventana.title("Informe de salidas")
@@ -192,84 +209,18 @@ def informe_salidas():
 # EXPORTACIÓN DIARIA A SAP B1
 # =========================
 
-def exportar_sap_diario():
-    conn = get_conn()
-    cur = conn.cursor()
-
-    hoy = datetime.datetime.now().strftime("%Y-%m-%d")
+def exportar_sap_diario(formato="xlsx"):
+    # Solo las ventas nuevas desde la última exportación (marca en sap_export_ledger),
+    # así exportar dos veces o pasada la medianoche no duplica ni salta documentos.
+    lotes = sap_export.exportar_pendientes(get_conn(), formato=formato)
 
-    # Ventas del día
-    cur.execute("""
-        SELECT id, fecha, total_total, tipo_documento
-        FROM ventas
-        WHERE fecha LIKE ?
-    """, (hoy + "%",))
-    ventas = cur.fetchall()
-
-    # Detalle de esas ventas
-    cur.execute("""
-        SELECT venta_id, codigo, descripcion, cantidad, precio_unitario, total_linea
-        FROM ventas_detalle
-        WHERE venta_id IN (
-            SELECT id FROM ventas WHERE fecha LIKE ?
-        )
-    """, (hoy + "%",))
-    detalle = cur.fetchall()
-
-    conn.close()
-
-    if not ventas:
-        messagebox.showinfo("Exportación SAP", "No hay ventas para exportar hoy.")
+    if not lotes:
+        messagebox.showinfo("Exportación SAP", "No hay ventas nuevas para exportar.")
         return
 
-    df_oinv = pd.DataFrame(columns=[
-        "DocDate", "DocDueDate", "CardCode", "DocTotal",
-        "Comments", "Series", "DocType"
-    ])
-
-    df_inv1 = pd.DataFrame(columns=[
-        "DocEntry", "ItemCode", "Quantity", "Price",
-        "LineTotal", "WhsCode"
-    ])
-
-    for v in ventas:
-        venta_id, fecha, total, tipo_doc = v
-
-        # Serie SAP según tipo de documento
-        if tipo_doc == "BOLETA":
-            serie = 33   # Ejemplo serie boleta
-        else:
-            serie = 30   # Ejemplo serie factura
-
-        df_oinv.loc[len(df_oinv)] = [
-            fecha.split(" ")[0],   # DocDate
-            fecha.split(" ")[0],   # DocDueDate
-            "C99999",              # Cliente genérico
-            total,
-            f"Venta POS ID {venta_id}",
-            serie,
-            "I"                    # Documento de ítems
-        ]
-
-    for d in detalle:
-        venta_id, codigo, desc, qty, price, total_linea = d
-        df_inv1.loc[len(df_inv1)] = [
-            venta_id,
-            codigo,
-            qty,
-            price,
-            total_linea,
-            "01"  # Bodega SAP
-        ]
-
-    fecha_archivo = datetime.datetime.now().strftime("%Y%m%d")
-    archivo = f"export_sap_{fecha_archivo}.xlsx"
-
-    with pd.ExcelWriter(archivo) as writer:
-        df_oinv.to_excel(writer, sheet_name="OINV", index=False)
-        df_inv1.to_excel(writer, sheet_name="INV1", index=False)
-
-    messagebox.showinfo("Exportación completada", f"Archivo generado:\n{archivo}")
+    documentos = sum(d for _, d, _ in lotes)
+    archivos = "\n".join(a for a, _, _ in lotes)
+    messagebox.showinfo("Exportación completada", f"Archivos generados:\n{archivos}\n\nDocumentos: {documentos}")
 
 
 # =========================
@@ -352,6 +303,10 @@ class POS:
         # Hook de cierre: exportar SAP diario al cerrar
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+        # Exportación SAP incremental cada pocos minutos, en segundo plano
+        self.exportador = sap_export.ExportadorPeriodico(DB_FILE)
+        self.exportador.iniciar()
+
     # =========================
     # AGREGAR PRODUCTO
     # =========================
@@ -474,7 +429,6 @@ class POS:
             WHERE descripcion LIKE ?
         """, ("%" + palabra + "%",))
         resultados = cur.fetchall()
-        conn.close()
 
         ventana = tk.Toplevel(self.root)
         ventana.title("Resultados de búsqueda")
@@ -540,7 +494,8 @@ class POS:
     # =========================
 
     def on_close(self):
-        if messagebox.askyesno("Cerrar día", "¿Deseas exportar las ventas del día a SAP antes de cerrar?"):
+        self.exportador.detener()
+        if messagebox.askyesno("Cerrar día", "¿Deseas exportar a SAP las ventas pendientes antes de cerrar?"):
             exportar_sap_diario()
         self.root.destroy()
 
@@ -0,0 +1,302 @@
+import os
+import csv
+import logging
+import threading
+import datetime
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from db_connection import get_connection
+
+# =========================
+# EXPORTACIÓN SAP B1 (OINV / INV1)
+# =========================
+# Una sola consulta (ventas LEFT JOIN ventas_detalle) leída por bloques con
+# fetchmany: cada bloque se transforma con operaciones de columna de pandas y
+# se escribe de inmediato, así la memoria no crece con el volumen del día.
+#   - xlsx: hojas OINV e INV1 (openpyxl en modo write_only)
+#   - csv: formato plano por línea, el mismo que escribe sap_ledger (Vers. 2.0)
+
+TAM_BLOQUE = 5000
+
+SERIE_BOLETA = 33
+SERIE_OTROS = 30
+CLIENTE_GENERICO = "C99999"
+BODEGA_SAP = "01"
+
+OINV_COLS = ["DocDate", "DocDueDate", "CardCode", "DocTotal", "Comments", "Series", "DocType"]
+INV1_COLS = ["DocEntry", "ItemCode", "Quantity", "Price", "LineTotal", "WhsCode"]
+CSV_COLS = ["SaleID", "Fecha", "SKU", "Cantidad", "PrecioUnitario", "Subtotal"]
+
+CONSULTA_COLS = ["venta_id", "fecha", "total", "tipo_documento",
+                 "codigo", "cantidad", "precio_unitario", "total_linea"]
+
+CONSULTA_SQL = """
+    SELECT v.id, v.fecha, v.total_total, v.tipo_documento,
+           d.codigo, d.cantidad, d.precio_unitario, d.total_linea
+    FROM ventas v
+    LEFT JOIN ventas_detalle d ON d.venta_id = v.id
+    WHERE {filtro}
+    ORDER BY v.id, d.id
+"""
+
+
+def construir_oinv(df):
+    """Encabezados OINV de un bloque (una fila por venta, en orden de id)."""
+    ventas = df.drop_duplicates("venta_id")
+    dia = ventas["fecha"].str.slice(0, 10)
+    return pd.DataFrame({
+        "DocDate": dia,
+        "DocDueDate": dia,
+        "CardCode": CLIENTE_GENERICO,
+        "DocTotal": ventas["total"],
+        "Comments": "Venta POS ID " + ventas["venta_id"].astype(str),
+        "Series": np.where(ventas["tipo_documento"].eq("BOLETA"), SERIE_BOLETA, SERIE_OTROS),
+        "DocType": "I",
+    }, columns=OINV_COLS)
+
+
+def construir_inv1(df):
+    """Líneas INV1 de un bloque (las ventas sin detalle no aportan líneas)."""
+    lineas = df[df["codigo"].notna()]
+    return pd.DataFrame({
+        "DocEntry": lineas["venta_id"],
+        "ItemCode": lineas["codigo"],
+        "Quantity": lineas["cantidad"],
+        "Price": lineas["precio_unitario"],
+        "LineTotal": lineas["total_linea"],
+        "WhsCode": BODEGA_SAP,
+    }, columns=INV1_COLS)
+
+
+def _filas(df):
+    # tolist() entrega tipos nativos de Python (openpyxl y csv no reciben numpy)
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+class _EscritorXlsx:
+    def __init__(self, archivo):
+        self.archivo = archivo
+        self.wb = Workbook(write_only=True)
+        self.oinv = self.wb.create_sheet("OINV")
+        self.inv1 = self.wb.create_sheet("INV1")
+        self.oinv.append(OINV_COLS)
+        self.inv1.append(INV1_COLS)
+
+    def escribir(self, df):
+        for fila in _filas(construir_oinv(df)):
+            self.oinv.append(fila)
+        for fila in _filas(construir_inv1(df)):
+            self.inv1.append(fila)
+
+    def cerrar(self):
+        self.wb.save(self.archivo)
+
+
+class _EscritorCsv:
+    def __init__(self, archivo):
+        self.f = open(archivo, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(CSV_COLS)
+
+    def escribir(self, df):
+        lineas = df[df["codigo"].notna()]
+        self.writer.writerows(_filas(lineas[["venta_id", "fecha", "codigo", "cantidad", "precio_unitario", "total_linea"]]))
+
+    def cerrar(self):
+        self.f.close()
+
+
+ESCRITORES = {"xlsx": _EscritorXlsx, "csv": _EscritorCsv}
+
+
+def _exportar(conn, archivo, filtro, params, formato="xlsx", tam_bloque=TAM_BLOQUE):
+    # Un bloque nunca corta una venta: sus líneas pendientes pasan al bloque siguiente.
+    if formato not in ESCRITORES:
+        raise ValueError(f"Formato de exportación no soportado: {formato}")
+
+    cur = conn.cursor()
+    cur.execute(CONSULTA_SQL.format(filtro=filtro), params)
+
+    escritor = None
+    documentos = lineas = 0
+    pendientes = []
+    try:
+        while True:
+            nuevas = cur.fetchmany(tam_bloque)
+            filas = pendientes + nuevas
+            if not filas:
+                break
+            pendientes = []
+            if nuevas:
+                # la última venta puede seguir en el próximo fetchmany: se deja pendiente
+                ultima = filas[-1][0]
+                corte = len(filas)
+                while corte > 0 and filas[corte - 1][0] == ultima:
+                    corte -= 1
+                filas, pendientes = filas[:corte], filas[corte:]
+                if not filas:
+                    continue
+
+            df = pd.DataFrame.from_records(filas, columns=CONSULTA_COLS)
+            if escritor is None:
+                escritor = ESCRITORES[formato](archivo)
+            escritor.escribir(df)
+            documentos += df["venta_id"].nunique()
+            lineas += int(df["codigo"].notna().sum())
+    finally:
+        if escritor is not None:
+            escritor.cerrar()
+
+    return documentos, lineas
+
+
+# =========================
+# EXPORTACIÓN INCREMENTAL (LEDGER)
+# =========================
+# sap_export_ledger guarda por destino el último id de venta exportado.
+# Cada corrida exporta solo las ventas nuevas, en lotes de hasta TAM_LOTE ventas
+# (un archivo por lote). Antes de escribir un lote se anotan en el ledger su último
+# id y su archivo; el archivo se escribe como .part y se renombra antes de avanzar
+# la marca. Si algo falla a mitad de lote, la siguiente corrida rehace el lote
+# anotado (mismo rango de ids, mismo archivo, que se sobrescribe) aunque entretanto
+# hayan entrado ventas nuevas, sin duplicar ni saltar ventas.
+
+TAM_LOTE = 500
+DESTINO_SAP = "sap_b1"
+INTERVALO_EXPORT_S = 5 * 60
+
+LEDGER_SQL = """
+    CREATE TABLE IF NOT EXISTS sap_export_ledger (
+        destino TEXT PRIMARY KEY,
+        ultimo_id INTEGER NOT NULL DEFAULT 0,
+        ultima_fecha TEXT,
+        actualizado TEXT,
+        lote_hasta_id INTEGER,
+        lote_archivo TEXT
+    )
+"""
+
+# columnas agregadas después de la primera versión del ledger (BD ya existentes)
+LEDGER_COLUMNAS_NUEVAS = {
+    "lote_hasta_id": "ALTER TABLE sap_export_ledger ADD COLUMN lote_hasta_id INTEGER",
+    "lote_archivo": "ALTER TABLE sap_export_ledger ADD COLUMN lote_archivo TEXT",
+}
+
+# la exportación manual y la periódica no deben correr a la vez sobre el mismo destino
+_lock_export = threading.Lock()
+
+
+def asegurar_ledger(conn):
+    conn.execute(LEDGER_SQL)
+    existentes = {r[1] for r in conn.execute("PRAGMA table_info(sap_export_ledger)")}
+    for columna, ddl in LEDGER_COLUMNAS_NUEVAS.items():
+        if columna not in existentes:
+            conn.execute(ddl)
+
+
+def marca_agua(conn, destino=DESTINO_SAP):
+    """(ultimo_id, ultima_fecha) exportados para el destino; (0, None) si nunca se exportó."""
+    asegurar_ledger(conn)
+    row = conn.execute(
+        "SELECT ultimo_id, ultima_fecha FROM sap_export_ledger WHERE destino = ?", (destino,)
+    ).fetchone()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def _lote_en_curso(conn, destino):
+    row = conn.execute(
+        "SELECT lote_hasta_id, lote_archivo FROM sap_export_ledger WHERE destino = ? AND lote_hasta_id IS NOT NULL",
+        (destino,)
+    ).fetchone()
+    return row if row else (None, None)
+
+
+def _anotar_lote(conn, destino, hasta_id, archivo):
+    conn.execute("""
+        INSERT INTO sap_export_ledger (destino, lote_hasta_id, lote_archivo, actualizado)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(destino) DO UPDATE SET
+            lote_hasta_id = excluded.lote_hasta_id,
+            lote_archivo = excluded.lote_archivo,
+            actualizado = excluded.actualizado
+    """, (destino, hasta_id, archivo, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    conn.commit()
+
+
+def exportar_pendientes(conn, carpeta=".", destino=DESTINO_SAP, formato="xlsx", lote=TAM_LOTE, max_lotes=None):
+    """
+    Exporta las ventas posteriores a la marca del destino, lote por lote.
+    Devuelve [(archivo, documentos, lineas), ...] (vacía si no hay ventas nuevas).
+    Un lote que quedó a medias en una corrida anterior se rehace primero, con su
+    rango y su archivo (y el formato de ese archivo).
+    """
+    with _lock_export:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ventas'")
+        if cur.fetchone() is None:
+            return []   # todavía no se registró ninguna venta
+
+        ultimo_id, _ = marca_agua(conn, destino)
+        generados = []
+        while max_lotes is None or len(generados) < max_lotes:
+            hasta_id, archivo = _lote_en_curso(conn, destino)
+            if hasta_id is None:
+                cur.execute("SELECT id FROM ventas WHERE id > ? ORDER BY id LIMIT ?", (ultimo_id, lote))
+                ventas = cur.fetchall()
+                if not ventas:
+                    break
+                desde_id, hasta_id = ventas[0][0], ventas[-1][0]
+                archivo = os.path.join(carpeta, f"export_sap_{destino}_{desde_id:08d}_{hasta_id:08d}.{formato}")
+                # rango y archivo quedan anotados antes de escribir: un reintento rehace este mismo lote
+                _anotar_lote(conn, destino, hasta_id, archivo)
+
+            hasta_fecha = cur.execute("SELECT fecha FROM ventas WHERE id = ?", (hasta_id,)).fetchone()[0]
+            tmp = archivo + ".part"
+            formato_archivo = os.path.splitext(archivo)[1].lstrip(".")
+            documentos, lineas = _exportar(conn, tmp, "v.id > ? AND v.id <= ?", (ultimo_id, hasta_id), formato_archivo)
+            os.replace(tmp, archivo)
+
+            # el archivo ya está completo: recién ahora avanza la marca y se cierra el lote
+            conn.execute("""
+                UPDATE sap_export_ledger
+                SET ultimo_id = ?, ultima_fecha = ?, actualizado = ?, lote_hasta_id = NULL, lote_archivo = NULL
+                WHERE destino = ?
+            """, (hasta_id, hasta_fecha, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), destino))
+            conn.commit()
+            logging.info(f"Export {destino}: ventas {ultimo_id + 1}-{hasta_id} -> {archivo}")
+            generados.append((archivo, documentos, lineas))
+            ultimo_id = hasta_id
+        return generados
+
+
+class ExportadorPeriodico:
+    """
+    Hilo en segundo plano que llama a exportar_pendientes cada intervalo_s segundos,
+    con su propia conexión (get_connection es por hilo). No toca la interfaz.
+    """
+
+    def __init__(self, db_file, intervalo_s=INTERVALO_EXPORT_S, **opciones):
+        self.db_file = db_file
+        self.intervalo_s = intervalo_s
+        self.opciones = opciones
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="sap-export", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo_s):
+            try:
+                exportar_pendientes(get_connection(self.db_file), **self.opciones)
+            except Exception:
+                logging.exception("Error en exportación SAP periódica")
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=30)
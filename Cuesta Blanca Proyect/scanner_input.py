@@ -0,0 +1,133 @@
+# scanner_input.py
+# Entrada de la pistola láser en el POS.
+# La pistola "teclea" el código completo en pocos milisegundos y termina con Enter;
+# una persona demora bastante más entre tecla y tecla. DetectorRafagas mide el
+# intervalo entre las teclas del Entry: si el código completo llegó en ráfaga es un
+# escaneo y va a la cola, sin diálogo de cantidad; si no, es digitación manual y
+# sigue el flujo de siempre.
+#
+# ProcesadorEscaneos vacía la cola en un hilo aparte: toma todos los escaneos que
+# ya esperan, suma las lecturas repetidas del mismo código y busca cada producto
+# una sola vez. La UI recoge los resultados con root.after (Tk solo se toca desde
+# su propio hilo), así un escaneo nunca espera a la base de datos ni a un diálogo.
+
+import queue
+import logging
+import threading
+from collections import Counter
+
+MAX_INTERVALO_TECLAS_S = 0.05    # pistolas USB (teclado HID) escriben a menos de 10 ms por tecla
+LARGO_MIN_ESCANEO = 4
+INTERVALO_SONDEO_MS = 30
+
+
+# =========================
+# DETECCIÓN DE RÁFAGAS
+# =========================
+
+class DetectorRafagas:
+    """
+    Sigue las teclas de un campo de texto. Los instantes son en segundos; desde
+    Tk conviene pasar event.time / 1000, que es la hora en que se presionó la
+    tecla y no la hora en que la UI alcanzó a atender el evento.
+    """
+
+    def __init__(self, max_intervalo_s=MAX_INTERVALO_TECLAS_S, largo_min=LARGO_MIN_ESCANEO):
+        self.max_intervalo_s = max_intervalo_s
+        self.largo_min = largo_min
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.teclas = 0
+        self.mayor_intervalo = 0.0      # mayor pausa entre teclas de la lectura en curso
+        self._ultima = None
+
+    def tecla(self, instante):
+        """Registra una tecla imprimible."""
+        if self._ultima is not None:
+            self.mayor_intervalo = max(self.mayor_intervalo, instante - self._ultima)
+        self._ultima = instante
+        self.teclas += 1
+
+    def fin(self, texto, instante):
+        """Enter: True si el texto llegó en ráfaga (escaneo). Deja el detector listo para la siguiente lectura."""
+        es_escaneo = (
+            self._ultima is not None
+            and self.teclas >= self.largo_min
+            and len(texto) >= self.largo_min
+            and max(self.mayor_intervalo, instante - self._ultima) <= self.max_intervalo_s
+        )
+        self.reiniciar()
+        return es_escaneo
+
+
+# =========================
+# COLA DE ESCANEOS
+# =========================
+
+class ProcesadorEscaneos:
+    """
+    Hilo que resuelve los códigos escaneados con buscar(codigo) -> producto o None.
+    Cada lote de resultados es una lista [(codigo, cantidad, producto)] en el orden
+    del primer escaneo de cada código.
+    """
+
+    def __init__(self, buscar):
+        self.buscar = buscar
+        self._entrada = queue.Queue()
+        self._resultados = queue.Queue()
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="escaneos", daemon=True)
+            self._hilo.start()
+
+    def encolar(self, codigo):
+        self._entrada.put(codigo)
+
+    def resultados(self):
+        """Lotes ya procesados (no bloquea; se llama desde el hilo de la UI)."""
+        lotes = []
+        while True:
+            try:
+                lotes.append(self._resultados.get_nowait())
+            except queue.Empty:
+                return lotes
+
+    def procesar(self, codigos):
+        lote = []
+        for codigo, cantidad in Counter(codigos).items():
+            try:
+                producto = self.buscar(codigo)
+            except Exception:
+                logging.exception(f"Error al buscar el código escaneado {codigo}")
+                producto = None
+            lote.append((codigo, cantidad, producto))
+        return lote
+
+    def _bucle(self):
+        while True:
+            codigo = self._entrada.get()
+            if codigo is None:
+                return
+            # lo que se escaneó mientras se buscaba el lote anterior va junto
+            codigos = [codigo]
+            detener = False
+            while True:
+                try:
+                    codigo = self._entrada.get_nowait()
+                except queue.Empty:
+                    break
+                if codigo is None:
+                    detener = True
+                    break
+                codigos.append(codigo)
+            self._resultados.put(self.procesar(codigos))
+            if detener:
+                return
+
+    def detener(self):
+        self._entrada.put(None)
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
@@ -0,0 +1,170 @@
+# sii_stub.py
+# Servidor local que imita los endpoints del SII que usa dte_sender
+# (semilla, token, upload y estado del envío), para probar el envío sin red ni certificado real.
+# No valida firmas: solo entrega semillas/tokens y exige un token vigente al subir
+# y al consultar el estado de un envío.
+#
+# Uso en un script:
+#     with StubSII() as stub:
+#         cliente = ClienteSII(private_key, certificate, urls=stub.urls)
+# Uso manual: python sii_stub.py [puerto]
+
+import sys
+import time
+import itertools
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubSII:
+    def __init__(self, host="127.0.0.1", puerto=0, token_ttl=3600):
+        """
+        - puerto 0: el sistema elige uno libre (ver self.urls)
+        - token_ttl: segundos que el stub acepta cada token
+        """
+        self.token_ttl = token_ttl
+        self.semillas = 0
+        self.tokens = 0
+        self.uploads = []            # [(token, cuerpo_multipart)]
+        self.fallas_upload = 0       # próximos uploads que responden HTTP 503 (simula caída)
+        self.respuestas_perdidas = 0 # próximos uploads recibidos cuya respuesta se pierde (HTTP 504)
+        self.estado_envios = "EPR"   # ESTADO que informa QueryEstUp para envíos conocidos
+        self._tokens_vigentes = {}   # token -> vence (monotonic)
+        self._track_ids = itertools.count(1000)
+        self._enviados = set()
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, cuerpo, status=200):
+                datos = cuerpo.encode("ISO-8859-1")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_GET(self):
+                if self.path.startswith("/DTEWS/CrSeed.jws"):
+                    self._responder(stub._semilla())
+                elif self.path.startswith("/DTEWS/QueryEstUp.jws"):
+                    params = parse_qs(urlparse(self.path).query)
+                    self._responder(stub._estado(params.get("TrackId", [""])[0], params.get("Token", [""])[0]))
+                else:
+                    self._responder("<ERROR/>", 404)
+
+            def do_POST(self):
+                largo = int(self.headers.get("Content-Length", 0))
+                cuerpo = self.rfile.read(largo)
+                if self.path.startswith("/DTEWS/GetTokenFromSeed.jws"):
+                    self._responder(stub._token())
+                elif self.path.startswith("/cgi_dte/UPL/DTEUpload"):
+                    cookie = self.headers.get("Cookie", "")
+                    token = cookie.split("TOKEN=", 1)[1].split(";")[0] if "TOKEN=" in cookie else None
+                    if stub._fallar_upload():
+                        self._responder("<ERROR/>", 503)
+                        return
+                    respuesta = stub._upload(token, cuerpo)
+                    if stub._perder_respuesta():
+                        self._responder("<ERROR/>", 504)
+                    else:
+                        self._responder(respuesta)
+                else:
+                    self._responder("<ERROR/>", 404)
+
+        self.server = ThreadingHTTPServer((host, puerto), Handler)
+        self.server.daemon_threads = True
+        base = f"http://{host}:{self.server.server_address[1]}"
+        self.urls = {
+            "semilla": f"{base}/DTEWS/CrSeed.jws",
+            "token": f"{base}/DTEWS/GetTokenFromSeed.jws",
+            "upload": f"{base}/cgi_dte/UPL/DTEUpload",
+            "estado": f"{base}/DTEWS/QueryEstUp.jws",
+        }
+        self._hilo = None
+
+    # =========================
+    # RESPUESTAS
+    # =========================
+    def _semilla(self):
+        with self._lock:
+            self.semillas += 1
+            n = self.semillas
+        return f"<RESPUESTA><RESP_BODY><SEMILLA>{n:012d}</SEMILLA></RESP_BODY><RESP_HDR><ESTADO>00</ESTADO></RESP_HDR></RESPUESTA>"
+
+    def _token(self):
+        with self._lock:
+            self.tokens += 1
+            token = f"TOKENSTUB{self.tokens:06d}"
+            self._tokens_vigentes[token] = time.monotonic() + self.token_ttl
+        return f"<RESPUESTA><RESP_BODY><TOKEN>{token}</TOKEN></RESP_BODY><RESP_HDR><ESTADO>00</ESTADO></RESP_HDR></RESPUESTA>"
+
+    def _upload(self, token, cuerpo):
+        with self._lock:
+            vence = self._tokens_vigentes.get(token)
+            if vence is None or time.monotonic() >= vence:
+                return "<RECEPCIONDTE><STATUS>5</STATUS></RECEPCIONDTE>"
+            self.uploads.append((token, cuerpo))
+            track_id = next(self._track_ids)
+            self._enviados.add(str(track_id))
+        return f"<RECEPCIONDTE><STATUS>0</STATUS><TRACKID>{track_id}</TRACKID></RECEPCIONDTE>"
+
+    def _fallar_upload(self):
+        with self._lock:
+            if self.fallas_upload > 0:
+                self.fallas_upload -= 1
+                return True
+            return False
+
+    def _perder_respuesta(self):
+        with self._lock:
+            if self.respuestas_perdidas > 0:
+                self.respuestas_perdidas -= 1
+                return True
+            return False
+
+    def _estado(self, track_id, token):
+        with self._lock:
+            vence = self._tokens_vigentes.get(token)
+            if vence is None or time.monotonic() >= vence:
+                estado = "001"
+            else:
+                estado = self.estado_envios if track_id in self._enviados else "-11"
+        return f"<RESPUESTA><RESP_HDR><TRACKID>{track_id}</TRACKID><ESTADO>{estado}</ESTADO></RESP_HDR></RESPUESTA>"
+
+    def revocar_tokens(self):
+        """Simula que el SII invalidó los tokens emitidos (el cliente debe renovar)."""
+        with self._lock:
+            self._tokens_vigentes.clear()
+
+    # =========================
+    # CICLO DE VIDA
+    # =========================
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self.server.serve_forever, name="sii-stub", daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+
+if __name__ == "__main__":
+    puerto = int(sys.argv[1]) if len(sys.argv) > 1 else 8085
+    stub = StubSII(puerto=puerto)
+    print("Stub SII escuchando:")
+    for nombre, url in stub.urls.items():
+        print(f"  {nombre}: {url}")
+    stub.server.serve_forever()
@@ -0,0 +1,192 @@
+# stock_journal.py
+# Diario de movimientos de stock para el POS basado en Excel.
+# Cada venta agrega sus rebajas a la tabla stock_movimientos (un INSERT por línea,
+# una transacción por venta) en vez de reescribir la planilla completa.
+# El stock vigente es la planilla (foto base) más los movimientos posteriores a ella.
+# Cada COMPACTAR_CADA movimientos la planilla se reescribe con el stock al día
+# (archivo temporal + os.replace, nunca queda a medio escribir) y se borran del
+# diario los movimientos ya incluidos.
+#
+# La planilla guarda en la hoja HOJA_MARCA el id del último movimiento que contiene:
+# si el programa se corta entre reescribir la planilla y limpiar el diario, al
+# volver a cargar no se aplica dos veces lo que ya está en la foto.
+# El diario guarda además la huella (SHA-256) de la planilla sobre la que se
+# anotaron sus movimientos: si la planilla se reemplazó por fuera (una
+# reexportación trae otro stock y ninguna marca), los movimientos pendientes no
+# se aplican sobre ella hasta que alguien decida qué hacer (ver aceptar_base).
+# Pensado para un solo POS por planilla (igual que la reescritura anterior).
+
+import os
+import hashlib
+import logging
+import datetime
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from db_connection import get_connection
+
+HOJA_MARCA = "_diario_stock"
+COMPACTAR_CADA = 200
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS stock_movimientos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fecha TEXT NOT NULL,
+    codigo TEXT NOT NULL,
+    delta REAL NOT NULL,
+    motivo TEXT
+);
+CREATE TABLE IF NOT EXISTS stock_base (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    huella TEXT NOT NULL,
+    registrada TEXT NOT NULL
+);
+"""
+
+
+class PlanillaCambiada(Exception):
+    """La planilla no es la foto base del diario y hay movimientos sin compactar."""
+
+    def __init__(self, excel_path, pendientes):
+        super().__init__(
+            f"La planilla {excel_path} cambió fuera del POS y el diario tiene {pendientes} "
+            f"movimientos de stock sin compactar sobre la planilla anterior"
+        )
+        self.excel_path = excel_path
+        self.pendientes = pendientes
+
+
+def huella_planilla(excel_path):
+    """SHA-256 del archivo: cambia con cualquier reescritura, incluida la del POS."""
+    h = hashlib.sha256()
+    with open(excel_path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def leer_marca(excel_path):
+    """Id del último movimiento incluido en la planilla (0 si nunca se compactó)."""
+    wb = load_workbook(excel_path, read_only=True)
+    try:
+        if HOJA_MARCA not in wb.sheetnames:
+            return 0
+        valor = wb[HOJA_MARCA]["A2"].value
+        return int(valor or 0)
+    finally:
+        wb.close()
+
+
+class DiarioStock:
+    def __init__(self, db_path, compactar_cada=COMPACTAR_CADA):
+        self.db_path = db_path
+        self.compactar_cada = compactar_cada
+        self.marca = 0           # último movimiento incluido en la planilla cargada
+        self.ultimo_id = 0       # último movimiento aplicado al DataFrame en memoria
+        get_connection(db_path).executescript(SCHEMA_SQL)
+
+    def cargar(self, df, indice, excel_path):
+        """
+        Aplica al inventario recién leído los movimientos posteriores a la planilla.
+        Devuelve la cantidad de movimientos aplicados.
+        Lanza PlanillaCambiada si la planilla no es la base del diario y quedan
+        movimientos sin compactar (no se aplica nada).
+        """
+        self.marca = leer_marca(excel_path)
+        conn = get_connection(self.db_path)
+        huella = huella_planilla(excel_path)
+        base = conn.execute("SELECT huella FROM stock_base WHERE id = 1").fetchone()
+        if base is None or base[0] != huella:
+            pendientes = conn.execute(
+                "SELECT COUNT(*) FROM stock_movimientos WHERE id > ?", (self.marca,)
+            ).fetchone()[0]
+            # sin base registrada (diario de antes de la huella) se sigue confiando en la marca
+            if pendientes and base is not None:
+                raise PlanillaCambiada(excel_path, pendientes)
+            self._registrar_base(conn, huella)
+            conn.commit()
+
+        filas = conn.execute("""
+            SELECT codigo, SUM(delta), COUNT(*), MAX(id)
+            FROM stock_movimientos WHERE id > ?
+            GROUP BY codigo
+        """, (self.marca,)).fetchall()
+
+        self.ultimo_id = max([self.marca] + [f[3] for f in filas])
+        conocidas = [f for f in filas if indice.buscar(f[0]) is not None]
+        for codigo, *_ in set(filas) - set(conocidas):
+            logging.warning(f"Movimientos de stock de un código que ya no está en la planilla: {codigo}")
+
+        if conocidas:
+            indice.rebajar([f[0] for f in conocidas], [-f[1] for f in conocidas])
+        return sum(f[2] for f in filas)
+
+    def aceptar_base(self, excel_path, descartar_pendientes):
+        """
+        Toma la planilla actual como foto base del diario (después de PlanillaCambiada).
+        - descartar_pendientes=True: la planilla ya trae esas ventas; se borran del diario
+        - descartar_pendientes=False: se aplicarán sobre la planilla nueva en el próximo cargar()
+        Devuelve cuántos movimientos se descartaron.
+        """
+        marca = leer_marca(excel_path)
+        conn = get_connection(self.db_path)
+        try:
+            descartados = 0
+            if descartar_pendientes:
+                descartados = conn.execute("DELETE FROM stock_movimientos WHERE id > ?", (marca,)).rowcount
+            self._registrar_base(conn, huella_planilla(excel_path))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logging.warning(f"Nueva planilla base del diario de stock: {excel_path} "
+                        f"({descartados} movimientos descartados)")
+        return descartados
+
+    @staticmethod
+    def _registrar_base(conn, huella):
+        conn.execute(
+            "INSERT OR REPLACE INTO stock_base (id, huella, registrada) VALUES (1, ?, ?)",
+            (huella, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+
+    def registrar(self, codigos, cantidades, motivo="venta"):
+        """Agrega la rebaja de cada código (una transacción). cantidades > 0 descuentan stock."""
+        fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = get_connection(self.db_path)
+        cur = conn.cursor()
+        for codigo, cantidad in zip(codigos, cantidades):
+            cur.execute(
+                "INSERT INTO stock_movimientos (fecha, codigo, delta, motivo) VALUES (?, ?, ?, ?)",
+                (fecha, str(codigo), -float(cantidad), motivo)
+            )
+            self.ultimo_id = cur.lastrowid
+        conn.commit()
+
+    def pendientes(self):
+        """Movimientos aplicados en memoria que la planilla todavía no contiene."""
+        return get_connection(self.db_path).execute(
+            "SELECT COUNT(*) FROM stock_movimientos WHERE id > ? AND id <= ?", (self.marca, self.ultimo_id)
+        ).fetchone()[0]
+
+    def compactar(self, df, excel_path, hoja):
+        """Reescribe la planilla con el stock en memoria y vacía el diario hasta ese punto."""
+        hasta_id = self.ultimo_id
+        base, ext = os.path.splitext(excel_path)
+        temporal = f"{base}.tmp{ext}"
+        with pd.ExcelWriter(temporal, engine="openpyxl") as writer:
+            df.to_excel(writer, sheet_name=hoja, index=False)
+            pd.DataFrame({"ultimo_movimiento": [hasta_id]}).to_excel(writer, sheet_name=HOJA_MARCA, index=False)
+        os.replace(temporal, excel_path)
+        self.marca = hasta_id
+
+        # la planilla ya contiene estos movimientos (y lo dice su marca) y pasa a ser la base
+        conn = get_connection(self.db_path)
+        try:
+            conn.execute("DELETE FROM stock_movimientos WHERE id <= ?", (hasta_id,))
+            self._registrar_base(conn, huella_planilla(excel_path))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
@@ -1,7 +1,13 @@
 # test_envio_sii.py
+# Uso: python test_envio_sii.py [--stub]
+#   --stub: envía contra el stub local del SII (sii_stub.py) en vez de palena.sii.cl
+import sys
+
 from dte_signer import cargar_certificado_pfx, firmar_xml
 from dte_builder import build_boleta_xml
-from dte_sender import obtener_semilla, firmar_semilla, obtener_token, enviar_dte
+from dte_sender import ClienteSII
+
+USAR_STUB = "--stub" in sys.argv
 
 # =========================
 # RUTA Y CLAVE DEL CERTIFICADO
@@ -73,24 +79,29 @@ private_key, certificate = cargar_certificado_pfx(ruta_pfx, password)
 xml_firmado = firmar_xml(xml_sin_firma, private_key, certificate)
 
 # =========================
-# 4) OBTENER SEMILLA
+# 4) SESIÓN CON EL SII (semilla -> token, reutilizado entre envíos)
 # =========================
-semilla = obtener_semilla()
-print("Semilla:", semilla)
+stub = None
+urls = None
+if USAR_STUB:
+    from sii_stub import StubSII
+    stub = StubSII().iniciar()
+    urls = stub.urls
 
-# =========================
-# 5) FIRMAR SEMILLA
-# =========================
-semilla_firmada = firmar_semilla(semilla, private_key, certificate)
+try:
+    with ClienteSII(private_key, certificate, urls=urls) as cliente:
+        print("TOKEN:", cliente.token())
 
-# =========================
-# 6) OBTENER TOKEN
-# =========================
-token = obtener_token(semilla_firmada)
-print("TOKEN:", token)
+        # =========================
+        # 5) ENVIAR DTE
+        # =========================
+        track_id = cliente.enviar_dte(xml_firmado)
+        print("TRACK ID:", track_id)
 
-# =========================
-# 7) ENVIAR DTE
-# =========================
-track_id = enviar_dte(xml_firmado, token)
-print("TRACK ID:", track_id)
\ No newline at end of file
+        # Un segundo envío reutiliza el token y la conexión
+        track_id = cliente.enviar_dte(xml_firmado)
+        print("TRACK ID (2):", track_id)
+finally:
+    if stub is not None:
+        print(f"Stub: {stub.semillas} semilla(s), {stub.tokens} token(s), {len(stub.uploads)} envío(s)")
+        stub.detener()
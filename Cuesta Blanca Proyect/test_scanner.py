@@ -1,14 +1,40 @@
-print("\n====================================")
-print("   PRUEBA DE PISTOLA LÁSER")
-print("   Escanea un producto ahora")
-print("   (Escribe SALIR para terminar)")
-print("====================================\n")
+import tkinter as tk
 
-while True:
-    codigo = input("Escanea: ").strip()
+from scanner_input import DetectorRafagas, MAX_INTERVALO_TECLAS_S
 
-    if codigo.upper() == "SALIR":
-        print("\nPrueba finalizada.")
-        break
+# =========================
+# PRUEBA DE PISTOLA LÁSER
+# =========================
+# Muestra cada lectura, si el POS la tomaría como escaneo (ráfaga) o como
+# digitación manual, y la mayor pausa entre teclas. Sirve para ajustar
+# MAX_INTERVALO_TECLAS_S en scanner_input.py a la pistola de la caja.
 
-    print(f"Leído: [{codigo}]")
\ No newline at end of file
+detector = DetectorRafagas()
+
+
+def tecla(event):
+    if event.char and event.char.isprintable():
+        detector.tecla(event.time / 1000)
+
+
+def enter(event):
+    codigo = entry.get().strip()
+    entry.delete(0, tk.END)
+    pausa_ms = detector.mayor_intervalo * 1000
+    teclas = detector.teclas
+    tipo = "ESCANEO" if detector.fin(codigo, event.time / 1000) else "MANUAL"
+    lecturas.insert(0, f"{tipo:<8} [{codigo}]  {teclas} teclas, pausa máx. {pausa_ms:.0f} ms")
+    return "break"
+
+
+root = tk.Tk()
+root.title("Prueba de pistola láser")
+tk.Label(root, text=f"Escanea un producto (ráfaga = pausas de hasta {MAX_INTERVALO_TECLAS_S * 1000:.0f} ms)").pack(padx=10, pady=5)
+entry = tk.Entry(root, width=40)
+entry.pack(padx=10)
+entry.bind("<Key>", tecla)
+entry.bind("<Return>", enter)
+entry.focus_set()
+lecturas = tk.Listbox(root, width=70, height=15, font=("Consolas", 10))
+lecturas.pack(padx=10, pady=10)
+root.mainloop()